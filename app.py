@@ -1,8 +1,22 @@
 import os
+import json
+import time
+import shutil
+import tempfile
 import logging
-from flask import Flask, request, render_template
-from config import UPLOAD_FOLDER, LOG_FILE
+import threading
+from flask import Flask, request, render_template, jsonify, Response
+from config import UPLOAD_FOLDER, LOG_FILE, RBD_BACKEND, RBD_COPY_QUEUE_DEPTH, RBD_COPY_WORKERS, PROGRESS_STREAM_INTERVAL, \
+    PROVISION_CONCURRENCY, COPY_CONCURRENCY, COPY_PER_SOURCE_POOL, COPY_PER_TARGET_POOL, DISTRIBUTED, \
+    WORK_POLL_INTERVAL
 from migration_manager import MigrationManager
+from scheduler import MigrationScheduler
+from job_manager import JobManager, ACTIVE_STATUSES
+from progress import ProgressTracker
+from metrics import REGISTRY
+from throttle import get_throttle
+from work_queue import get_work_queue, TERMINAL_STATUSES
+from queue_worker import QueueWorker
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -11,33 +25,61 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 logging.basicConfig(filename=LOG_FILE, level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-task_status = {}
+job_manager = JobManager()
+progress_tracker = ProgressTracker()
+
+
+
+def _abandon_interrupted_jobs(job_ids):
+    """
+    本 Pod 重启前分发的任务已无人汇总：取消尚未领取的工作项，等其他 Pod 上执行中的虚拟机结束后
+    删除任务的工作项与规格（含认证信息），其他 Pod 随后释放该任务的连接与调度器
+    """
+    for job_id in job_ids:
+        work_queue.cancel_job(job_id)
+        logging.warning(f"[MIGRATION] 任务 {job_id} 因本 Pod 重启而中断，已取消未开始的虚拟机")
+    pending = set(job_ids)
+    while pending:
+        for job_id in list(pending):
+            if all(item['status'] in TERMINAL_STATUSES for item in work_queue.job_items(job_id)):
+                work_queue.finish_job(job_id)
+                pending.discard(job_id)
+                logging.info(f"[MIGRATION] 已清理中断任务 {job_id} 的工作队列记录")
+        if pending:
+            time.sleep(WORK_POLL_INTERVAL)
+
+
+# 多副本模式：每个 Pod 都从共享队列领取虚拟机执行
+if DISTRIBUTED:
+    work_queue = get_work_queue()
+    QueueWorker(work_queue, progress_tracker).start()
+    orphaned_jobs = [job_id for job_id in job_manager.interrupted() if work_queue.job_spec(job_id) is not None]
+    if orphaned_jobs:
+        threading.Thread(target=_abandon_interrupted_jobs, args=(orphaned_jobs,), name='orphaned-jobs',
+                         daemon=True).start()
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 
-def run_migration_task(request):
-    # 生成任务唯一标识
+def _prepare_migration(request, job_folder):
+    """
+    把上传的迁移清单与 ceph 配置保存到 job_folder，并按表单参数创建 MigrationManager
+    :return: (清单文件路径, MigrationManager, 并发数, 迁移方式, 任务参数)
+    """
     excel_file = request.files['excel_file']
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], excel_file.filename)
+    file_path = os.path.join(job_folder, excel_file.filename)
     excel_file.save(file_path)
-    task_id = hash(excel_file.filename + request.form.get('source_auth_url'))
-    if task_id in task_status and task_status[task_id] == 'running':
-        logging.warning(f"[MIGRATION] 任务 {task_id} 正在运行，避免重复执行。")
-        return
 
-    task_status[task_id] = 'running'
-    logging.info("[MIGRATION] 开始执行迁移任务")
     source_ceph_conf_file = request.files['source_ceph_conf_file']
     if source_ceph_conf_file:
-        source_ceph_conf_path = os.path.join(app.config['UPLOAD_FOLDER'], 'source_ceph.conf')
+        source_ceph_conf_path = os.path.join(job_folder, 'source_ceph.conf')
         source_ceph_conf_file.save(source_ceph_conf_path)
 
     target_ceph_conf_file = request.files['target_ceph_conf_file']
     if target_ceph_conf_file:
-        target_ceph_conf_path = os.path.join(app.config['UPLOAD_FOLDER'], 'target_ceph.conf')
+        target_ceph_conf_path = os.path.join(job_folder, 'target_ceph.conf')
         target_ceph_conf_file.save(target_ceph_conf_path)
 
     source_auth_args = {
@@ -45,6 +87,7 @@ def run_migration_task(request):
         'project_name': request.form.get('source_project_name'),
         'username': request.form.get('source_username'),
         'password': request.form.get('source_password'),
+        'password_ref': request.form.get('source_password_ref') or None,
         'user_domain_name': request.form.get('source_user_domain_name'),
         'project_domain_name': request.form.get('source_project_domain_name')
     }
@@ -54,6 +97,7 @@ def run_migration_task(request):
         'project_name': request.form.get('target_project_name'),
         'username': request.form.get('target_username'),
         'password': request.form.get('target_password'),
+        'password_ref': request.form.get('target_password_ref') or None,
         'user_domain_name': request.form.get('target_user_domain_name'),
         'project_domain_name': request.form.get('target_project_domain_name')
     }
@@ -64,25 +108,163 @@ def run_migration_task(request):
     target_ceph_pool = request.form.get('target_ceph_pool')
     concurrency = int(request.form.get('concurrency', 1))
     migration_method = request.form.get('migration_method', 'snapshot') 
+    rbd_backend = request.form.get('rbd_backend', RBD_BACKEND)
+    queue_depth = int(request.form.get('queue_depth', RBD_COPY_QUEUE_DEPTH))
+    copy_workers = int(request.form.get('copy_workers', RBD_COPY_WORKERS))
+    provision_concurrency = int(request.form.get('provision_concurrency', PROVISION_CONCURRENCY))
+    copy_concurrency = int(request.form.get('copy_concurrency', COPY_CONCURRENCY))
+    copy_per_source_pool = int(request.form.get('copy_per_source_pool', COPY_PER_SOURCE_POOL))
+    copy_per_target_pool = int(request.form.get('copy_per_target_pool', COPY_PER_TARGET_POOL))
 
-    try:
-        migration_manager = MigrationManager(source_auth_args, target_auth_args, source_ceph_conf, source_ceph_pool, target_ceph_conf, target_ceph_pool)
-        migration_manager.batch_migrate_from_excel(file_path,concurrency, migration_method)
-        task_status[task_id] = 'completed'
-    except Exception as e:
-        logging.error(f"[MIGRATION] 执行迁移任务时出现错误: {e}")
-        task_status[task_id] = 'error'
+    wire_transfer = request.form.get('wire_transfer') or None
+
+    scheduler = MigrationScheduler(provision_concurrency, copy_concurrency, copy_per_source_pool, copy_per_target_pool)
+    migration_manager = MigrationManager(source_auth_args, target_auth_args, source_ceph_conf, source_ceph_pool, target_ceph_conf, target_ceph_pool, rbd_backend, queue_depth, copy_workers, scheduler, wire_transfer)
+    params = {
+        'excel_file': excel_file.filename,
+        'source_auth_url': source_auth_args['auth_url'],
+        'target_auth_url': target_auth_args['auth_url'],
+        'source_ceph_pool': source_ceph_pool,
+        'target_ceph_pool': target_ceph_pool,
+        'concurrency': concurrency,
+        'provision_concurrency': provision_concurrency,
+        'copy_concurrency': copy_concurrency,
+        'copy_per_source_pool': copy_per_source_pool,
+        'copy_per_target_pool': copy_per_target_pool,
+        'migration_method': migration_method,
+        'rbd_backend': rbd_backend,
+        'wire_transfer': wire_transfer,
+    }
+    return file_path, migration_manager, concurrency, migration_method, params
+
+
+def run_migration_task(request):
+    """
+    保存上传文件并解析参数，将迁移任务提交到后台队列
+    :return: (任务 ID, 提示信息)
+    """
+    excel_file = request.files['excel_file']
+    dedup_key = f"{excel_file.filename}|{request.form.get('source_auth_url')}"
+    active_job = job_manager.find_active(dedup_key)
+    if active_job:
+        logging.warning(f"[MIGRATION] 任务 {active_job} 正在运行，避免重复执行。")
+        return active_job, "相同的迁移任务正在运行"
+
+    job_id = job_manager.new_job_id()
+    # 每个任务使用独立目录，避免排队中的任务的 ceph 配置被后续上传覆盖
+    job_folder = os.path.join(app.config['UPLOAD_FOLDER'], job_id)
+    os.makedirs(job_folder)
+    file_path, migration_manager, concurrency, migration_method, params = _prepare_migration(request, job_folder)
+    migration_manager.job_id = job_id
+    job_progress = progress_tracker.job(job_id)
+
+    def run(cancel_event):
+        # 每个任务按表单参数使用自己的调度器，任务结束后回收它的复制线程
+        try:
+            if DISTRIBUTED:
+                return migration_manager.distribute_batch_from_file(job_id, file_path, migration_method, work_queue,
+                                                                    cancel_event, job_progress)
+            return migration_manager.batch_migrate_from_file(file_path, concurrency, migration_method, cancel_event,
+                                                             job_progress)
+        finally:
+            migration_manager.scheduler.shutdown()
+
+    job_manager.submit(job_id, excel_file.filename, run, params, dedup_key)
+    return job_id, "迁移任务已提交"
 
 
 @app.route('/migrate', methods=['POST'])
 def migrate():
     try:
-        run_migration_task(request)
-        logging.info("[MIGRATION] 迁移任务已完成")
-        return "迁移完成"
+        job_id, message = run_migration_task(request)
+        return jsonify({"job_id": job_id, "message": f"{message}，任务 ID: {job_id}"})
     except Exception as e:
         logging.error(f"[MIGRATION] 启动迁移任务时出现错误: {e}")
-        return "启动迁移任务时出现错误"
+        return jsonify({"message": f"启动迁移任务时出现错误: {e}"}), 500
+
+
+@app.route('/plan', methods=['POST'])
+def plan():
+    """预演：参数与 /migrate 相同，同步返回每台虚拟机与整个批次的数据量和预计耗时，不创建任务"""
+    plan_folder = tempfile.mkdtemp(prefix='plan-', dir=app.config['UPLOAD_FOLDER'])
+    migration_manager = None
+    try:
+        file_path, migration_manager, concurrency, migration_method, _ = _prepare_migration(request, plan_folder)
+        return jsonify(migration_manager.plan_batch_from_file(file_path, concurrency, migration_method))
+    except Exception as e:
+        logging.error(f"[MIGRATION] 预演迁移任务时出现错误: {e}")
+        return jsonify({"message": f"预演迁移任务时出现错误: {e}"}), 500
+    finally:
+        if migration_manager is not None:
+            migration_manager.scheduler.shutdown()
+        shutil.rmtree(plan_folder, ignore_errors=True)
+
+
+@app.route('/jobs')
+def list_jobs():
+    return jsonify(job_manager.list())
+
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"message": "任务不存在"}), 404
+    return jsonify(job)
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if job_manager.get(job_id) is None:
+        return jsonify({"message": "任务不存在"}), 404
+    cancelled = job_manager.cancel(job_id)
+    # 任务可能由其他 Pod 提交，取消记在共享队列中，由提交任务的 Pod 与各工作 Pod 读取
+    if DISTRIBUTED:
+        cancelled = work_queue.cancel_job(job_id) or cancelled
+    if not cancelled:
+        return jsonify({"message": "任务已结束，无法取消"}), 409
+    return jsonify({"message": "已请求取消任务"})
+
+
+def _job_progress(job):
+    job_progress = progress_tracker.get(job['id'])
+    data = job_progress.to_dict() if job_progress else {'job_id': job['id'], 'vms': []}
+    data['status'] = job['status']
+    return data
+
+
+@app.route('/jobs/<job_id>/progress')
+def get_job_progress(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"message": "任务不存在"}), 404
+    return jsonify(_job_progress(job))
+
+
+@app.route('/jobs/<job_id>/progress/stream')
+def stream_job_progress(job_id):
+    """以 server-sent events 推送任务进度，任务结束后关闭"""
+    if job_manager.get(job_id) is None:
+        return jsonify({"message": "任务不存在"}), 404
+
+    def events():
+        while True:
+            job = job_manager.get(job_id)
+            yield f"data: {json.dumps(_job_progress(job), ensure_ascii=False)}\n\n"
+            if job['status'] not in ACTIVE_STATUSES:
+                break
+            time.sleep(PROGRESS_STREAM_INTERVAL)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/queue')
+def get_work_queue_status():
+    """多副本模式下共享队列中各状态的工作项数量与各 Pod 持有的租约数"""
+    if not DISTRIBUTED:
+        return jsonify({"message": "未启用多副本模式"}), 404
+    return jsonify(work_queue.status())
 
 
 @app.route('/logs')
@@ -97,6 +279,32 @@ def get_logs():
         return "日志文件未找到。"
 
 
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/throttle', methods=['GET'])
+def get_throttle_limits():
+    return jsonify(get_throttle().status())
+
+
+@app.route('/throttle', methods=['PUT'])
+def set_throttle_limits():
+    """请求体示例: {"source": {"bytes": 209715200, "ops": null}, "volume": {"bytes": 52428800}}"""
+    try:
+        get_throttle().set_limits(request.get_json(force=True))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify(get_throttle().status())
+
+
+@app.route('/throttle', methods=['DELETE'])
+def clear_throttle_limits():
+    get_throttle().clear_overrides()
+    return jsonify(get_throttle().status())
+
+
 # 新增 /healthz 端点
 @app.route('/healthz')
 def healthz():
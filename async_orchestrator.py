@@ -0,0 +1,344 @@
+"""
+asyncio 编排：批量迁移时每台虚拟机是一个协程而不是一个线程，发现、创建与状态等待阶段不占用线程，
+同时在途的虚拟机数量可以到上千台。
+- 阻塞的 SDK 调用放到有界的 API 线程池（config.ASYNC_API_WORKERS），共享 connection_pool 的会话与连接；
+- 虚拟机状态等待挂在 ServerWaiter 的 Future 上，卷状态等待用 asyncio.sleep 轮询；
+- 卷复制提交到 MigrationScheduler 的复制队列后等待其 Future，预拷贝的多轮同步放到有界线程池
+  （config.ASYNC_BLOCKING_WORKERS）执行。
+创建阶段的并发仍受 scheduler.provision_limit 限制，复制受 scheduler 的复制与存储池限额限制。
+"""
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import logging
+import time
+import config
+import connection_pool
+from batch_input import BatchInput
+from batch_order import BatchOrder
+from ceph_utils import CephUtils
+from incremental_sync import IncrementalSync
+from metrics import ACTIVE_WORKERS, POLL_WAIT_SECONDS
+from openstack_utils import OpenStackUtils, ProvisionedVm, MANAGE_FAILURES
+from server_waiter import get_server_waiter
+
+SERVER_ACTIVE_STATUSES = ['ACTIVE', 'ERROR', 'PAUSED', 'SUSPENDED']
+SERVER_STOPPED_STATUSES = ['SHUTOFF', 'ERROR', 'PAUSED', 'SUSPENDED']
+
+
+class ApiDispatcher:
+    """
+    按虚拟机在批次中的顺序分派阻塞 SDK 调用：排在前面的虚拟机的调用先执行，
+    上千台虚拟机同时在途时不会每一步都等所有虚拟机走完，前面的虚拟机尽早进入复制阶段
+    """
+
+    def __init__(self, executor, workers):
+        self.executor = executor
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(workers)]
+
+    async def call(self, rank, fn):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rank, next(self._order), fn, future))
+        return await future
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, fn, future = await self._queue.get()
+            try:
+                result = await loop.run_in_executor(self.executor, fn)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    def close(self):
+        for worker in self._workers:
+            worker.cancel()
+
+
+class AsyncOpenStack:
+    """
+    OpenStackUtils 的协程版本，请求构造与清理复用 OpenStackUtils 的方法
+    :param utils: OpenStackUtils
+    :param dispatcher: ApiDispatcher
+    :param rank: 虚拟机在批次中的顺序，越小的调用越先执行
+    """
+
+    def __init__(self, utils, dispatcher, rank=0):
+        self.utils = utils
+        self.conn = utils.conn
+        self.dispatcher = dispatcher
+        self.rank = rank
+
+    async def call(self, fn, *args, **kwargs):
+        return await self.dispatcher.call(self.rank, functools.partial(fn, *args, **kwargs))
+
+    async def wait_server(self, server_id, statuses, timeout):
+        """:raise ServerWaitTimeout: 超时"""
+        future = await self.call(get_server_waiter(self.conn).watch, server_id, statuses, timeout)
+        return await asyncio.wrap_future(future)
+
+    async def wait_volume(self, volume, failures, timeout):
+        """轮询卷状态直到 available，无变化时按倍数放大间隔"""
+        deadline = time.monotonic() + timeout
+        interval = config.SERVER_WAIT_MIN_INTERVAL
+        while True:
+            volume = await self.call(self.conn.block_storage.get_volume, volume.id)
+            if volume.status == 'available':
+                return volume
+            if volume.status in failures:
+                raise RuntimeError(f"卷 {volume.id} 状态为 {volume.status}")
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"等待卷 {volume.id} 可用超时，状态为 {volume.status}")
+            await asyncio.sleep(interval)
+            interval = min(interval * 1.5, config.SERVER_WAIT_MAX_INTERVAL)
+
+    async def stop_vm(self, vm_id):
+        """关闭虚拟机，虚拟机已关闭或成功关闭返回 True"""
+        try:
+            server = await self.call(self.conn.compute.get_server, vm_id)
+            if server.status != 'ACTIVE':
+                logging.info(f"[MIGRATION]虚拟机 {vm_id} 当前状态为 {server.status}，无需关闭。")
+                return True
+            await self.call(self.conn.compute.stop_server, vm_id)
+            logging.info(f"[MIGRATION]正在关闭虚拟机 {vm_id}...")
+            with POLL_WAIT_SECONDS.time(loop='stop_vm'):
+                server = await self.wait_server(vm_id, SERVER_STOPPED_STATUSES, config.SERVER_STOP_TIMEOUT)
+            if server.status == 'SHUTOFF':
+                logging.info(f"[MIGRATION]虚拟机 {vm_id} 已成功关闭。")
+                return True
+            logging.error(f"[MIGRATION]虚拟机 {vm_id} 关闭失败，状态为 {server.status}。")
+            return False
+        except Exception as e:
+            logging.error(f"[MIGRATION]关闭虚拟机 {vm_id} 时出错: {e}")
+            return False
+
+    async def create_blank_volume(self, name, size, bootable=False, image=None, metadata=None):
+        volume = await self.call(self.utils.request_blank_volume, name, size, metadata)
+        volume = await self.wait_volume(volume, ['error'], config.VOLUME_CREATE_TIMEOUT)
+        await self.call(self.utils.finish_blank_volume, volume, bootable, image)
+        return volume
+
+    async def manage_volume(self, pool, image_name, name, bootable=False, image=None):
+        volume = await self.call(self.utils.request_manage_volume, pool, image_name, name, bootable)
+        volume = await self.wait_volume(volume, MANAGE_FAILURES, config.VOLUME_CREATE_TIMEOUT)
+        await self.call(self.utils.finish_managed_volume, volume, pool, image_name, bootable, image)
+        return volume
+
+    async def manage_volumes(self, plan, images):
+        """见 OpenStackUtils.manage_volumes"""
+        target_image = await self.call(self.utils._target_image, plan)
+        results = await asyncio.gather(
+            *(self.manage_volume(pool, image_name, name or f"{plan.vm_name}_{index}", index == 0, target_image)
+              for index, (pool, image_name, name) in enumerate(images)),
+            return_exceptions=True)
+        errors = [str(result) for result in results if isinstance(result, Exception)]
+        if errors:
+            raise RuntimeError(f"纳管目标镜像失败: {'; '.join(errors)}")
+        return results
+
+    async def create_vm_in_target(self, plan, target_az, volumes=None):
+        """见 OpenStackUtils.create_vm_in_target，端口、卷与 flavor 并发准备"""
+        utils = self.utils
+        vm_name = plan.vm_name
+        ports = []
+        managed = volumes is not None
+        volumes = list(volumes) if managed else []
+        try:
+            target_network = await self.call(utils.ensure_network_exists, plan.network)
+            if not target_network:
+                logging.warning(f"[MIGRATION] 目标环境中没有与虚拟机 {vm_name} 匹配的网络，跳过虚拟机创建。")
+                return None
+            target_image = await self.call(utils._target_image, plan)
+            volume_specs = [] if managed else utils._target_volume_specs(plan)
+            flavor, *results = await asyncio.gather(
+                self.call(utils.ensure_flavor_exists, plan.server_info.get('flavor', {})),
+                *(self.create_blank_volume(name, size, bootable, target_image, tags)
+                  for name, size, bootable, tags in volume_specs),
+                *(self.call(utils.create_port_with_ip, info['network_id'], info['subnet_id'], info['ipaddr'], vm_name)
+                  for info in target_network),
+                return_exceptions=True)
+            created_volumes, created_ports = results[:len(volume_specs)], results[len(volume_specs):]
+            ports = [port for port in created_ports if port and not isinstance(port, Exception)]
+            errors = [str(volume) for volume in created_volumes if isinstance(volume, Exception)]
+            volumes.extend(volume for volume in created_volumes if not isinstance(volume, Exception))
+            if errors:
+                raise RuntimeError(f"创建目标卷失败: {'; '.join(errors)}")
+            if isinstance(flavor, Exception):
+                raise flavor
+            if not flavor:
+                raise RuntimeError("无法在目标环境中创建 flavor")
+            server = await self.call(self.conn.compute.create_server,
+                                     **utils.server_request(vm_name, target_az, flavor, target_network, ports, volumes))
+        except Exception as e:
+            logging.error(f"[MIGRATION] 在目标 OpenStack 环境中创建虚拟机时出现错误，目标可用区: {target_az}: {e}")
+            await self.call(utils._cleanup, ports, [] if managed else volumes)
+            return None
+
+        try:
+            with POLL_WAIT_SECONDS.time(loop='create_vm'):
+                server = await self.wait_server(server.id, SERVER_ACTIVE_STATUSES, config.SERVER_CREATE_TIMEOUT)
+            if server.status != 'ACTIVE':
+                logging.error(f"[MIGRATION] 虚拟机 {vm_name} 创建失败，状态为 {server.status}，目标可用区: {target_az}。")
+                return None
+            logging.info(f"[MIGRATION] 虚拟机 {vm_name} 已在目标 OpenStack 环境中创建完成，目标可用区: {target_az}。")
+            if not await self.stop_vm(server.id):
+                return None
+            return ProvisionedVm(server, volumes)
+        except Exception as e:
+            logging.error(f"[MIGRATION] 等待目标虚拟机 {vm_name} 创建完成时出现错误，目标可用区: {target_az}: {e}")
+            return None
+
+
+class AsyncBatchRunner:
+    """
+    以 asyncio 执行 MigrationManager 的批量迁移，流程与 MigrationManager.migrate_vm_cross_openstack_ceph 一致
+    :param manager: MigrationManager，提供认证信息、ceph 配置、目标端缓存与调度器
+    """
+
+    def __init__(self, manager, api_workers=None, blocking_workers=None):
+        self.manager = manager
+        self.api_workers = api_workers or config.ASYNC_API_WORKERS
+        self.blocking_workers = blocking_workers or config.ASYNC_BLOCKING_WORKERS
+
+    def run(self, file_path, concurrency, migration_method, cancel_event=None, progress=None):
+        """参数与返回值见 MigrationManager.batch_migrate_from_file，concurrency 为同时在途的虚拟机数量"""
+        return asyncio.run(self._run(file_path, concurrency, migration_method, cancel_event, progress))
+
+    async def _run(self, file_path, concurrency, migration_method, cancel_event, progress):
+        manager = self.manager
+        connection_pool.reserve(manager.source_auth_args, self.api_workers)
+        connection_pool.reserve(manager.target_auth_args, self.api_workers)
+        batch = BatchInput(file_path, migration_method, manager.target_ceph_pool)
+        failures = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.api_workers, thread_name_prefix='openstack-api') as api, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=self.blocking_workers,
+                                                      thread_name_prefix='ceph-blocking') as blocking:
+            self._api = ApiDispatcher(api, self.api_workers)
+            self._blocking = blocking
+            self._provision_slots = asyncio.Semaphore(manager.scheduler.provision_limit)
+            loop = asyncio.get_running_loop()
+            try:
+                # 预检一次加载源端资源，整个清单的计划放入 BatchOrder 后按其顺序依次启动
+                plans = await loop.run_in_executor(api, lambda: list(manager.iter_plans(batch, failures, progress)))
+            except FileNotFoundError:
+                logging.error(f"[MIGRATION] 未找到迁移清单文件: {file_path}")
+                raise
+            except Exception as e:
+                logging.error(f"[MIGRATION] 读取迁移清单时出现错误: {e}")
+                raise
+            if failures:
+                logging.warning(f"[MIGRATION] 预检共 {len(failures)} 台虚拟机无法迁移: "
+                                + "; ".join(f"{label}: {reason}" for label, reason in failures))
+            order = BatchOrder(manager)
+            for seq, row, plan in plans:
+                order.put(seq, row, plan)
+            order.close()
+            in_flight = asyncio.Semaphore(concurrency)
+            tasks = []
+            try:
+                # 有空位时才取下一台，取出时按最新的实测占用与速率排序
+                for rank in itertools.count():
+                    await in_flight.acquire()
+                    entry = order.get()
+                    if entry is None:
+                        break
+                    row, plan = entry
+                    tasks.append(asyncio.create_task(self._migrate_vm(rank, row, plan, cancel_event, progress, in_flight,
+                                                                      order)))
+                results = await asyncio.gather(*tasks)
+            finally:
+                self._api.close()
+        error_vms = [label for label, _ in failures] + [result for result in results if result]
+        error_vms.extend(f"第 {line} 行" for line, _ in batch.errors)
+        logging.info(f"[MIGRATION] 迁移清单共 {batch.rows} 行，无效 {len(batch.errors)} 行，重复 {len(batch.duplicates)} 行")
+        if error_vms:
+            logging.warning(f"[MIGRATION]以下虚拟机迁移出错: {', '.join(error_vms)}")
+        return error_vms
+
+    async def _migrate_vm(self, rank, row, plan, cancel_event, progress, in_flight, order):
+        vm_name = plan.vm_name
+        vm_progress = progress.vm(vm_name) if progress is not None else None
+        try:
+            if cancel_event is not None and cancel_event.is_set():
+                logging.info(f"[MIGRATION] 任务已取消，跳过虚拟机 {vm_name}")
+                self.manager._set_vm_phase(vm_progress, 'cancelled')
+                return None
+            logging.info(f"[MIGRATION] 开始处理虚拟机 {vm_name} 的迁移任务，目标可用区: {row.target_az}，"
+                         f"迁移方式: {row.method}，优先级: {row.priority}")
+            with ACTIVE_WORKERS.track_inprogress(kind='vm'):
+                return await self._migrate(rank, vm_name, row, plan, vm_progress)
+        finally:
+            order.done(plan)
+            in_flight.release()
+
+    async def _migrate(self, rank, vm_name, row, plan, vm_progress):
+        manager = self.manager
+        set_phase = manager._set_vm_phase
+        source_conn = OpenStackUtils(manager.source_auth_args)
+        target_utils = OpenStackUtils(manager.target_auth_args, manager.target_inventory)
+        target_utils.job_id = manager.job_id
+        target_conn = AsyncOpenStack(target_utils, self._api, rank)
+        ceph_utils = CephUtils(manager.source_ceph_conf, manager.source_ceph_pool, manager.target_ceph_conf,
+                               row.target_pool or manager.target_ceph_pool, manager.rbd_backend, manager.queue_depth,
+                               manager.copy_workers, manager.wire_transfer)
+        ceph_utils.progress = vm_progress
+        ceph_utils.bandwidth_class = row.bandwidth_class
+        # 预检时记录的状态可能已过时，校验前在复制线程中再查询
+        ceph_utils.source_stopped = lambda: source_conn.is_vm_stopped(plan.server.id)
+        method = row.method
+        loop = asyncio.get_running_loop()
+        try:
+            provision = method in ('snapshot', 'full_migrate', 'precopy')
+            direct = provision and config.TARGET_VOLUME_MODE == 'manage'
+            if direct:
+                volume_pairs = ceph_utils.direct_volume_pairs(plan.server, plan.volumes, plan.is_boot_from_volume)
+            else:
+                if provision:
+                    set_phase(vm_progress, 'provisioning')
+                    async with self._provision_slots:
+                        provisioned = await target_conn.create_vm_in_target(plan, row.target_az)
+                    if not provisioned:
+                        logging.error(f"[MIGRATION] 虚拟机 {vm_name} 创建创建失败")
+                        set_phase(vm_progress, 'failed', "目标虚拟机创建失败")
+                        return vm_name
+                    target_volumes = provisioned.volumes
+                else:
+                    target_volumes = await target_conn.call(target_conn.utils.get_vm_volumes, vm_name + "2")
+                volume_pairs = ceph_utils.pair_volumes(plan.server, plan.volumes, target_volumes, plan.is_boot_from_volume)
+            set_phase(vm_progress, 'copying')
+            if method == 'precopy':
+                # 预拷贝的多轮同步与切换时的关机在有界线程池中执行
+                incremental_sync = IncrementalSync(ceph_utils, volume_pairs, manager.scheduler)
+                if not await loop.run_in_executor(self._blocking, incremental_sync.run,
+                                                  lambda: source_conn.stop_vm(plan.server.id)):
+                    set_phase(vm_progress, 'failed', "预拷贝切换失败")
+                    return vm_name
+            else:
+                copies = ceph_utils.submit_volume_pairs(volume_pairs, manager.scheduler, method)
+                await asyncio.gather(*(asyncio.wrap_future(future) for _, _, future in copies), return_exceptions=True)
+                if not ceph_utils.copy_results(copies):
+                    set_phase(vm_progress, 'failed', "卷数据复制失败")
+                    return vm_name
+            if direct:
+                set_phase(vm_progress, 'provisioning')
+                async with self._provision_slots:
+                    target_volumes = await target_conn.manage_volumes(
+                        plan, [(target["pool"], target["volume_id"], target["name"]) for _, target in volume_pairs])
+                    await loop.run_in_executor(self._blocking, ceph_utils.record_adopted, volume_pairs, target_volumes)
+                    provisioned = await target_conn.create_vm_in_target(plan, row.target_az, target_volumes)
+                if not provisioned:
+                    logging.error(f"[MIGRATION] 虚拟机 {vm_name} 创建失败，已纳管的卷保留在目标环境中")
+                    set_phase(vm_progress, 'failed', "目标虚拟机创建失败")
+                    return vm_name
+            set_phase(vm_progress, 'completed')
+        except Exception as e:
+            logging.error(f"[MIGRATION] 迁移虚拟机 {vm_name} 时出现错误: {e}")
+            set_phase(vm_progress, 'failed', str(e))
+            return vm_name
@@ -0,0 +1,183 @@
+"""
+迁移清单读取：逐行流式读取 xlsx（openpyxl 只读模式）、CSV、JSON Lines，
+每行校验后立即产出，重复的虚拟机只保留第一行。
+
+列（表头不区分大小写）：
+    vm_name / ip        二选一，指定源虚拟机
+    target_az           目标可用区（必填）
+    method              迁移方式，缺省使用任务的迁移方式
+    priority            优先级，整数，越大越先迁移，缺省 0
+    target_pool         目标 RBD 存储池，缺省使用任务的目标存储池
+    bandwidth_class     单卷限速档位，取值见 config.BANDWIDTH_CLASSES
+    deadline            期望完成时间（本地时间），如 2026-10-20 06:00，排序见 batch_order
+"""
+import csv
+import datetime
+import ipaddress
+import json
+import logging
+import os
+from collections import namedtuple
+import config
+
+MIGRATION_METHODS = ('snapshot', 'rbd_diff', 'full_migrate', 'precopy')
+COLUMN_ALIASES = {
+    'name': 'vm_name',
+    'ip_address': 'ip',
+    'az': 'target_az',
+    'migration_method': 'method',
+}
+
+
+class BatchInputError(Exception):
+    """清单文件无法读取"""
+
+
+class BatchRow(namedtuple('BatchRow', ['line', 'vm_name', 'ip', 'target_az', 'method', 'priority', 'target_pool',
+                                       'bandwidth_class', 'deadline'])):
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """去重键：优先按虚拟机名称，其次按 IP"""
+        return ('vm_name', self.vm_name) if self.vm_name else ('ip', self.ip)
+
+    @property
+    def label(self):
+        return self.vm_name or self.ip
+
+
+def _normalize_header(name):
+    name = str(name or '').strip().lower()
+    return COLUMN_ALIASES.get(name, name)
+
+
+def _cell(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def _iter_xlsx(path):
+    try:
+        import openpyxl
+    except ImportError as e:
+        raise BatchInputError("读取 xlsx 需要安装 openpyxl") from e
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [_normalize_header(name) for name in header]
+        for line, values in enumerate(rows, start=2):
+            yield line, dict(zip(columns, values))
+    finally:
+        workbook.close()
+
+
+def _iter_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = [_normalize_header(name) for name in header]
+        for values in reader:
+            yield reader.line_num, dict(zip(columns, values))
+
+
+def _iter_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line, text in enumerate(f, start=1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as e:
+                yield line, e
+                continue
+            if not isinstance(record, dict):
+                yield line, ValueError("每行必须是 JSON 对象")
+                continue
+            yield line, {_normalize_header(name): value for name, value in record.items()}
+
+
+def _readers(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.xlsx', '.xlsm'):
+        return _iter_xlsx(path)
+    if extension in ('.csv', '.txt'):
+        return _iter_csv(path)
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return _iter_jsonl(path)
+    raise BatchInputError(f"不支持的清单格式: {extension}，请使用 xlsx / csv / jsonl")
+
+
+class BatchInput:
+    """
+    迭代得到校验通过且去重后的 BatchRow；校验失败的行记录在 errors，重复行记录在 duplicates
+    """
+
+    def __init__(self, path, default_method='snapshot', default_target_pool=None):
+        self.path = path
+        self.default_method = default_method
+        self.default_target_pool = default_target_pool
+        self.errors = []
+        self.duplicates = []
+        self.rows = 0
+
+    def _parse(self, line, record):
+        vm_name = _cell(record.get('vm_name'))
+        ip = _cell(record.get('ip'))
+        target_az = _cell(record.get('target_az'))
+        if not vm_name and not ip:
+            raise ValueError("vm_name 与 ip 至少填写一个")
+        if ip:
+            ipaddress.ip_address(ip)
+        if not target_az:
+            raise ValueError("target_az 不能为空")
+        method = _cell(record.get('method')) or self.default_method
+        if method not in MIGRATION_METHODS:
+            raise ValueError(f"不支持的迁移方式 {method}")
+        priority = _cell(record.get('priority'))
+        priority = int(priority) if priority is not None else 0
+        bandwidth_class = _cell(record.get('bandwidth_class'))
+        if bandwidth_class and bandwidth_class not in config.BANDWIDTH_CLASSES:
+            raise ValueError(f"未知的限速档位 {bandwidth_class}")
+        deadline = _cell(record.get('deadline'))
+        if deadline is not None:
+            try:
+                deadline = datetime.datetime.fromisoformat(deadline)
+            except ValueError:
+                raise ValueError(f"deadline 格式应为 YYYY-MM-DD HH:MM: {deadline}")
+        return BatchRow(line, vm_name, ip, target_az, method, priority,
+                        _cell(record.get('target_pool')) or self.default_target_pool, bandwidth_class, deadline)
+
+    def _error(self, line, message):
+        self.errors.append((line, message))
+        logging.error(f"[MIGRATION] 迁移清单第 {line} 行无效: {message}")
+
+    def __iter__(self):
+        seen = set()
+        for line, record in _readers(self.path):
+            if isinstance(record, Exception):
+                self._error(line, str(record))
+                continue
+            if not any(_cell(value) for value in record.values()):
+                continue
+            self.rows += 1
+            try:
+                row = self._parse(line, record)
+            except ValueError as e:
+                self._error(line, str(e))
+                continue
+            if row.key in seen:
+                self.duplicates.append(row)
+                logging.warning(f"[MIGRATION] 迁移清单第 {line} 行的虚拟机 {row.label} 重复，已忽略")
+                continue
+            seen.add(row.key)
+            yield row
@@ -0,0 +1,226 @@
+"""
+批量迁移的出队顺序：预检通过的虚拟机放入 BatchOrder，迁移线程（或协程）每次取出当前最应开始的一台。
+lpt 策略（最长处理时间优先）：
+    1. 优先级高的先迁移（清单 priority 列）；
+    2. 同优先级中填写了 deadline 的先迁移，按最晚开始时间（deadline − 预计耗时）从早到晚；
+    3. 其余按预计耗时从长到短，大虚拟机不会排在清单末尾、在其他线程都空闲后独自拖长整个批次；
+    4. 同一源计算节点已有 config.ORDER_PER_SOURCE_HOST 台在迁移时，先取同优先级中其他节点的虚拟机，分散源端读压力。
+预计耗时 = 预计传输字节数 / min(单流复制速率, 单卷限速)。放入时先按 Cinder 卷大小估算，后台再用
+CephUtils.estimate_volume 实测卷的实际占用；单流速率取断点续传日志中最近的复制记录，本批次的复制完成后随之更新，
+每 config.ORDER_RATE_REFRESH 秒刷新一次。估算或速率变化后，尚未开始的虚拟机重新排序。
+lpt 策略只在开始时等待一个预热窗口（config.ORDER_WARMUP 台或 config.ORDER_WARMUP_SECONDS 秒），此后清单边读边出队，
+每次取出已读入的虚拟机中排名最前的一台，后读入的虚拟机随之参与排序。
+manifest 策略与之前相同，只按优先级、清单顺序，清单边读边出队。
+多副本模式的工作项仍按优先级、入队顺序领取（见 work_queue）。
+"""
+import logging
+import threading
+import time
+import concurrent.futures
+import config
+from ceph_utils import CephUtils
+from copy_journal import get_copy_journal
+from rbd_backend import cluster_id
+from throttle import get_throttle
+
+ORDER_POLICIES = ('manifest', 'lpt')
+
+
+def source_host(plan):
+    """源虚拟机所在的计算节点，非管理员身份看不到时退回源可用区"""
+    info = plan.server_info
+    return info.get('compute_host') or info.get('OS-EXT-SRV-ATTR:host') or info.get('availability_zone')
+
+
+def initial_transfer_bytes(plan):
+    """按 Cinder 卷大小与 flavor 根盘大小（GB）估算传输量，实测卷占用之前使用"""
+    size = sum(volume.size or 0 for volume in plan.volumes)
+    if not plan.is_boot_from_volume:
+        size += (plan.server_info.get('flavor') or {}).get('disk') or 0
+    return size * 1024 ** 3
+
+
+def transfer_seconds(transfer_bytes, stream_rate, rate_limit=None):
+    """:param rate_limit: 单卷限速（字节/秒），None 表示不限"""
+    rate = min(stream_rate, rate_limit) if rate_limit else stream_rate
+    return transfer_bytes / rate
+
+
+def order_key(policy, priority, seq, seconds, deadline=None):
+    """
+    :param seq: 清单顺序
+    :param seconds: 预计耗时（秒）
+    :param deadline: 截止时间戳，未填写时为 None
+    :return: 排序键，越小越先迁移
+    """
+    if policy == 'manifest':
+        return (-priority, seq)
+    if deadline is not None:
+        return (-priority, 0, deadline - seconds, seq)
+    return (-priority, 1, -seconds, seq)
+
+
+class _Pending:
+    __slots__ = ('seq', 'row', 'plan', 'host', 'transfer_bytes', 'rate_limit', 'deadline')
+
+    def __init__(self, seq, row, plan, rate_limit):
+        self.seq = seq
+        self.row = row
+        self.plan = plan
+        self.host = source_host(plan)
+        self.transfer_bytes = initial_transfer_bytes(plan)
+        self.rate_limit = rate_limit
+        self.deadline = row.deadline.timestamp() if row.deadline is not None else None
+
+
+class BatchOrder:
+    """
+    线程安全的待迁移队列：put 放入，get 取出下一台，done 报告一台虚拟机迁移结束
+    :param manager: MigrationManager，使用它的 Ceph 配置与后端实测卷占用、读取复制速率
+    :param policy: 排序策略，默认 config.BATCH_ORDERING
+    :param per_host: 同一源计算节点同时迁移的虚拟机数，默认 config.ORDER_PER_SOURCE_HOST，0 不限制（仅 lpt 策略）
+    """
+
+    def __init__(self, manager, policy=None, per_host=None):
+        self.manager = manager
+        self.policy = policy or config.BATCH_ORDERING
+        if self.policy not in ORDER_POLICIES:
+            raise ValueError(f"不支持的排序策略: {self.policy}")
+        self.per_host = config.ORDER_PER_SOURCE_HOST if per_host is None else per_host
+        self._cond = threading.Condition()
+        self._pending = {}
+        # 排好序的待迁移列表，放入、实测或速率变化后置为 None 重新排序
+        self._ranked = None
+        self._running = {}
+        self._host_running = {}
+        self._closed = False
+        # lpt 预热窗口：积累到 config.ORDER_WARMUP 台或到达截止时间后开始出队
+        self._warm = self.policy != 'lpt'
+        self._warmup_deadline = None
+        self._stream_rate = None
+        self._rate_at = None
+        self._volume_limit = get_throttle().limits()['volume']['bytes']
+        self._estimator = None
+        if self.policy == 'lpt':
+            self._ceph_utils = CephUtils(manager.source_ceph_conf, manager.source_ceph_pool, manager.target_ceph_conf,
+                                         manager.target_ceph_pool, manager.rbd_backend, manager.queue_depth,
+                                         manager.copy_workers, manager.wire_transfer)
+            self._estimator = concurrent.futures.ThreadPoolExecutor(max_workers=config.PLAN_WORKERS,
+                                                                    thread_name_prefix='order-estimate')
+
+    def put(self, seq, row, plan):
+        """:param seq: 清单顺序"""
+        rate_limit = config.BANDWIDTH_CLASSES[row.bandwidth_class]['bytes'] if row.bandwidth_class else self._volume_limit
+        item = _Pending(seq, row, plan, rate_limit)
+        with self._cond:
+            self._pending[plan.vm_name] = item
+            self._ranked = None
+            if self._warmup_deadline is None:
+                self._warmup_deadline = time.monotonic() + config.ORDER_WARMUP_SECONDS
+            self._cond.notify()
+        if self._estimator is not None:
+            self._estimator.submit(self._measure, item)
+
+    def close(self):
+        """清单已读完，取完剩余的虚拟机后 get 返回 None"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def get(self):
+        """
+        取出下一台开始迁移的虚拟机。lpt 策略在预热窗口满（或清单读完）之前等待，之后与 manifest 策略一样
+        清单边读边出队，取已读入的虚拟机中排名最前的一台
+        :return: (BatchRow, VmPlan)，全部取完后返回 None
+        """
+        with self._cond:
+            while not self._ready():
+                timeout = None
+                if not self._warm and self._warmup_deadline is not None:
+                    timeout = max(0.0, self._warmup_deadline - time.monotonic())
+                self._cond.wait(timeout)
+            if not self._pending:
+                if self._estimator is not None:
+                    self._estimator.shutdown(wait=False, cancel_futures=True)
+                return None
+            item = self._select()
+            del self._pending[item.plan.vm_name]
+            self._ranked.remove(item)
+            self._running[item.plan.vm_name] = item.host
+            self._host_running[item.host] = self._host_running.get(item.host, 0) + 1
+        if item.deadline is not None:
+            finish = time.time() + self._seconds(item)
+            if finish > item.deadline:
+                logging.warning(f"[MIGRATION] 虚拟机 {item.plan.vm_name} 预计 {time.strftime('%Y-%m-%d %H:%M', time.localtime(finish))} "
+                                f"完成，晚于截止时间 {item.row.deadline}")
+        return item.row, item.plan
+
+    def _ready(self):
+        if self._closed:
+            return True
+        if not self._pending:
+            return False
+        if not self._warm and (len(self._pending) >= config.ORDER_WARMUP
+                               or time.monotonic() >= self._warmup_deadline):
+            self._warm = True
+        return self._warm
+
+    def done(self, plan):
+        """一台虚拟机迁移结束（无论成败），释放它占用的源计算节点名额"""
+        with self._cond:
+            if plan.vm_name in self._running:
+                host = self._running.pop(plan.vm_name)
+                self._host_running[host] -= 1
+
+    def _seconds(self, item):
+        return transfer_seconds(item.transfer_bytes, self._stream_rate or config.PLAN_DEFAULT_RATE, item.rate_limit)
+
+    def _key(self, item):
+        return order_key(self.policy, item.row.priority, item.seq, self._seconds(item), item.deadline)
+
+    def _select(self):
+        if self.policy == 'lpt':
+            self._refresh_rate()
+        if self._ranked is None:
+            self._ranked = sorted(self._pending.values(), key=self._key)
+        head = self._ranked[0]
+        if self.policy == 'lpt' and self.per_host:
+            for item in self._ranked:
+                if item.row.priority != head.row.priority:
+                    break
+                if item.host is None or self._host_running.get(item.host, 0) < self.per_host:
+                    return item
+        return head
+
+    def _refresh_rate(self):
+        now = time.monotonic()
+        if self._rate_at is not None and now - self._rate_at < config.ORDER_RATE_REFRESH:
+            return
+        self._rate_at = now
+        manager = self.manager
+        try:
+            rate, _ = get_copy_journal().copy_rate(cluster_id(manager.source_ceph_conf),
+                                                   cluster_id(manager.target_ceph_conf))
+        except Exception as e:
+            logging.warning(f"[MIGRATION] 读取历史复制速率失败: {e}")
+            return
+        if rate and rate != self._stream_rate:
+            self._stream_rate = rate
+            self._ranked = None
+
+    def _measure(self, item):
+        """实测虚拟机各卷的实际传输量，已开始迁移的不再查询"""
+        with self._cond:
+            if item.plan.vm_name not in self._pending:
+                return
+        plan = item.plan
+        ceph_utils = self._ceph_utils
+        try:
+            transfer = sum(ceph_utils.estimate_volume(volume['pool'], volume['volume_id'], item.row.method)[2]
+                           for volume in ceph_utils.source_volumes(plan.server, plan.volumes, plan.is_boot_from_volume))
+        except Exception as e:
+            logging.warning(f"[MIGRATION] 查询虚拟机 {plan.vm_name} 的卷占用失败，按卷大小排序: {e}")
+            return
+        with self._cond:
+            item.transfer_bytes = transfer
+            self._ranked = None
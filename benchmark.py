@@ -0,0 +1,268 @@
+"""
+离线压测：用 fake_openstack（内存云环境，可设 API 延迟与资源数量）与 fake RBD 后端（内存集群），
+让合成的迁移清单走完真实的 MigrationManager → OpenStackUtils / CephUtils 编排流程，
+统计每台虚拟机的 API 调用次数、总耗时、内存峰值与复制字节数，结果输出为 JSON，便于不同版本对比。
+目标集群吞吐量通过 throttle 的 target 限速模拟。
+
+fake 集群把数据放在内存中，内存占用约为 虚拟机数 × 每台卷数 × 2 × max(--written, --object-size)。
+
+示例：
+    python benchmark.py --vms 10 100 1000 --api-latency 0.02 --throughput 200M --output bench.json
+    # 比较出队顺序：清单末尾 4 台大虚拟机，单卷限速使大卷的复制耗时远长于其他虚拟机
+    python benchmark.py --vms 40 --large-vms 4 --large-written 8M --volume-throughput 2M --ordering manifest
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import config
+import connection_pool
+import fake_rbd
+from fake_openstack import FakeCloud
+from migration_manager import MigrationManager
+from metrics import COPIED_BYTES
+from progress import JobProgress
+from scheduler import MigrationScheduler
+from rbd_backend import ImageSpec, get_rbd_backend
+from throttle import get_throttle
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+IMAGE_NAME = "benchmark-image"
+SOURCE_POOL = "volumes"
+TARGET_POOL = "volumes"
+
+
+def parse_size(value):
+    """'64K' / '200M' / '1G' / '4096' → 字节数"""
+    value = str(value).strip().upper().rstrip('B').rstrip('I')
+    unit = value[-1:] if value[-1:] in SIZE_UNITS else ''
+    return int(float(value[:len(value) - len(unit)]) * SIZE_UNITS[unit])
+
+
+def _git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _ip(network_index, host_index):
+    host = host_index + 10
+    return f"10.{network_index}.{host // 256}.{host % 256}"
+
+
+class BenchmarkEnvironment:
+    """一次压测用的源/目标 fake 云环境与 fake Ceph 集群"""
+
+    def __init__(self, workdir, run, options):
+        self.options = options
+        self.source = FakeCloud('source', options.api_latency, options.boot_seconds)
+        self.target = FakeCloud('target', options.api_latency, options.boot_seconds)
+        # fake 集群按配置文件路径区分，每次压测使用新的路径
+        self.source_conf = os.path.join(workdir, f"run{run}-source.conf")
+        self.target_conf = os.path.join(workdir, f"run{run}-target.conf")
+        self.source_auth = {'auth_url': f"http://benchmark-source/{run}"}
+        self.target_auth = {'auth_url': f"http://benchmark-target/{run}"}
+        self.vm_names = []
+
+    def build(self, vms):
+        options = self.options
+        source, target = self.source, self.target
+        networks = []
+        for index in range(options.networks):
+            cidr = f"10.{index}.0.0/16"
+            networks.append(source.add_subnet(cidr))
+            target.add_subnet(cidr)
+        flavors = [source.add_flavor(f"benchmark-{index}", disk=options.volume_size) for index in range(options.flavors)]
+        image = source.add_image(IMAGE_NAME)
+        target.add_image(IMAGE_NAME)
+        target.add_image(config.DEFAULT_MIGRATE_IMAGE)
+        backend = get_rbd_backend('fake')
+        nic_index = 0
+        for index in range(vms + options.extra_servers):
+            name = f"benchmark-vm-{index:05d}"
+            flavor = flavors[index % len(flavors)]
+            volumes = [source.add_volume(f"{name}-data{number}", options.volume_size)
+                       for number in range(options.data_volumes)]
+            nics = []
+            for _ in range(options.nics):
+                network_index = nic_index % len(networks)
+                nics.append((networks[network_index], _ip(network_index, nic_index // len(networks))))
+                nic_index += 1
+            addresses = {}
+            for subnet, ip in nics:
+                addresses.setdefault(subnet.network_id, []).append({'addr': ip})
+            server = source.add_server(name, flavor, image_id=image.id, volume_ids=[v.id for v in volumes],
+                                       addresses=addresses)
+            for subnet, ip in nics:
+                source.add_port(subnet.network_id, [{'subnet_id': subnet.id, 'ip_address': ip}], device_id=server.id)
+            # 清单之外的虚拟机只增加列表调用的数据量，不创建 RBD 镜像
+            if index >= vms:
+                continue
+            self.vm_names.append(name)
+            # 清单末尾的 --large-vms 台虚拟机写入更多数据，用于比较出队顺序
+            written = options.large_written if index >= vms - options.large_vms else options.written
+            self._create_image(backend, 'vms', f"{server.id}_disk", flavor.disk, written)
+            for volume in volumes:
+                self._create_image(backend, SOURCE_POOL, f"volume-{volume.id}", volume.size, written)
+
+    def _create_image(self, backend, pool, image, size_gb, written):
+        options = self.options
+        spec = ImageSpec(self.source_conf, pool, image)
+        backend.create_image(spec, size_gb * 1024 ** 3, options.object_size)
+        if written:
+            ioctx = fake_rbd.Rados(conffile=self.source_conf).open_ioctx(pool)
+            fake_rbd.Image(ioctx, image).write(os.urandom(written), 0)
+
+    def install(self):
+        connection_pool.install(self.source_auth, self.source.connect())
+        connection_pool.install(self.target_auth, self.target.connect())
+
+    def write_batch(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['vm_name', 'target_az', 'method'])
+            for name in self.vm_names:
+                writer.writerow([name, 'nova', self.options.method])
+
+
+def _api_summary(calls, vms):
+    total = sum(calls.values())
+    return {'total': total, 'per_vm': round(total / vms, 2) if vms else None, 'by_method': dict(sorted(calls.items()))}
+
+
+def run_benchmark(workdir, run, vms, options):
+    """
+    :return: 一次压测的结果（可 JSON 序列化）
+    """
+    environment = BenchmarkEnvironment(workdir, run, options)
+    build_start = time.monotonic()
+    environment.build(vms)
+    build_seconds = time.monotonic() - build_start
+    environment.install()
+    batch_path = os.path.join(workdir, f"run{run}.csv")
+    environment.write_batch(batch_path)
+    manager = MigrationManager(environment.source_auth, environment.target_auth, environment.source_conf, SOURCE_POOL,
+                               environment.target_conf, TARGET_POOL, rbd_backend='fake',
+                               scheduler=MigrationScheduler(options.provision_concurrency))
+    progress = JobProgress(f"benchmark-{run}")
+
+    copied_before = COPIED_BYTES.value()
+    tracemalloc.start()
+    start = time.monotonic()
+    try:
+        error_vms = manager.batch_migrate_from_file(batch_path, options.concurrency, options.method, progress=progress)
+        wall_seconds = time.monotonic() - start
+        peak_traced = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        manager.scheduler.shutdown()
+        connection_pool.close_all()
+        fake_rbd.reset()
+
+    # 预拷贝每轮重新计数卷进度，复制字节数按复制引擎的累计写入量计算
+    bytes_copied = COPIED_BYTES.value() - copied_before
+    source_api, target_api = _api_summary(environment.source.calls(), vms), _api_summary(environment.target.calls(), vms)
+    api_total = source_api['total'] + target_api['total']
+    result = {
+        'vms': vms,
+        'failed_vms': len(error_vms),
+        'build_seconds': round(build_seconds, 3),
+        'wall_seconds': round(wall_seconds, 3),
+        'vms_per_minute': round(vms / wall_seconds * 60, 2) if wall_seconds > 0 else None,
+        'api_calls': {
+            'total': api_total,
+            'per_vm': round(api_total / vms, 2) if vms else None,
+            'source': source_api,
+            'target': target_api,
+        },
+        'peak_traced_memory_bytes': peak_traced,
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'bytes_copied': bytes_copied,
+        'copy_rate_bytes': round(bytes_copied / wall_seconds) if wall_seconds > 0 else None,
+    }
+    logging.warning(f"[MIGRATION] 压测 {vms} 台虚拟机：耗时 {wall_seconds:.1f} 秒，失败 {len(error_vms)} 台，"
+                    f"API 调用 {result['api_calls']['per_vm']} 次/台，复制 {bytes_copied / 1024 ** 2:.1f} MB，"
+                    f"内存峰值 {peak_traced / 1024 ** 2:.1f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线迁移压测（fake OpenStack + fake Ceph）")
+    parser.add_argument('--vms', type=int, nargs='+', default=[10, 100], help="每次压测的虚拟机数量，可给多个")
+    parser.add_argument('--method', default='snapshot', choices=['snapshot', 'full_migrate', 'precopy'],
+                        help="迁移方式")
+    parser.add_argument('--concurrency', type=int, default=8, help="同时处理的虚拟机数量")
+    parser.add_argument('--provision-concurrency', type=int, default=config.PROVISION_CONCURRENCY,
+                        help="同时创建的目标虚拟机数量")
+    parser.add_argument('--data-volumes', type=int, default=1, help="每台虚拟机的数据卷数量（另有一个系统盘）")
+    parser.add_argument('--nics', type=int, default=1, help="每台虚拟机的网卡数量")
+    parser.add_argument('--networks', type=int, default=4, help="子网数量")
+    parser.add_argument('--flavors', type=int, default=4, help="源端 flavor 数量")
+    parser.add_argument('--extra-servers', type=int, default=0, help="源端清单之外的虚拟机数量")
+    parser.add_argument('--volume-size', type=int, default=10, help="每个卷的分配大小（GB）")
+    parser.add_argument('--written', type=parse_size, default=parse_size('64K'), help="每个卷实际写入的数据量")
+    parser.add_argument('--large-vms', type=int, default=0, help="清单末尾写入 --large-written 数据量的虚拟机数量")
+    parser.add_argument('--large-written', type=parse_size, default=parse_size('4M'), help="大虚拟机每个卷实际写入的数据量")
+    parser.add_argument('--object-size', type=parse_size, default=parse_size('64K'), help="源/目标镜像的对象大小")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="每次 OpenStack API 调用的模拟耗时（秒）")
+    parser.add_argument('--boot-seconds', type=float, default=0.0, help="目标虚拟机启动、关机的模拟耗时（秒）")
+    parser.add_argument('--throughput', type=parse_size, default=None, help="目标集群总吞吐量（字节/秒），默认不限")
+    parser.add_argument('--volume-throughput', type=parse_size, default=None, help="单个卷的复制速率上限（字节/秒），默认不限")
+    parser.add_argument('--target-volume-mode', choices=['placeholder', 'manage'], default=config.TARGET_VOLUME_MODE,
+                        help="目标卷准备方式，见 config.TARGET_VOLUME_MODE")
+    parser.add_argument('--orchestration', choices=['threads', 'asyncio'], default=config.ORCHESTRATION,
+                        help="批量迁移的编排方式，见 config.ORCHESTRATION")
+    parser.add_argument('--ordering', choices=['manifest', 'lpt'], default=config.BATCH_ORDERING,
+                        help="批量迁移的出队顺序，见 batch_order")
+    parser.add_argument('--output', help="结果 JSON 文件，默认输出到标准输出")
+    parser.add_argument('--verbose', action='store_true', help="输出迁移流程的 INFO 日志")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    workdir = tempfile.mkdtemp(prefix='vm-migrate-benchmark-')
+    # 断点日志与复制速率记录写入临时目录，不影响 uploads 下的正式数据
+    config.COPY_JOURNAL_DB = os.path.join(workdir, 'copy_journal.db')
+    config.RBD_TARGET_OBJECT_SIZE = args.object_size
+    config.TARGET_VOLUME_MODE = args.target_volume_mode
+    config.ORCHESTRATION = args.orchestration
+    config.BATCH_ORDERING = args.ordering
+    config.CINDER_MANAGE_HOSTS = {TARGET_POOL: f"benchmark@fake#{TARGET_POOL}"}
+    if args.throughput:
+        get_throttle().set_limits({'target': {'bytes': args.throughput}})
+    if args.volume_throughput:
+        get_throttle().set_limits({'volume': {'bytes': args.volume_throughput}})
+    try:
+        runs = [run_benchmark(workdir, run, vms, args) for run, vms in enumerate(args.vms)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ('output', 'verbose')}
+    report = {
+        'version': _git_version(),
+        'python': platform.python_version(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'parameters': parameters,
+        'runs': runs,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
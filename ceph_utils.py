@@ -1,22 +1,104 @@
-import subprocess
 import logging
-import concurrent.futures
+import time
+from contextlib import contextmanager
 from datetime import datetime
+import config
+from rbd_backend import ImageSpec, ImageLayout, RbdBackendError, get_rbd_backend, cluster_id
+from copy_journal import get_copy_journal
+from verify import VolumeVerifier
+from relay import wire_backend
+from throttle import get_throttle
 
 class CephUtils:
-    def __init__(self, source_ceph_conf, source_ceph_pool, target_ceph_conf, target_ceph_pool):
+    def __init__(self, source_ceph_conf, source_ceph_pool, target_ceph_conf, target_ceph_pool, backend=None, queue_depth=None, copy_workers=None, wire_transfer=None):
         self.source_ceph_conf = source_ceph_conf
         self.source_ceph_pool = source_ceph_pool
         self.target_ceph_conf = target_ceph_conf
         self.target_ceph_pool = target_ceph_pool
-        
-    def _run_command(self, command, error_message):
+        # backend 可以是后端名称（cli / librbd / fake）或 RbdBackend 实例
+        self.backend = get_rbd_backend(backend) if backend is None or isinstance(backend, str) else backend
+        # 帧格式传输（inprocess / relay）时目标端操作经 RelayBackend 执行
+        self.backend = wire_backend(self.backend, target_ceph_conf, wire_transfer)
+        self.queue_depth = queue_depth
+        # 单个卷内按区间并行复制的线程数（仅 librbd 后端生效）
+        self.copy_workers = copy_workers or config.RBD_COPY_WORKERS
+        # progress.VmProgress，由 MigrationManager 设置后按卷上报复制进度
+        self.progress = None
+        # 迁移清单指定的单卷限速档位（config.BANDWIDTH_CLASSES 的键），为空时使用全局限速
+        self.bandwidth_class = None
+        # source_stopped() 在校验前重新查询源虚拟机是否已关机（SHUTOFF），由 MigrationManager 设置；
+        # 未设置或未关机时不与源镜像当前数据比较
+        self.source_stopped = None
+        # 新建目标镜像的对象大小与条带
+        self.layout = ImageLayout(config.RBD_TARGET_OBJECT_SIZE, config.RBD_TARGET_STRIPE_UNIT,
+                                  config.RBD_TARGET_STRIPE_COUNT)
+
+    def _image_exists(self, spec):
         try:
-            result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-            return result.stdout
-        except subprocess.CalledProcessError as e:
-            logging.error(f"[MIGRATION] {error_message}: {e}")
-            return None    
+            self.backend.image_size(spec)
+            return True
+        except RbdBackendError:
+            return False
+
+    def _begin_checkpoint(self, source, target):
+        """
+        支持断点续传的后端返回 Checkpoint，目标卷已不存在时放弃旧断点重新开始；
+        命令行后端返回 None
+        """
+        if not self.backend.supports_checkpoint:
+            return None
+        journal = get_copy_journal()
+        checkpoint = journal.begin(source, target)
+        if checkpoint.resumed and not self._image_exists(target):
+            logging.warning(f"[MIGRATION] 目标卷 {target.path} 已不存在，放弃断点重新复制")
+            checkpoint = journal.begin(source, target, resume=False)
+        return checkpoint
+
+    def _resumable_snapshot(self, source, target):
+        """
+        查找该源目标对上次未完成复制所使用的快照，存在则复用以便续传
+        """
+        if not self.backend.supports_checkpoint:
+            return None
+        active = get_copy_journal().find_active(source, target)
+        if active and active[1]:
+            try:
+                if active[1] in [name for name, _ in self.backend.list_snapshots(source)]:
+                    logging.info(f"[MIGRATION] 复用未完成复制的快照 {source.at(active[1]).path}")
+                    return active[1]
+            except RbdBackendError as e:
+                logging.warning(f"[MIGRATION] 查询快照 {source.path} 失败: {e}")
+        return None
+
+    def _volume_progress(self, rbd_name):
+        return self.progress.volume(rbd_name) if self.progress is not None else None
+
+    @property
+    def aborted(self):
+        """虚拟机的迁移已被中止（见 progress.VmProgress.abort），不再开始新的复制"""
+        return self.progress is not None and self.progress.aborted
+
+    @staticmethod
+    def _set_phase(volume_progress, phase):
+        if volume_progress is not None:
+            volume_progress.set_phase(phase)
+
+    @contextmanager
+    def _bandwidth_limits(self, target_rbd_pool, target_rbd_id):
+        """复制期间为目标卷设置 bandwidth_class 对应的单卷限速"""
+        if not self.bandwidth_class:
+            yield
+            return
+        volume = ImageSpec(self.target_ceph_conf, target_rbd_pool, target_rbd_id).path
+        get_throttle().set_volume_limits(volume, config.BANDWIDTH_CLASSES[self.bandwidth_class])
+        try:
+            yield
+        finally:
+            get_throttle().set_volume_limits(volume, None)
+
+    def _log_written(self, target, written):
+        if written is not None:
+            logging.info(f"[MIGRATION] {target.path} 实际写入 {written / 1024 ** 2:.1f} MB 数据")
 
     def get_latest_snapshot(self, source_ceph_conf, source_ceph_pool, source_rbd_id):
         """
@@ -27,37 +109,17 @@ class CephUtils:
         :return: 最新快照名称，如果没有快照则返回 None
         """
         try:
-            # 执行 rbd snap ls 命令获取所有快照信息
-            command = f'rbd --conf {source_ceph_conf} snap ls {source_ceph_pool}/{source_rbd_id}'
-            output = self._run_command(command, "执行 rbd snap ls 命令时出错")
-
-            # 解析输出，提取快照名称和创建时间
-            snapshots = []
-            lines = output.strip().split('\n')[1:]  # 跳过标题行
-            for line in lines:
-                parts = line.split()
-                if len(parts) >= 4:
-                    snapshot_name = parts[1]
-                    creation_time_str = ' '.join(parts[-5:])
-                    import re
-                    clean_time_str = re.sub(r'[^a-zA-Z0-9: ]', '', creation_time_str)
-                    # 这里简单假设时间格式可以被解析
-                    try:
-                        creation_time = int(subprocess.run(f"date -d '{clean_time_str}' +%s", shell=True, capture_output=True, text=True).stdout.strip())
-                        snapshots.append((snapshot_name, creation_time))
-                    except ValueError:
-                        logging.warning(f"[MIGRATION] 无法解析快照 {snapshot_name} 的创建时间: {clean_time_str}")
-
+            snapshots = self.backend.list_snapshots(ImageSpec(source_ceph_conf, source_ceph_pool, source_rbd_id))
+            snapshots = [snap for snap in snapshots if snap[1] is not None]
             if snapshots:
                 # 按创建时间降序排序
                 snapshots.sort(key=lambda x: x[1], reverse=True)
-                latest_snapshot = snapshots[0][0] if len(snapshots) > 0 else None
-                return latest_snapshot
-        except subprocess.CalledProcessError as e:
-            logging.error(f"[MIGRATION] 执行 rbd snap ls 命令时出错: {e}")
+                return snapshots[0][0]
+        except Exception as e:
+            logging.error(f"[MIGRATION] 获取 {source_ceph_pool}/{source_rbd_id} 快照列表时出错: {e}")
         return None
 
-    def sync_from_latest_snapshot(self, source_ceph_conf, source_ceph_pool, source_rbd_id, target_ceph_conf, target_ceph_pool, target_rbd_id, rbd_name):
+    def sync_from_latest_snapshot(self, source_ceph_conf, source_ceph_pool, source_rbd_id, target_ceph_conf, target_ceph_pool, target_rbd_id, rbd_name, progress=None):
         """
         从源 RBD 镜像的最新快照进行数据同步到目标 RBD 镜像
         :param source_ceph_conf: 源 Ceph 配置文件路径
@@ -68,138 +130,243 @@ class CephUtils:
         :param target_rbd_id: 目标 RBD 镜像 ID
         :return: 同步是否成功
         """
-        latest_latest_snapshot = self.get_latest_snapshot(source_ceph_conf, source_ceph_pool, source_rbd_id)
+        source = ImageSpec(source_ceph_conf, source_ceph_pool, source_rbd_id)
+        target = ImageSpec(target_ceph_conf, target_ceph_pool, target_rbd_id)
+        # 优先使用快照链中记录的、已确认同步到目标端的快照
+        latest_latest_snapshot = get_copy_journal().last_snapshot(source, target) or \
+            self.get_latest_snapshot(source_ceph_conf, source_ceph_pool, source_rbd_id)
+        if latest_latest_snapshot is None:
+            logging.error(f"[MIGRATION] {rbd_name} 没有可用于增量同步的快照")
+            return False
         try:
             #快照回滚
-            rollback_command = [
-                "rbd",
-                "--conf", target_ceph_conf,
-                "snap",
-                "rollback",
-                f"{target_ceph_pool}/{target_rbd_id}@{latest_latest_snapshot}"
-            ]
-            self._run_command(" ".join(rollback_command), "执行出错")
+            self.backend.rollback_snapshot(target, latest_latest_snapshot)
             logging.info("[MIGRATION] 快照回滚成功。")
-
-	    # 执行 rbd diff 并同步
-            diff_command = [
-                "rbd",
-                "--conf", source_ceph_conf,
-                "export-diff",
-                f"{source_ceph_pool}/{source_rbd_id}",
-                "--from-snap", latest_latest_snapshot,
-                "-",
-                "|",
-                "rbd",
-                "--conf", target_ceph_conf,
-                "import-diff",
-                "-",
-                f"{target_ceph_pool}/{target_rbd_id}"
-            ]
-            result = self._run_command(" ".join(diff_command), "执行出错")
+            # 执行 rbd diff 并同步
+            self.backend.copy_diff(source, target, from_snap=latest_latest_snapshot, queue_depth=self.queue_depth, workers=self.copy_workers, progress=progress)
             logging.info("[MIGRATION] 数据同步成功。")
             return True
-        except subprocess.CalledProcessError as e:
+        except Exception as e:
             logging.error(f"[MIGRATION] 数据同步失败: {e}")
             return False
 
     
-    def create_rbd_snapshot(self, rbd_pool, source_rbd_id, rbd_name):
+    def create_rbd_snapshot(self, rbd_pool, source_rbd_id, rbd_name, label="snapshot"):
         try:
             timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            snapshot_name = f"{rbd_name}-snapshot-{timestamp}"
-            command = [
-                "rbd",
-                "--conf", self.source_ceph_conf,
-                "snap", "create",
-                f"{rbd_pool}/{source_rbd_id}@{snapshot_name}"
-            ]
-            self._run_command(" ".join(command), "执行出错")
+            snapshot_name = f"{rbd_name}-{label}-{timestamp}"
+            self.backend.create_snapshot(ImageSpec(self.source_ceph_conf, rbd_pool, source_rbd_id), snapshot_name)
             logging.info(f"[MIGRATION] 为 RBD 卷 {rbd_pool}/{rbd_name} 创建快照 {snapshot_name} 成功。")
             return snapshot_name
-        except subprocess.CalledProcessError as e:
+        except Exception as e:
             logging.error(f"[MIGRATION] 为 RBD 卷 {rbd_pool}/{rbd_name} 创建快照时出错: {e}")
             return None
 
-    def migrate_rbd_data_from_snapshot(self, source_rbd_pool, source_rbd_id, snapshot_name, target_rbd_pool, target_rbd_id, volume_size):
+    def migrate_rbd_data_from_snapshot(self, source_rbd_pool, source_rbd_id, snapshot_name, target_rbd_pool, target_rbd_id, volume_size, progress=None):
+        source = ImageSpec(self.source_ceph_conf, source_rbd_pool, source_rbd_id, snapshot_name)
+        target = ImageSpec(self.target_ceph_conf, target_rbd_pool, target_rbd_id)
         try:
-            #rbd rm删除目标卷
-            rm_command = f"rbd --conf {self.target_ceph_conf} rm {target_rbd_pool}/{target_rbd_id}"
-            self._run_command(rm_command, "执行出错")
-            logging.info(f"[MIGRATION]{target_rbd_pool}/{target_rbd_id}删除成功 。")
-            #rbd 重建目标卷，采用8M的块
-            rebuild_command=f"rbd --conf {self.target_ceph_conf} create --size {volume_size} {target_rbd_pool}/{target_rbd_id} --object-size 4M"
-            self._run_command(rebuild_command, "执行出错")
-            logging.info(f"[MIGRATION]{target_rbd_pool}/{target_rbd_id}重建成功 。")
-            command = [
-                "rbd",
-                "--conf", self.source_ceph_conf,
-                "export-diff",
-                f"{source_rbd_pool}/{source_rbd_id}@{snapshot_name}",
-                "-",
-                "|",
-                "rbd",
-                "--conf", self.target_ceph_conf,
-                "import-diff",
-                "-",
-                f"{target_rbd_pool}/{target_rbd_id}"
-            ]
-            # 由于管道的复杂性，这里使用 shell 模式执行命令
-            self._run_command(" ".join(command), "执行出错")
+            checkpoint = self._begin_checkpoint(source, target)
+            if checkpoint is None or not checkpoint.resumed:
+                #rbd rm删除目标卷
+                self.backend.remove_image(target)
+                logging.info(f"[MIGRATION]{target_rbd_pool}/{target_rbd_id}删除成功 。")
+                #rbd 按配置的对象大小与条带重建目标卷，卷大小单位为 GB
+                size = volume_size * 1024 ** 3 if volume_size else self.backend.image_size(source)
+                self.backend.create_image(target, size, *self.layout)
+                get_copy_journal().clear_lineage(source, target)
+                logging.info(f"[MIGRATION]{target_rbd_pool}/{target_rbd_id}重建成功 。")
+            written = self.backend.copy_diff(source, target, queue_depth=self.queue_depth, workers=self.copy_workers,
+                                             checkpoint=checkpoint, progress=progress)
+            if checkpoint is not None:
+                get_copy_journal().finish(checkpoint)
+            get_copy_journal().record_snapshot(source, target, snapshot_name)
+            self._log_written(target, written)
             logging.info(f"[MIGRATION] 从快照 {snapshot_name} 迁移 RBD 卷 {source_rbd_pool}/{source_rbd_id} 到目标 {target_rbd_pool}/{target_rbd_id} 成功。")
             return True
-        except subprocess.CalledProcessError as e:
+        except Exception as e:
             logging.error(f"[MIGRATION] 从快照 {snapshot_name} 迁移 RBD 卷 {source_rbd_pool}/{source_rbd_id} 到目标 {target_rbd_pool}/{target_rbd_id} 时出错: {e}")
             return False
 
-    def full_migrate_rbd_volume(self, source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id):
+    def full_migrate_rbd_volume(self, source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id, progress=None):
+            source = ImageSpec(self.source_ceph_conf, source_rbd_pool, source_rbd_id)
+            target = ImageSpec(self.target_ceph_conf, target_rbd_pool, target_rbd_id)
             try:
-                rm_command = f"rbd --conf {self.target_ceph_conf} rm {target_rbd_pool}/{target_rbd_id}"
-                self._run_command(rm_command, "执行出错")
-                export_import_command = [
-                    "rbd",
-                    "--conf", self.source_ceph_conf,
-                    "export",
-                    f"{source_rbd_pool}/{source_rbd_id}",
-                    "-",
-                    "|",
-                    "rbd",
-                    "--conf", self.target_ceph_conf,
-                    "import",
-                    "-",
-                    f"{target_rbd_pool}/{target_rbd_id}"
-                ]
-                result = self._run_command(" ".join(export_import_command), "执行出错")
-                if result != None:
-                    logging.info(f"[MIGRATION] {rbd_name} 数据完整迁移成功")
-                    return True
-                else:
-                    logging.error(f"[MIGRATION] {rbd_name} 数据完整迁移失败")
-                    return False
+                checkpoint = self._begin_checkpoint(source, target)
+                if checkpoint is None or not checkpoint.resumed:
+                    self.backend.remove_image(target)
+                    get_copy_journal().clear_lineage(source, target)
+                written = self.backend.copy_image(source, target, queue_depth=self.queue_depth,
+                                                  workers=self.copy_workers, checkpoint=checkpoint, progress=progress,
+                                                  layout=self.layout)
+                if checkpoint is not None:
+                    get_copy_journal().finish(checkpoint)
+                self._log_written(target, written)
+                logging.info(f"[MIGRATION] {rbd_name} 数据完整迁移成功")
+                return True
             except Exception as e:
-                logging.error(f"[MIGRATION] 执行 rbd export import 时出错: {e}")
+                logging.error(f"[MIGRATION] {rbd_name} 数据完整迁移失败: {e}")
                 return False
 
+    def sync_snapshot_diff(self, source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id, label):
+        """
+        增量同步一轮：创建新快照，将其相对快照链中上一个快照的差异写入目标端，并记入快照链
+        :return: 本轮差异数据量（字节），失败返回 None
+        """
+        source = ImageSpec(self.source_ceph_conf, source_rbd_pool, source_rbd_id)
+        target = ImageSpec(self.target_ceph_conf, target_rbd_pool, target_rbd_id)
+        if self.aborted:
+            logging.warning(f"[MIGRATION] {rbd_name} 的迁移已中止，不再增量同步: {self.progress.abort_reason}")
+            return None
+        journal = get_copy_journal()
+        from_snap = journal.last_snapshot(source, target)
+        if from_snap is None:
+            logging.error(f"[MIGRATION] {rbd_name} 没有已同步的基础快照，无法增量同步")
+            return None
+        volume_progress = self._volume_progress(rbd_name)
+        snapshot_name = self.create_rbd_snapshot(source_rbd_pool, source_rbd_id, rbd_name, label)
+        if snapshot_name is None:
+            self._set_phase(volume_progress, 'failed')
+            return None
+        try:
+            self._set_phase(volume_progress, label)
+            delta = sum(length for _, length in self.backend.list_extents(source.at(snapshot_name), from_snap))
+            with self._bandwidth_limits(target_rbd_pool, target_rbd_id):
+                self.backend.copy_diff(source.at(snapshot_name), target, from_snap=from_snap,
+                                       queue_depth=self.queue_depth, workers=self.copy_workers, progress=volume_progress)
+            journal.record_snapshot(source, target, snapshot_name, delta)
+            self._set_phase(volume_progress, 'synced')
+            logging.info(f"[MIGRATION] {rbd_name} 增量同步 {from_snap} -> {snapshot_name} 完成，差异 {delta / 1024 ** 2:.1f} MB")
+        except Exception as e:
+            logging.error(f"[MIGRATION] {rbd_name} 增量同步 {from_snap} -> {snapshot_name} 失败: {e}")
+            self._set_phase(volume_progress, 'failed')
+            return None
+        # 下一轮只需要快照链中最新的快照，上一轮的快照两端都删除，预拷贝结束后源端只保留一个快照
+        self._remove_snapshot_pair(source, target, from_snap, rbd_name)
+        return delta
+
+    def _remove_snapshot_pair(self, source, target, snapshot_name, rbd_name):
+        """删除源与目标端的同名快照，失败只告警，不影响迁移"""
+        for spec in (source, target):
+            try:
+                self.backend.remove_snapshot(spec, snapshot_name)
+            except Exception as e:
+                logging.warning(f"[MIGRATION] {rbd_name} 删除快照 {spec.at(snapshot_name).path} 失败: {e}")
+
+    def verify_volume(self, source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id, snapshot_name=None):
+        """
+        分块比较源与目标数据，不一致的块重新复制后复核
+        :param snapshot_name: 目标数据对应的源快照，为空时与源镜像当前数据比较（源虚拟机需已关机，见 _verify_live_source）
+        :return: 数据是否一致，未启用校验时返回 True
+        """
+        if not config.VERIFY_ENABLED:
+            return True
+        if not self.backend.supports_chunk_verify and not config.VERIFY_CLI_BACKEND:
+            logging.warning(f"[MIGRATION] {self.backend.name} 后端不支持按块校验，跳过 {rbd_name} 的数据校验")
+            return True
+        source = ImageSpec(self.source_ceph_conf, source_rbd_pool, source_rbd_id, snapshot_name)
+        target = ImageSpec(self.target_ceph_conf, target_rbd_pool, target_rbd_id)
+        volume_progress = self._volume_progress(rbd_name)
+        self._set_phase(volume_progress, 'verifying')
+        try:
+            verified = VolumeVerifier(self.backend).verify(source, target)
+        except Exception as e:
+            logging.error(f"[MIGRATION] {rbd_name} 数据校验出错: {e}")
+            verified = False
+        self._set_phase(volume_progress, 'verified' if verified else 'failed')
+        return verified
+
+    def _verify_live_source(self, source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id):
+        """
+        full_migrate / rbd_diff 复制的是源镜像当前数据而非快照，只有源虚拟机已关机时比较结果才有意义；
+        虚拟机仍在运行时复制期间的写入必然造成差异，跳过校验并告警
+        """
+        if not config.VERIFY_ENABLED:
+            return True
+        if self.source_stopped is None or not self.source_stopped():
+            logging.warning(f"[MIGRATION] {rbd_name} 的源虚拟机未关机，源镜像仍在写入，跳过数据校验")
+            return True
+        return self.verify_volume(source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id)
+
+    def synced_snapshot(self, source_rbd_pool, source_rbd_id, target_rbd_pool, target_rbd_id):
+        """:return: 快照链中最近一次已同步到目标端的快照"""
+        return get_copy_journal().last_snapshot(ImageSpec(self.source_ceph_conf, source_rbd_pool, source_rbd_id),
+                                                ImageSpec(self.target_ceph_conf, target_rbd_pool, target_rbd_id))
+
     def migrate_rbd_data(self, source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id, volume_size, migration_method):
+        volume_progress = self._volume_progress(rbd_name)
+        if self.aborted:
+            logging.warning(f"[MIGRATION] {rbd_name} 的迁移已中止，不再复制: {self.progress.abort_reason}")
+            self._set_phase(volume_progress, 'failed')
+            return False
+        self._set_phase(volume_progress, migration_method)
+        start = time.monotonic()
+        with self._bandwidth_limits(target_rbd_pool, target_rbd_id):
+            result = self._migrate_rbd_data(source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id, volume_size, migration_method, volume_progress)
+        if result:
+            self._record_rate(source_rbd_pool, source_rbd_id, volume_progress, time.monotonic() - start)
+        self._set_phase(volume_progress, 'completed' if result else 'failed')
+        return result
+
+    def _record_rate(self, source_rbd_pool, source_rbd_id, volume_progress, seconds):
+        """记录本次复制的速率供预演使用，命令行后端不上报进度，按源卷实际占用计算"""
+        try:
+            nbytes = volume_progress.bytes_copied if volume_progress is not None else 0
+            if not nbytes:
+                nbytes = self.backend.image_usage(ImageSpec(self.source_ceph_conf, source_rbd_pool, source_rbd_id))[1]
+            if nbytes and seconds > 0:
+                get_copy_journal().record_rate(cluster_id(self.source_ceph_conf), cluster_id(self.target_ceph_conf),
+                                               nbytes, seconds)
+        except Exception as e:
+            logging.warning(f"[MIGRATION] 记录 {source_rbd_pool}/{source_rbd_id} 复制速率失败: {e}")
+
+    def estimate_volume(self, source_rbd_pool, source_rbd_id, migration_method):
+        """
+        预估一个卷需要传输的数据量，只读查询，不创建快照
+        :return: (分配大小, 实际占用, 预计传输字节数)
+        """
+        source = ImageSpec(self.source_ceph_conf, source_rbd_pool, source_rbd_id)
+        provisioned, used = self.backend.image_usage(source)
+        transfer = used
+        if migration_method == 'rbd_diff':
+            # 只同步最新快照之后的差异
+            latest_snapshot = self.get_latest_snapshot(self.source_ceph_conf, source_rbd_pool, source_rbd_id)
+            if latest_snapshot is not None:
+                transfer = sum(length for _, length in self.backend.list_extents(source, from_snap=latest_snapshot))
+        elif migration_method == 'full_migrate' and self.backend.name == 'cli':
+            # rbd export 管道按整个分配大小读出数据
+            transfer = provisioned
+        return provisioned, used, transfer
+
+    def _migrate_rbd_data(self, source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id, volume_size, migration_method, progress):
         if migration_method == 'snapshot':
-            # 创建快照
-            snapshot_name = self.create_rbd_snapshot(source_rbd_pool, source_rbd_id, rbd_name)
+            # 上次中断的复制优先复用原快照续传，否则创建快照
+            snapshot_name = self._resumable_snapshot(ImageSpec(self.source_ceph_conf, source_rbd_pool, source_rbd_id),
+                                                     ImageSpec(self.target_ceph_conf, target_rbd_pool, target_rbd_id))
+            if snapshot_name is None:
+                snapshot_name = self.create_rbd_snapshot(source_rbd_pool, source_rbd_id, rbd_name)
             if snapshot_name is None:
                 return False
             # 从快照迁移数据
-            if not self.migrate_rbd_data_from_snapshot(source_rbd_pool, source_rbd_id, snapshot_name, target_rbd_pool, target_rbd_id, volume_size):
+            if not self.migrate_rbd_data_from_snapshot(source_rbd_pool, source_rbd_id, snapshot_name, target_rbd_pool, target_rbd_id, volume_size, progress):
+                return False
+            if not self.verify_volume(source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id, snapshot_name):
                 return False
             logging.info(f"[MIGRATION] {rbd_name} 数据迁移成功")
             return True
         elif migration_method == 'rbd_diff':
             # 直接进行 RBD diff 数据同步
-            if not self.sync_from_latest_snapshot(self.source_ceph_conf, source_rbd_pool, source_rbd_id, self.target_ceph_conf, target_rbd_pool, target_rbd_id, rbd_name):
+            if not self.sync_from_latest_snapshot(self.source_ceph_conf, source_rbd_pool, source_rbd_id, self.target_ceph_conf, target_rbd_pool, target_rbd_id, rbd_name, progress):
+                return False
+            if not self._verify_live_source(source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id):
                 return False
             logging.info(f"[MIGRATION] {rbd_name} 数据同步成功")
             return True
         elif migration_method == 'full_migrate':
             # 直接进行 RBD 完整卷导入导出
-            if not self.full_migrate_rbd_volume(source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id):
+            if not self.full_migrate_rbd_volume(source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id, progress):
+                return False
+            if not self._verify_live_source(source_rbd_pool, rbd_name, source_rbd_id, target_rbd_pool, target_rbd_id):
                 return False
             logging.info(f"[MIGRATION] {rbd_name} 数据迁移成功")
             return True
@@ -207,37 +374,35 @@ class CephUtils:
             logging.error(f"[MIGRATION] 不支持的迁移方式: {migration_method}")
             return False
 
-    def create_volumes_in_target(self,sources_server, sources_volumes, target_volumes, is_boot_from_volume, concurrency, migration_method):
-        if is_boot_from_volume:
-            sources_all_volumes_info = [
-                {
-                    "name": volume.name,
-                    "volume_id": "volume-" + volume.id,
-                    "is_bootable": volume.is_bootable,
-                    "size": volume.size,
-                    "pool": self.source_ceph_pool,
-                }
-                for volume in sources_volumes
-            ]
-        else:
-            sources_all_volumes_info = [
-                {
-                    "name": f"{sources_server.name}_vda",
-                    "volume_id": f"{sources_server.id}_disk",
-                    "is_bootable": True,
-                    "size": None,
-                    "pool": "vms",
-                }
-            ] + [
-                {
-                    "name": volume.name,
-                    "volume_id": "volume-" + volume.id,
-                    "is_bootable": volume.is_bootable,
-                    "size": volume.size,
-                    "pool": self.source_ceph_pool,
-                }
-                for volume in sources_volumes
-            ]
+    def source_volumes(self, sources_server, sources_volumes, is_boot_from_volume):
+        """
+        :return: 源虚拟机需要复制的 RBD 镜像，从镜像启动时第一个为 vms 池中的系统盘
+        """
+        sources_all_volumes_info = [
+            {
+                "name": volume.name,
+                "volume_id": "volume-" + volume.id,
+                "is_bootable": volume.is_bootable,
+                "size": volume.size,
+                "pool": self.source_ceph_pool,
+            }
+            for volume in sources_volumes
+        ]
+        if not is_boot_from_volume:
+            sources_all_volumes_info.insert(0, {
+                "name": f"{sources_server.name}_vda",
+                "volume_id": f"{sources_server.id}_disk",
+                "is_bootable": True,
+                "size": None,
+                "pool": "vms",
+            })
+        return sources_all_volumes_info
+
+    def pair_volumes(self, sources_server, sources_volumes, target_volumes, is_boot_from_volume):
+        """
+        :return: [(源卷信息, 目标卷信息), ...]
+        """
+        sources_all_volumes_info = self.source_volumes(sources_server, sources_volumes, is_boot_from_volume)
         target_all_volumes_info= [
             {
                 "name": volume.name,
@@ -248,19 +413,75 @@ class CephUtils:
             }
             for volume in target_volumes
         ]
-        zip_all_volumes = zip(sources_all_volumes_info, target_all_volumes_info)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
-            for source,target in zip_all_volumes:
-                future = executor.submit(
-                            self.migrate_rbd_data,
-                            source["pool"],
-                            source["name"],
-                            source["volume_id"],
-                            target["pool"],
-                            target["volume_id"],
-                            target["size"],
-                            migration_method
-                        )
-                if future:
-                    logging.info(f"[MIGRATION] 从{source['name']},到目标{target['volume_id']}迁移成功")
-                
+        return list(zip(sources_all_volumes_info, target_all_volumes_info))
+
+    def direct_volume_pairs(self, sources_server, sources_volumes, is_boot_from_volume):
+        """
+        manage 模式的卷配对：每个源卷对应一个按其镜像名命名的目标镜像，尚未创建，复制时按源卷大小新建
+        :return: [(源卷信息, 目标镜像信息), ...]
+        """
+        return [
+            (source, {
+                "name": source["name"],
+                "volume_id": config.TARGET_IMAGE_PREFIX + source["volume_id"],
+                "is_bootable": source["is_bootable"],
+                "size": source["size"],
+                "pool": self.target_ceph_pool,
+            })
+            for source in self.source_volumes(sources_server, sources_volumes, is_boot_from_volume)
+        ]
+
+    def record_adopted(self, volume_pairs, target_volumes):
+        """目标镜像被 Cinder 纳管并重命名为 volume-<卷 ID> 后，快照链随之改名"""
+        journal = get_copy_journal()
+        for (source, target), volume in zip(volume_pairs, target_volumes):
+            journal.rename_target(ImageSpec(self.target_ceph_conf, target["pool"], target["volume_id"]),
+                                  ImageSpec(self.target_ceph_conf, target["pool"], "volume-" + volume.id))
+
+    def create_volumes_in_target(self, sources_server, sources_volumes, target_volumes, is_boot_from_volume, scheduler, migration_method):
+        """
+        按源卷与目标卷的挂载顺序配对后复制，见 copy_volume_pairs
+        """
+        return self.copy_volume_pairs(self.pair_volumes(sources_server, sources_volumes, target_volumes, is_boot_from_volume),
+                                      scheduler, migration_method)
+
+    def copy_volume_pairs(self, zip_all_volumes, scheduler, migration_method):
+        """
+        把虚拟机的所有卷提交到全局复制队列并等待完成
+        :param zip_all_volumes: [(源卷信息, 目标卷信息), ...]，见 pair_volumes / direct_volume_pairs
+        :param scheduler: scheduler.MigrationScheduler，限制复制总数与每个存储池的复制数
+        :return: 所有卷是否都复制成功
+        """
+        return self.copy_results(self.submit_volume_pairs(zip_all_volumes, scheduler, migration_method))
+
+    def submit_volume_pairs(self, zip_all_volumes, scheduler, migration_method):
+        """
+        把虚拟机的所有卷提交到全局复制队列，不等待
+        :return: [(源卷信息, 目标卷信息, Future), ...]，交给 copy_results 汇总
+        """
+        return [
+            (source, target, scheduler.submit_copy(
+                source["pool"], target["pool"], self.migrate_rbd_data,
+                source["pool"], source["name"], source["volume_id"],
+                target["pool"], target["volume_id"], target["size"], migration_method))
+            for source, target in zip_all_volumes
+        ]
+
+    @staticmethod
+    def copy_results(futures):
+        """
+        等待 submit_volume_pairs 提交的复制结束并记录结果
+        :return: 所有卷是否都复制成功
+        """
+        success = True
+        for source, target, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"[MIGRATION] 从{source['name']},到目标{target['volume_id']}迁移出错: {e}")
+                result = False
+            if result:
+                logging.info(f"[MIGRATION] 从{source['name']},到目标{target['volume_id']}迁移成功")
+            else:
+                success = False
+        return success
@@ -1,4 +1,5 @@
 import os
+import socket
 
 # 配置信息
 UPLOAD_FOLDER = 'uploads'
@@ -10,6 +11,171 @@ DEFAULT_MIGRATE_IMAGE="迁移通用镜像QCOW2"
 DEFAULT_CINDER_TYPE="hdd"
 DEFAULT_SEC_GROUP="all_pass"
 
+# 迁移任务队列：任务状态库与同时执行的任务（批次）数量
+JOB_DB = os.path.join(UPLOAD_FOLDER, 'jobs.db')
+JOB_WORKERS = 2
+
+# 多副本模式：提交任务的 Pod 预检后把虚拟机作为工作项放入共享队列，所有 Pod 的工作线程按租约领取执行。
+# UPLOAD_FOLDER 需为各 Pod 共享的卷（清单、ceph 配置、任务库与队列库都在其中）；
+# WORK_QUEUE_DB 为 ":memory:" 时使用进程内队列（单 Pod）
+DISTRIBUTED = os.environ.get('MIGRATE_DISTRIBUTED', '0') == '1'
+POD_NAME = os.environ.get('POD_NAME') or socket.gethostname()
+WORK_QUEUE_DB = os.environ.get('WORK_QUEUE_DB') or os.path.join(UPLOAD_FOLDER, 'work_queue.db')
+# 每个 Pod 同时迁移的虚拟机数量
+WORKER_SLOTS = int(os.environ.get('WORKER_SLOTS', '4'))
+# 本 Pod 的就近标签，逗号分隔，如 "target:<目标集群 fsid>,az:nova"；工作项带 source:/target:/az: 标签，
+# 标签相交的 Pod 优先领取，其余 Pod 在工作项入队 LOCALITY_WAIT_SECONDS 秒后才可领取；未设置标签的 Pod 不区分
+WORKER_LOCALITY = [label.strip() for label in os.environ.get('MIGRATE_LOCALITY', '').split(',') if label.strip()]
+LOCALITY_WAIT_SECONDS = 30
+# 租约时长（秒），持有者每隔三分之一租约续约一次；租约过期的工作项可被其他 Pod 重新领取，最多执行 LEASE_MAX_ATTEMPTS 次
+LEASE_SECONDS = 60
+LEASE_MAX_ATTEMPTS = 3
+# 失去租约（续约被拒或超过 LEASE_SECONDS 未能续约）的 Pod 立即中止这台虚拟机的复制与创建，停止后在队列中确认；
+# 接手的 Pod 删除目标端残留资源前最多等待这么久（秒），原 Pod 已崩溃、无法确认时等满后再删除
+LEASE_RELEASE_WAIT = LEASE_SECONDS
+# 预检通过的虚拟机每攒够这么多台写入一次队列
+WORK_ENQUEUE_BATCH = 50
+# 队列空闲时的轮询间隔，以及提交任务的 Pod 汇总工作项状态的间隔（秒）
+WORK_POLL_INTERVAL = 2
+# 云环境密码的挂载目录（Kubernetes Secret，每个键一个文件，内容为密码）。工作队列中的任务规格只保存凭据名称
+# （表单中的“凭据名称”），各 Pod 从该目录读取同名文件，文件不存在时读取同名环境变量；多副本模式下必须填写凭据名称
+CREDENTIALS_DIR = os.environ.get('MIGRATE_CREDENTIALS_DIR', '/etc/vm-migrate/credentials')
+
+# 进度 SSE 推送间隔（秒）
+PROGRESS_STREAM_INTERVAL = 2
+
+# 目标端 flavor/子网/镜像缓存的有效期（秒）
+INVENTORY_TTL = 600
 
 # 日志配置
 LOG_FILE = 'vm_batch_migration.log'
+
+# RBD 数据复制后端: cli（rbd export | import 管道）/ librbd（rados/rbd Python 绑定）/ fake（内存模拟）
+RBD_BACKEND = "cli"
+# librbd 复制引擎单次 AIO 读写的缓冲区大小（会按对象大小对齐）
+RBD_COPY_BUFFER_SIZE = 8 * 1024 * 1024
+# librbd 复制引擎每个卷同时在途的读/写请求数
+RBD_COPY_QUEUE_DEPTH = 8
+# 单个卷按已分配区间拆分后并行复制的线程数（仅 librbd 后端生效）
+RBD_COPY_WORKERS = 4
+
+# RBD 镜像大小、快照列表等元数据的缓存有效期（秒），本进程的写操作会立即使对应镜像的缓存失效；为 0 时不缓存
+RBD_METADATA_CACHE_TTL = 300
+
+# 断点续传日志（仅 librbd 后端），记录每个源→目标复制已提交的区间、快照链与复制速率，需放在持久卷上；
+# 该库使用 WAL，多副本模式下 UPLOAD_FOLDER 在网络文件系统上，由环境变量指向每个 Pod 各自的持久卷（PVC），
+# 单副本模式始终放在 UPLOAD_FOLDER 下
+COPY_JOURNAL_DB = (os.environ.get('COPY_JOURNAL_DB') if DISTRIBUTED else None) \
+    or os.path.join(UPLOAD_FOLDER, 'copy_journal.db')
+# 累计多少个已提交区间或间隔多少秒落盘一次
+COPY_JOURNAL_BATCH = 64
+COPY_JOURNAL_FLUSH_INTERVAL = 5
+
+# 预拷贝：一轮所有卷差异总量低于该值（字节）时关闭源虚拟机进入切换
+PRECOPY_DELTA_THRESHOLD = 1024 * 1024 * 1024
+# 预拷贝最多进行的增量轮数
+PRECOPY_MAX_ROUNDS = 5
+
+# OpenStack 连接池：同一云环境的所有迁移线程共享一个已认证连接（令牌过期时自动重新认证），
+# 每个主机保持的 HTTP keep-alive 连接数上限，批量迁移时至少按并发数放大
+OPENSTACK_HTTP_POOL_SIZE = 10
+
+# 虚拟机状态等待：所有待等待的虚拟机由一个轮询线程合并成一次列表调用查询，
+# 无变化时轮询间隔在上下限之间逐步放大
+SERVER_WAIT_MIN_INTERVAL = 2
+SERVER_WAIT_MAX_INTERVAL = 30
+# 创建虚拟机等待 ACTIVE、关机等待 SHUTOFF 的超时时间（秒）
+SERVER_CREATE_TIMEOUT = 1800
+SERVER_STOP_TIMEOUT = 600
+# 目标端空白卷创建的超时（秒）与单台虚拟机准备端口/卷时的并发请求数
+VOLUME_CREATE_TIMEOUT = 300
+PROVISION_PARALLEL_REQUESTS = 8
+
+# 批量迁移的编排方式：threads 每台虚拟机占用一个线程；asyncio 每台虚拟机是一个协程（见 async_orchestrator），
+# 此时并发数为同时在途的虚拟机数量，可设到上千
+ORCHESTRATION = os.environ.get('MIGRATE_ORCHESTRATION', 'threads')
+# 批量迁移的出队顺序（见 batch_order）：manifest 按优先级、清单顺序；lpt 同优先级内先排填写了 deadline 的虚拟机
+# （按最晚开始时间），其余按预计复制耗时从长到短，预计耗时随实测的卷占用与复制速率更新
+BATCH_ORDERING = os.environ.get('MIGRATE_BATCH_ORDERING', 'lpt')
+# 同一源计算节点同时迁移的虚拟机数，达到后先取同优先级中其他节点的虚拟机；0 不限制
+ORDER_PER_SOURCE_HOST = 2
+# 排序所用复制速率的刷新间隔（秒）
+ORDER_RATE_REFRESH = 30
+# lpt 策略开始出队前先积累的虚拟机数，清单读完或第一台放入后超过 ORDER_WARMUP_SECONDS 秒时不再等待；
+# 之后清单边读边出队，新读入的虚拟机参与重新排序
+ORDER_WARMUP = 16
+ORDER_WARMUP_SECONDS = 30
+# asyncio 编排下执行阻塞 SDK 调用的线程数（也是到每个云环境的 keep-alive 连接数），以及执行预拷贝多轮同步的线程数
+ASYNC_API_WORKERS = 32
+ASYNC_BLOCKING_WORKERS = 64
+
+# 目标卷的准备方式：placeholder 先由 Cinder 创建空白卷并挂到目标虚拟机，再重建其 RBD 镜像写入数据；
+# manage 直接把数据写入按源卷命名的目标 RBD 镜像，复制完成后通过 Cinder 卷纳管（manageable volumes）
+# 接管这些镜像并据此创建目标虚拟机，每个卷只写一次（rbd_diff 方式始终使用已有的目标虚拟机）
+TARGET_VOLUME_MODE = "placeholder"
+# manage 模式下目标镜像名称的前缀，纳管后 Cinder 会将其重命名为 volume-<卷 ID>
+TARGET_IMAGE_PREFIX = "migrate-"
+# manage 模式：目标存储池 → 接管该池镜像的 cinder-volume 主机（host@backend#pool）
+# 例: {'volumes': 'cinder@ceph#ceph'}
+CINDER_MANAGE_HOSTS = {}
+# 新建目标 RBD 镜像的对象大小与条带（字节 / 个），条带为 None 时不启用
+RBD_TARGET_OBJECT_SIZE = 4 * 1024 * 1024
+RBD_TARGET_STRIPE_UNIT = None
+RBD_TARGET_STRIPE_COUNT = None
+
+# 两级调度：虚拟机创建（OpenStack API）与 RBD 数据复制分开限流，
+# 复制流同时受总数、每个源存储池、每个目标存储池三个上限约束
+PROVISION_CONCURRENCY = 4
+COPY_CONCURRENCY = 8
+COPY_PER_SOURCE_POOL = 4
+COPY_PER_TARGET_POOL = 4
+
+# Ceph 传输限速：按源集群、目标集群、单个卷分别限制字节/秒（bytes）与请求/秒（ops），None 表示不限
+THROTTLE_LIMITS = {
+    'source': {'bytes': None, 'ops': None},
+    'target': {'bytes': None, 'ops': None},
+    'volume': {'bytes': None, 'ops': None},
+}
+# 分时段限速：命中时段内的 limits 覆盖 THROTTLE_LIMITS 中对应项，时段可跨零点，weekdays 为空表示每天
+# 例: {'name': 'business-hours', 'start': '08:00', 'end': '20:00', 'weekdays': [0, 1, 2, 3, 4],
+#      'limits': {'source': {'bytes': 200 * 1024 * 1024, 'ops': 500}}}
+THROTTLE_PROFILES = []
+# 令牌桶可积攒的突发量（秒数 × 速率）
+THROTTLE_BURST_SECONDS = 1.0
+
+# 迁移后数据校验：按固定大小分块并行计算源快照与目标卷的摘要，只比较已分配区域，不一致的块重新复制
+VERIFY_ENABLED = True
+VERIFY_CHUNK_SIZE = 4 * 1024 * 1024
+VERIFY_WORKERS = 4
+# 发现不一致时是否只重新复制不一致的块（仅 librbd 后端支持），否则直接判定迁移失败
+VERIFY_REPAIR = True
+# 命令行后端是否执行校验：它只能串行读出整个镜像计算摘要，也不支持按块修复，默认跳过校验
+VERIFY_CLI_BACKEND = False
+
+# 帧格式传输（仅 librbd 后端）：None 直连复制；inprocess 进程内编码解码（零区段改为 discard，不压缩）；
+# relay 发送到目标数据中心的 relay.py 服务，由其写入目标集群（零区段省略，数据压缩）
+WIRE_TRANSFER = None
+RELAY_ADDRESS = "127.0.0.1:7700"
+# 中继服务的共享口令，两端必须一致；中继监听非本机地址时必须设置
+RELAY_TOKEN = None
+# 中继证书的 CA 文件（PEM），设置后以 TLS 连接中继并校验证书，中继不在本机时必须设置，否则口令与数据明文传输
+RELAY_TLS_CA = None
+# 压缩算法: zstd / lz4 / zlib / none，未安装时退回 zlib
+WIRE_COMPRESSION = "zstd"
+WIRE_COMPRESSION_LEVEL = 3
+# 每个数据帧读取的块大小
+WIRE_CHUNK_SIZE = 4 * 1024 * 1024
+
+# 迁移清单中 bandwidth_class 列可用的单卷限速档位（字节/秒、请求/秒，None 表示不限）
+BANDWIDTH_CLASSES = {
+    'low': {'bytes': 50 * 1024 * 1024, 'ops': None},
+    'normal': {'bytes': 200 * 1024 * 1024, 'ops': None},
+    'high': {'bytes': None, 'ops': None},
+}
+
+# 迁移预演：没有历史复制记录时假定的单个复制流速率（字节/秒）、估算速率取最近的复制次数、
+# 创建一台目标虚拟机的估计耗时（秒）、并行查询卷占用的线程数
+PLAN_DEFAULT_RATE = 100 * 1024 * 1024
+PLAN_RATE_SAMPLES = 50
+PLAN_PROVISION_SECONDS = 180
+PLAN_WORKERS = 8
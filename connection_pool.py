@@ -0,0 +1,106 @@
+"""
+OpenStack 连接池：每个云环境（按认证参数区分）只调用一次 openstack.connect，
+所有迁移线程共享同一个 keystoneauth 会话与令牌，令牌过期或返回 401 时由 keystoneauth 自动重新认证；
+底层 requests 会话的 keep-alive 连接数按工作线程数设置上限。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import openstack
+from requests.adapters import HTTPAdapter
+import config
+from metrics import instrument_connection
+
+_lock = threading.Lock()
+_connections = {}
+_pool_sizes = {}
+
+
+def _cloud_key(auth_args):
+    # 认证参数（含密码）变化时视为新的云环境，键中只保留摘要
+    return hashlib.sha256(json.dumps(auth_args, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def resolve_password(password_ref):
+    """:return: config.CREDENTIALS_DIR 下同名文件的内容，文件不存在时为同名环境变量"""
+    if not password_ref or os.path.basename(password_ref) != password_ref or password_ref.startswith('.'):
+        raise ValueError(f"无效的凭据名称: {password_ref!r}")
+    path = os.path.join(config.CREDENTIALS_DIR, password_ref)
+    if os.path.isfile(path):
+        with open(path) as f:
+            return f.read().strip()
+    password = os.environ.get(password_ref)
+    if password is None:
+        raise ValueError(f"未找到凭据 {password_ref}：{path} 不存在且未设置同名环境变量")
+    return password
+
+
+def credential_reference(auth_args):
+    """
+    :return: 去掉密码、只保留凭据名称（password_ref）的认证参数，用于写入共享工作队列
+    """
+    if not auth_args.get('password_ref'):
+        raise ValueError(f"{auth_args.get('auth_url')} 未填写凭据名称，多副本模式不会把密码写入工作队列")
+    return {key: value for key, value in auth_args.items() if key != 'password'}
+
+
+def _connect_args(auth_args):
+    """password_ref 替换为密码；已直接给出密码（提交任务的 Pod）时不再读取"""
+    args = {key: value for key, value in auth_args.items() if key != 'password_ref'}
+    if auth_args.get('password_ref') and not args.get('password'):
+        args['password'] = resolve_password(auth_args['password_ref'])
+    return args
+
+
+def _mount_adapter(conn, pool_size):
+    http_session = conn.session.session
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    http_session.mount('https://', adapter)
+    http_session.mount('http://', adapter)
+
+
+def get_connection(auth_args, pool_size=None):
+    """
+    :param pool_size: 需要的 keep-alive 连接数，只会放大已有连接池
+    :return: 该云环境共享的已认证连接（带 SDK 调用计时）
+    """
+    key = _cloud_key(auth_args)
+    pool_size = max(pool_size or 0, config.OPENSTACK_HTTP_POOL_SIZE)
+    with _lock:
+        conn = _connections.get(key)
+        if conn is None:
+            conn = instrument_connection(openstack.connect(**_connect_args(auth_args)), auth_args.get('auth_url'))
+            _connections[key] = conn
+            logging.info(f"[MIGRATION] 已建立到 {auth_args.get('auth_url')} 的共享连接")
+        if pool_size > _pool_sizes.get(key, 0):
+            _mount_adapter(conn, pool_size)
+            _pool_sizes[key] = pool_size
+        return conn
+
+
+def install(auth_args, conn):
+    """
+    为该云环境预先放入连接（例如 benchmark.py 使用的 fake_openstack 连接），之后 get_connection 直接返回它
+    """
+    key = _cloud_key(auth_args)
+    with _lock:
+        _connections[key] = instrument_connection(conn, auth_args.get('auth_url'))
+        _pool_sizes.pop(key, None)
+
+
+def reserve(auth_args, workers):
+    """批量迁移开始前按并发数放大连接池，避免线程等待空闲连接"""
+    get_connection(auth_args, workers)
+
+
+def close_all():
+    with _lock:
+        for conn in _connections.values():
+            try:
+                conn.close()
+            except Exception as e:
+                logging.warning(f"[MIGRATION] 关闭 OpenStack 连接出错: {e}")
+        _connections.clear()
+        _pool_sizes.clear()
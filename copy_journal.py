@@ -0,0 +1,246 @@
+"""
+RBD 复制断点日志：记录每个 源→目标 复制已提交的区间，
+Pod 重启或网络中断后重试时可以从已提交的位置继续，而不是从零开始。
+同时记录每个 源→目标 已同步到目标端的快照链，供增量同步确定起始快照；
+以及按 源集群→目标集群 记录的历次卷复制速率，供预演估算批次耗时。
+"""
+import bisect
+import logging
+import sqlite3
+import threading
+import time
+import config
+from rbd_backend import merge_extents, cluster_id
+
+
+class Checkpoint:
+    """
+    单次复制的断点句柄，供复制引擎判断区间是否已复制，并在写入完成后提交
+    """
+
+    def __init__(self, journal, transfer_id, snap, committed, resumed):
+        self.journal = journal
+        self.transfer_id = transfer_id
+        self.snap = snap
+        self.resumed = resumed
+        self._done = merge_extents(committed)
+        self._starts = [offset for offset, _ in self._done]
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def committed_bytes(self):
+        return sum(length for _, length in self._done)
+
+    def is_committed(self, offset, length):
+        index = bisect.bisect_right(self._starts, offset) - 1
+        if index < 0:
+            return False
+        start, done_length = self._done[index]
+        return offset + length <= start + done_length
+
+    def commit(self, offset, length):
+        """写入完成回调中调用，批量落盘"""
+        with self._lock:
+            self._pending.append((self.transfer_id, offset, length))
+            if len(self._pending) >= config.COPY_JOURNAL_BATCH or \
+                    time.monotonic() - self._last_flush >= config.COPY_JOURNAL_FLUSH_INTERVAL:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._pending:
+            self.journal._insert_extents(self._pending)
+            self._pending = []
+        self._last_flush = time.monotonic()
+
+
+class CopyJournal:
+    """
+    基于 SQLite 的断点日志，默认存放在 UPLOAD_FOLDER 下
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.COPY_JOURNAL_DB
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS transfers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                target TEXT NOT NULL,
+                snap TEXT,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_transfers_pair ON transfers (source, target, status);
+            CREATE TABLE IF NOT EXISTS extents (
+                transfer_id INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_extents_transfer ON extents (transfer_id);
+            CREATE TABLE IF NOT EXISTS snapshot_lineage (
+                source TEXT NOT NULL,
+                target TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                snap TEXT NOT NULL,
+                delta_bytes INTEGER,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_lineage_pair ON snapshot_lineage (source, target, seq);
+            CREATE TABLE IF NOT EXISTS copy_rates (
+                source_cluster TEXT NOT NULL,
+                target_cluster TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                seconds REAL NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_rates_pair ON copy_rates (source_cluster, target_cluster, created_at);
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _key(spec):
+        # 按集群 fsid 而不是配置文件路径记录：每个任务的配置文件上传到各自的目录，重新提交的任务也要找到断点与快照链
+        return f"{cluster_id(spec.conf)}:{spec.pool}/{spec.image}"
+
+    def _insert_extents(self, rows):
+        with self._lock:
+            self._conn.executemany("INSERT INTO extents (transfer_id, offset, length) VALUES (?, ?, ?)", rows)
+            self._conn.execute("UPDATE transfers SET updated_at = ? WHERE id = ?", (time.time(), rows[0][0]))
+            self._conn.commit()
+
+    def find_active(self, source, target):
+        """
+        :return: 未完成的复制记录 (transfer_id, snap)，没有则返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, snap FROM transfers WHERE source = ? AND target = ? AND status = 'running' "
+                "ORDER BY id DESC LIMIT 1", (self._key(source), self._key(target))).fetchone()
+        return row
+
+    def begin(self, source, target, resume=True):
+        """
+        开始（或继续）一次复制，source.snap 为复制所基于的快照
+        :param resume: 为 False 时放弃该源目标对之前未完成的记录
+        :return: Checkpoint
+        """
+        active = self.find_active(source, target) if resume else None
+        if active and active[1] == source.snap:
+            transfer_id = active[0]
+            with self._lock:
+                committed = self._conn.execute("SELECT offset, length FROM extents WHERE transfer_id = ?",
+                                               (transfer_id,)).fetchall()
+            checkpoint = Checkpoint(self, transfer_id, source.snap, committed, resumed=True)
+            logging.info(f"[MIGRATION] 从断点继续复制 {source.path} -> {target.path}，"
+                         f"已提交 {checkpoint.committed_bytes / 1024 ** 2:.1f} MB")
+            return checkpoint
+        self.abandon(source, target)
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO transfers (source, target, snap, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'running', ?, ?)", (self._key(source), self._key(target), source.snap, now, now))
+            self._conn.commit()
+        return Checkpoint(self, cursor.lastrowid, source.snap, [], resumed=False)
+
+    def finish(self, checkpoint):
+        """复制完成，清理区间记录"""
+        checkpoint.flush()
+        self._close_transfer(checkpoint.transfer_id, 'done')
+
+    def abandon(self, source, target):
+        """放弃该源目标对所有未完成的复制"""
+        active = self.find_active(source, target)
+        while active:
+            self._close_transfer(active[0], 'abandoned')
+            active = self.find_active(source, target)
+
+    def _close_transfer(self, transfer_id, status):
+        with self._lock:
+            self._conn.execute("DELETE FROM extents WHERE transfer_id = ?", (transfer_id,))
+            self._conn.execute("UPDATE transfers SET status = ?, updated_at = ? WHERE id = ?",
+                               (status, time.time(), transfer_id))
+            self._conn.commit()
+
+    def record_snapshot(self, source, target, snap, delta_bytes=None):
+        """
+        记录快照 snap 已完整同步到目标端（目标端存在同名快照）
+        :param delta_bytes: 本轮相对上一个快照的差异数据量
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(seq) FROM snapshot_lineage WHERE source = ? AND target = ?",
+                                     (self._key(source), self._key(target))).fetchone()
+            seq = 0 if row[0] is None else row[0] + 1
+            self._conn.execute(
+                "INSERT INTO snapshot_lineage (source, target, seq, snap, delta_bytes, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (self._key(source), self._key(target), seq, snap, delta_bytes, time.time()))
+            self._conn.commit()
+        return seq
+
+    def lineage(self, source, target):
+        """:return: [(seq, snap, delta_bytes), ...] 按同步顺序排列"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT seq, snap, delta_bytes FROM snapshot_lineage WHERE source = ? AND target = ? ORDER BY seq",
+                (self._key(source), self._key(target))).fetchall()
+
+    def last_snapshot(self, source, target):
+        """:return: 最近一次同步到目标端的快照名称，没有则返回 None"""
+        lineage = self.lineage(source, target)
+        return lineage[-1][1] if lineage else None
+
+    def clear_lineage(self, source, target):
+        """目标卷被重建后旧的快照链失效"""
+        with self._lock:
+            self._conn.execute("DELETE FROM snapshot_lineage WHERE source = ? AND target = ?",
+                               (self._key(source), self._key(target)))
+            self._conn.commit()
+
+    def rename_target(self, target, new_target):
+        """目标镜像改名（如被 Cinder 纳管）后，快照链改记到新名称下，之后仍可增量同步"""
+        with self._lock:
+            self._conn.execute("UPDATE snapshot_lineage SET target = ? WHERE target = ?",
+                               (self._key(new_target), self._key(target)))
+            self._conn.commit()
+
+    def record_rate(self, source_cluster, target_cluster, nbytes, seconds):
+        """记录一个卷从开始复制到校验完成的数据量与耗时"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO copy_rates (source_cluster, target_cluster, bytes, seconds, created_at) VALUES (?, ?, ?, ?, ?)",
+                (source_cluster, target_cluster, nbytes, seconds, time.time()))
+            self._conn.commit()
+
+    def copy_rate(self, source_cluster, target_cluster, samples=None):
+        """
+        :param samples: 取最近多少次复制，默认 config.PLAN_RATE_SAMPLES
+        :return: (单个复制流的平均速率 字节/秒, 样本数)，没有记录时速率为 None
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT bytes, seconds FROM copy_rates WHERE source_cluster = ? AND target_cluster = ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (source_cluster, target_cluster, samples or config.PLAN_RATE_SAMPLES)).fetchall()
+        seconds = sum(row[1] for row in rows)
+        return (sum(row[0] for row in rows) / seconds if seconds > 0 else None), len(rows)
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_copy_journal():
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = CopyJournal()
+        return _journal
@@ -0,0 +1,323 @@
+"""
+内存版 OpenStack 连接，接口与 openstacksdk Connection 中迁移流程用到的部分保持一致，
+用于在没有云环境的情况下运行 MigrationManager / OpenStackUtils 的编排逻辑（见 benchmark.py）。
+每次 API 调用按 latency 休眠模拟往返耗时，并按 服务.方法 计数。
+新建的虚拟机经过 boot_seconds 后进入 ACTIVE，关机经过同样时间后进入 SHUTOFF。
+"""
+import functools
+import itertools
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+
+def _api(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._cloud.record(self._service, method.__name__)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+class FakeResource:
+    """SDK 资源对象：属性访问与 to_dict()"""
+
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+    def to_dict(self):
+        return {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+
+
+class FakeServer(FakeResource):
+    def __init__(self, status, **attrs):
+        super().__init__(**attrs)
+        self._status = status
+        self._next = None
+        self._updated_at = time.time()
+
+    def transition(self, status, delay):
+        """delay 秒后进入 status，delay 为 0 时立即生效"""
+        if delay:
+            self._next = (status, time.time() + delay)
+        else:
+            self._status, self._next, self._updated_at = status, None, time.time()
+
+    def _advance(self):
+        if self._next is not None and time.time() >= self._next[1]:
+            (self._status, self._updated_at), self._next = self._next, None
+
+    @property
+    def status(self):
+        self._advance()
+        return self._status
+
+    @property
+    def updated_at(self):
+        self._advance()
+        return self._updated_at
+
+    def to_dict(self):
+        result = super().to_dict()
+        result['status'] = self.status
+        return result
+
+
+class FakeResponse:
+    def __init__(self, body=None):
+        self._body = body or {}
+        self.status_code = 200
+        self.text = ''
+
+    def json(self):
+        return self._body
+
+
+class _Service:
+    def __init__(self, cloud, service):
+        self._cloud = cloud
+        self._service = service
+
+
+class FakeCompute(_Service):
+    @_api
+    def servers(self, details=True, changes_since=None, **filters):
+        servers = list(self._cloud.servers.values())
+        if changes_since:
+            since = datetime.strptime(changes_since, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+            servers = [server for server in servers if server.updated_at >= since]
+        return iter(servers)
+
+    @_api
+    def get_server(self, server_id):
+        return self._cloud.servers[server_id]
+
+    @_api
+    def find_server(self, name_or_id):
+        server = self._cloud.servers.get(name_or_id)
+        if server is None:
+            server = next((s for s in self._cloud.servers.values() if s.name == name_or_id), None)
+        return server
+
+    @_api
+    def create_server(self, name, flavor_id, networks=None, block_device_mapping_v2=None, availability_zone=None,
+                      **attrs):
+        cloud = self._cloud
+        flavor = next(f for f in cloud.flavors.values() if f.id == flavor_id)
+        volumes = [mapping['uuid'] for mapping in block_device_mapping_v2 or []]
+        addresses = {}
+        for network in networks or []:
+            port = cloud.ports.get(network.get('port'))
+            if port is not None:
+                addresses.setdefault(port.network_id, []).extend(
+                    {'addr': fixed_ip['ip_address']} for fixed_ip in port.fixed_ips)
+        server = cloud.add_server(name, flavor, image_id=None, volume_ids=volumes, addresses=addresses,
+                                  status='BUILD', availability_zone=availability_zone)
+        server.metadata = dict(attrs.get('metadata') or {})
+        for network in networks or []:
+            if network.get('port') in cloud.ports:
+                cloud.ports[network['port']].device_id = server.id
+        server.transition('ACTIVE', cloud.boot_seconds)
+        return server
+
+    @_api
+    def delete_server(self, server):
+        self._cloud.servers.pop(getattr(server, 'id', server), None)
+
+    @_api
+    def wait_for_delete(self, server, interval=None, wait=None):
+        return server
+
+    @_api
+    def stop_server(self, server_id):
+        self._cloud.servers[server_id].transition('SHUTOFF', self._cloud.boot_seconds)
+
+    @_api
+    def flavors(self, **filters):
+        return iter(list(self._cloud.flavors.values()))
+
+    @_api
+    def create_flavor(self, name, ram, vcpus, disk, **attrs):
+        return self._cloud.add_flavor(name, ram, vcpus, disk)
+
+
+class FakeNetwork(_Service):
+    @_api
+    def ports(self, device_id=None, **filters):
+        ports = list(self._cloud.ports.values())
+        if device_id is not None:
+            ports = [port for port in ports if port.device_id == device_id]
+        return iter(ports)
+
+    @_api
+    def subnets(self, **filters):
+        return iter(list(self._cloud.subnets.values()))
+
+    @_api
+    def get_subnet(self, subnet_id):
+        return self._cloud.subnets[subnet_id]
+
+    @_api
+    def create_port(self, network_id, fixed_ips, name=None, description=None, **attrs):
+        port = self._cloud.add_port(network_id, fixed_ips, name=name)
+        port.description = description
+        return port
+
+    @_api
+    def delete_port(self, port):
+        self._cloud.ports.pop(getattr(port, 'id', port), None)
+
+    @_api
+    def find_security_group(self, name):
+        return FakeResource(id=name, name=name)
+
+
+class FakeBlockStorage(_Service):
+    @_api
+    def volumes(self, details=True, **filters):
+        return iter(list(self._cloud.volumes.values()))
+
+    @_api
+    def get_volume(self, volume_id):
+        # 创建与纳管在下一次查询时完成
+        volume = self._cloud.volumes[volume_id]
+        if volume.status in ('creating', 'managing'):
+            volume.status = 'available'
+        return volume
+
+    @_api
+    def create_volume(self, name, size, volume_type=None, metadata=None, **attrs):
+        volume = self._cloud.add_volume(name, size, status='creating')
+        volume.metadata = dict(metadata or {})
+        return volume
+
+    @_api
+    def wait_for_status(self, volume, status='available', failures=None, interval=None, wait=None):
+        volume.status = status
+        return volume
+
+    @_api
+    def delete_volume(self, volume):
+        self._cloud.volumes.pop(getattr(volume, 'id', volume), None)
+
+    @_api
+    def post(self, url, json=None, raise_exc=False, **kwargs):
+        """卷操作（os-set_bootable 等）与卷纳管"""
+        body = json or {}
+        if url == '/manageable_volumes':
+            request = body['volume']
+            volume = self._cloud.add_volume(request.get('name'), self._cloud.manage_size, status='managing',
+                                            bootable=request.get('bootable', False))
+            return FakeResponse({'volume': {'id': volume.id}})
+        action = body.get('os-set_bootable')
+        if action is not None:
+            self._cloud.volumes[url.split('/')[2]].is_bootable = action['bootable']
+        return FakeResponse()
+
+
+class FakeImage(_Service):
+    @_api
+    def images(self, **filters):
+        return iter(list(self._cloud.images.values()))
+
+
+class _FakeHttpSession:
+    def mount(self, prefix, adapter):
+        pass
+
+
+class FakeCloud:
+    """
+    一个云环境的全部资源与 API 调用计数
+    :param latency: 每次 API 调用的模拟耗时（秒）
+    :param boot_seconds: 虚拟机从创建到 ACTIVE、从关机到 SHUTOFF 的耗时（秒）
+    """
+
+    def __init__(self, name, latency=0.0, boot_seconds=0.0):
+        self.name = name
+        self.latency = latency
+        self.boot_seconds = boot_seconds
+        # 纳管卷的大小（GB），模拟环境不关心实际大小
+        self.manage_size = 1
+        self.project_id = uuid.uuid4().hex
+        self.servers = {}
+        self.volumes = {}
+        self.ports = {}
+        self.subnets = {}
+        self.flavors = {}
+        self.images = {}
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _id(self, kind):
+        return f"{self.name}-{kind}-{next(self._ids):08d}"
+
+    def record(self, service, method):
+        with self._lock:
+            key = f"{service}.{method}"
+            self._calls[key] = self._calls.get(key, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def calls(self):
+        """:return: {'服务.方法': 调用次数}"""
+        with self._lock:
+            return dict(self._calls)
+
+    def connect(self):
+        """:return: 供 connection_pool.install 使用的连接对象"""
+        return FakeConnection(self)
+
+    def add_flavor(self, name, ram=2048, vcpus=2, disk=20):
+        flavor = FakeResource(id=self._id('flavor'), name=name, ram=ram, vcpus=vcpus, disk=disk, ephemeral=0, swap=0)
+        self.flavors[flavor.id] = flavor
+        return flavor
+
+    def add_subnet(self, cidr, network_id=None):
+        subnet = FakeResource(id=self._id('subnet'), cidr=cidr, network_id=network_id or self._id('net'))
+        self.subnets[subnet.id] = subnet
+        return subnet
+
+    def add_image(self, name, properties=None):
+        image = FakeResource(id=self._id('image'), name=name, properties=properties or {})
+        self.images[image.id] = image
+        return image
+
+    def add_volume(self, name, size, status='available', bootable=False, image_id=None):
+        volume = FakeResource(id=self._id('volume'), name=name, size=size, status=status, is_bootable=bootable,
+                              volume_image_metadata={'image_id': image_id} if image_id else {}, metadata={})
+        self.volumes[volume.id] = volume
+        return volume
+
+    def add_port(self, network_id, fixed_ips, device_id=None, name=None):
+        port = FakeResource(id=self._id('port'), name=name, network_id=network_id, fixed_ips=list(fixed_ips),
+                            device_id=device_id, project_id=self.project_id, description=None)
+        self.ports[port.id] = port
+        return port
+
+    def add_server(self, name, flavor, image_id=None, volume_ids=(), addresses=None, status='ACTIVE',
+                   availability_zone=None):
+        server = FakeServer(status, id=self._id('server'), name=name, addresses=addresses or {},
+                            availability_zone=availability_zone,
+                            image={'id': image_id} if image_id else {},
+                            attached_volumes=[{'id': volume_id} for volume_id in volume_ids], metadata={},
+                            flavor={'original_name': flavor.name, 'ram': flavor.ram, 'vcpus': flavor.vcpus,
+                                    'disk': flavor.disk, 'ephemeral': flavor.ephemeral, 'swap': flavor.swap})
+        self.servers[server.id] = server
+        return server
+
+
+class FakeConnection:
+    def __init__(self, cloud):
+        self.cloud = cloud
+        self.current_project_id = cloud.project_id
+        self.session = FakeResource(session=_FakeHttpSession())
+        self.compute = FakeCompute(cloud, 'compute')
+        self.network = FakeNetwork(cloud, 'network')
+        self.block_storage = FakeBlockStorage(cloud, 'block_storage')
+        self.image = FakeImage(cloud, 'image')
+
+    def close(self):
+        pass
@@ -0,0 +1,293 @@
+"""
+内存版 rados/rbd 模块，接口与 python3-rados、python3-rbd 中用到的部分保持一致，
+用于在没有 Ceph 集群的环境下运行 NativeRbdBackend 的复制逻辑。
+数据按对象存放，快照与当前镜像共享未修改的对象。
+"""
+import sys
+import threading
+from datetime import datetime
+from rbd_backend import NativeRbdBackend
+
+DEFAULT_ORDER = 22
+
+
+class Error(Exception):
+    pass
+
+
+class ImageNotFound(Error):
+    pass
+
+
+class ImageExists(Error):
+    pass
+
+
+# conffile -> pool -> image name -> _ImageData
+_clusters = {}
+_lock = threading.RLock()
+
+
+def reset():
+    """清空所有内存集群"""
+    with _lock:
+        _clusters.clear()
+
+
+class _Snap:
+    def __init__(self, snap_id, size, objects):
+        self.id = snap_id
+        self.size = size
+        self.objects = dict(objects)
+        self.timestamp = datetime.now()
+
+
+class _ImageData:
+    def __init__(self, size, order):
+        self.size = size
+        self.order = order
+        self.objects = {}
+        self.snaps = {}
+        self.next_snap_id = 1
+
+    @property
+    def object_size(self):
+        return 1 << self.order
+
+
+class Rados:
+    def __init__(self, conffile=None, **kwargs):
+        self.conffile = conffile
+
+    def connect(self):
+        with _lock:
+            _clusters.setdefault(self.conffile, {})
+
+    def shutdown(self):
+        pass
+
+    def open_ioctx(self, pool):
+        with _lock:
+            return Ioctx(_clusters.setdefault(self.conffile, {}).setdefault(pool, {}))
+
+
+class Ioctx:
+    def __init__(self, images):
+        self.images = images
+
+    def close(self):
+        pass
+
+
+class RBD:
+    def create(self, ioctx, name, size, order=None, old_format=True, **kwargs):
+        with _lock:
+            if name in ioctx.images:
+                raise ImageExists(name)
+            ioctx.images[name] = _ImageData(size, order or DEFAULT_ORDER)
+
+    def remove(self, ioctx, name):
+        with _lock:
+            if ioctx.images.pop(name, None) is None:
+                raise ImageNotFound(name)
+
+    def list(self, ioctx):
+        with _lock:
+            return list(ioctx.images)
+
+
+class Completion:
+    def __init__(self, ret):
+        self.ret = ret
+
+    def get_return_value(self):
+        return self.ret
+
+    def is_complete(self):
+        return True
+
+    def wait_for_complete_and_cb(self):
+        pass
+
+
+class Image:
+    def __init__(self, ioctx, name, snapshot=None, read_only=False):
+        with _lock:
+            self._data = ioctx.images.get(name)
+            if self._data is None:
+                raise ImageNotFound(name)
+            if snapshot is not None and snapshot not in self._data.snaps:
+                raise ImageNotFound(f"{name}@{snapshot}")
+        self.name = name
+        self.snapshot = snapshot
+        self.read_only = read_only or snapshot is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def _state(self):
+        """返回 (size, objects)，快照打开时返回快照时刻的内容"""
+        if self.snapshot is not None:
+            snap = self._data.snaps[self.snapshot]
+            return snap.size, snap.objects
+        return self._data.size, self._data.objects
+
+    def _check_writable(self):
+        if self.read_only:
+            raise Error(f"镜像 {self.name} 以只读方式打开")
+
+    def size(self):
+        return self._state()[0]
+
+    def stat(self):
+        return {'size': self.size(), 'obj_size': self._data.object_size, 'order': self._data.order}
+
+    def read(self, offset, length):
+        with _lock:
+            size, objects = self._state()
+            length = max(0, min(length, size - offset))
+            obj_size = self._data.object_size
+            out = bytearray(length)
+            pos = offset
+            while pos < offset + length:
+                index, start = divmod(pos, obj_size)
+                n = min(obj_size - start, offset + length - pos)
+                obj = objects.get(index)
+                if obj is not None:
+                    out[pos - offset:pos - offset + n] = obj[start:start + n]
+                pos += n
+            return bytes(out)
+
+    def write(self, data, offset):
+        self._check_writable()
+        with _lock:
+            obj_size = self._data.object_size
+            if offset + len(data) > self._data.size:
+                raise Error("写入超出镜像大小")
+            pos = 0
+            while pos < len(data):
+                index, start = divmod(offset + pos, obj_size)
+                n = min(obj_size - start, len(data) - pos)
+                if start == 0 and n == obj_size:
+                    obj = bytes(data[pos:pos + n])
+                else:
+                    # 对象为不可变 bytes，写入时生成新对象，快照中的旧对象不受影响
+                    obj = bytearray(self._data.objects.get(index) or bytes(obj_size))
+                    obj[start:start + n] = data[pos:pos + n]
+                    obj = bytes(obj)
+                self._data.objects[index] = obj
+                pos += n
+            return len(data)
+
+    def discard(self, offset, length):
+        self._check_writable()
+        with _lock:
+            obj_size = self._data.object_size
+            pos = offset
+            while pos < offset + length:
+                index, start = divmod(pos, obj_size)
+                n = min(obj_size - start, offset + length - pos)
+                if start == 0 and n == obj_size:
+                    self._data.objects.pop(index, None)
+                elif index in self._data.objects:
+                    obj = bytearray(self._data.objects[index])
+                    obj[start:start + n] = bytes(n)
+                    self._data.objects[index] = bytes(obj)
+                pos += n
+            return 0
+
+    def write_zeroes(self, offset, length, zero_flags=0):
+        # 与 librbd 一致：任意区间都确实置零（本模拟的 discard 本身也会清零部分对象）
+        return self.discard(offset, length)
+
+    def aio_read(self, offset, length, oncomplete):
+        data = self.read(offset, length)
+        completion = Completion(len(data))
+        oncomplete(completion, data)
+        return completion
+
+    def aio_write(self, data, offset, oncomplete):
+        try:
+            ret = self.write(data, offset)
+        except Error:
+            ret = -5
+        completion = Completion(ret)
+        oncomplete(completion)
+        return completion
+
+    def resize(self, size):
+        self._check_writable()
+        with _lock:
+            self._data.size = size
+            last = -(-size // self._data.object_size)
+            for index in [i for i in self._data.objects if i >= last]:
+                del self._data.objects[index]
+
+    def diff_iterate(self, offset, length, from_snapshot, iterate_cb, include_parent=True, whole_object=False):
+        """按对象粒度报告 [offset, offset+length) 内相对 from_snapshot 有变化的区间"""
+        with _lock:
+            size, objects = self._state()
+            base = self._data.snaps[from_snapshot].objects if from_snapshot else {}
+            obj_size = self._data.object_size
+            changes = []
+            end = min(offset + length, size)
+            first, last = offset // obj_size, -(-end // obj_size)
+            # 只检查两边存在的对象，大而稀疏的镜像不逐个对象遍历
+            for index in sorted(i for i in set(objects) | set(base) if first <= i < last):
+                current = objects.get(index)
+                if current is base.get(index):
+                    continue
+                start = max(index * obj_size, offset)
+                changes.append((start, min((index + 1) * obj_size, end) - start, current is not None))
+        for change in changes:
+            iterate_cb(*change)
+        return 0
+
+    def create_snap(self, name):
+        with _lock:
+            if self.snapshot is not None:
+                raise Error("不能在快照上创建快照")
+            if name in self._data.snaps:
+                raise ImageExists(f"{self.name}@{name}")
+            self._data.snaps[name] = _Snap(self._data.next_snap_id, self._data.size, self._data.objects)
+            self._data.next_snap_id += 1
+
+    def remove_snap(self, name):
+        with _lock:
+            if self._data.snaps.pop(name, None) is None:
+                raise ImageNotFound(f"{self.name}@{name}")
+
+    def rollback_to_snap(self, name):
+        self._check_writable()
+        with _lock:
+            snap = self._data.snaps.get(name)
+            if snap is None:
+                raise ImageNotFound(f"{self.name}@{name}")
+            self._data.size = snap.size
+            self._data.objects = dict(snap.objects)
+
+    def list_snaps(self):
+        with _lock:
+            return [{'id': snap.id, 'size': snap.size, 'name': name} for name, snap in self._data.snaps.items()]
+
+    def get_snap_timestamp(self, snap_id):
+        with _lock:
+            for snap in self._data.snaps.values():
+                if snap.id == snap_id:
+                    return snap.timestamp
+        raise ImageNotFound(str(snap_id))
+
+
+class FakeRbdBackend(NativeRbdBackend):
+    """使用内存集群的 NativeRbdBackend，不需要任何 Ceph 环境"""
+    name = 'fake'
+
+    def __init__(self, **kwargs):
+        module = sys.modules[__name__]
+        super().__init__(module, module, **kwargs)
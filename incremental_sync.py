@@ -0,0 +1,82 @@
+import logging
+import config
+
+
+class IncrementalSync:
+    """
+    预拷贝 + 切换：虚拟机运行期间先做一次基础全量复制，再按快照链逐轮同步差异，
+    直到一轮的差异量低于阈值；随后关闭源虚拟机，做最后一轮很小的差异同步。
+    停机时间只取决于最后一轮的差异量，而不是磁盘大小。
+    每轮差异提交后删除上一轮的快照，两端始终只保留快照链中最新的一个。
+    """
+
+    def __init__(self, ceph_utils, volume_pairs, scheduler, delta_threshold=None, max_rounds=None):
+        """
+        :param ceph_utils: CephUtils 实例
+        :param volume_pairs: CephUtils.pair_volumes 返回的 [(源卷信息, 目标卷信息), ...]
+        :param scheduler: scheduler.MigrationScheduler，每轮各卷的同步都进入全局复制队列
+        :param delta_threshold: 所有卷一轮差异总量低于该值（字节）时进入切换
+        :param max_rounds: 预拷贝最多进行的增量轮数
+        """
+        self.ceph_utils = ceph_utils
+        self.volume_pairs = volume_pairs
+        self.scheduler = scheduler
+        self.delta_threshold = config.PRECOPY_DELTA_THRESHOLD if delta_threshold is None else delta_threshold
+        self.max_rounds = config.PRECOPY_MAX_ROUNDS if max_rounds is None else max_rounds
+
+    def _for_each_volume(self, fn):
+        futures = [self.scheduler.submit_copy(source["pool"], target["pool"], fn, source, target)
+                   for source, target in self.volume_pairs]
+        return [future.result() for future in futures]
+
+    def _base_copy(self, source, target):
+        return self.ceph_utils.migrate_rbd_data(source["pool"], source["name"], source["volume_id"],
+                                                target["pool"], target["volume_id"], target["size"], 'snapshot')
+
+    def _verify(self, source, target):
+        # 源虚拟机已关机，目标端数据应与快照链中最后一个快照一致
+        snapshot_name = self.ceph_utils.synced_snapshot(source["pool"], source["volume_id"], target["pool"], target["volume_id"])
+        return self.ceph_utils.verify_volume(source["pool"], source["name"], source["volume_id"],
+                                             target["pool"], target["volume_id"], snapshot_name)
+
+    def _diff_round(self, label):
+        deltas = self._for_each_volume(
+            lambda source, target: self.ceph_utils.sync_snapshot_diff(
+                source["pool"], source["name"], source["volume_id"], target["pool"], target["volume_id"], label))
+        if any(delta is None for delta in deltas):
+            return None
+        return sum(deltas)
+
+    def run(self, stop_source):
+        """
+        :param stop_source: 关闭源虚拟机的回调，成功关机返回 True
+        :return: 切换是否成功
+        """
+        if not all(self._for_each_volume(self._base_copy)):
+            logging.error("[MIGRATION] 预拷贝基础全量复制失败")
+            return False
+        for round_index in range(1, self.max_rounds + 1):
+            delta = self._diff_round(f"precopy{round_index}")
+            if delta is None:
+                logging.error(f"[MIGRATION] 预拷贝第 {round_index} 轮增量同步失败")
+                return False
+            logging.info(f"[MIGRATION] 预拷贝第 {round_index} 轮差异 {delta / 1024 ** 2:.1f} MB")
+            if delta <= self.delta_threshold:
+                break
+        if self.ceph_utils.aborted:
+            # 迁移已被中止（如租约已由其他 Pod 接手），不能再关闭源虚拟机
+            logging.error("[MIGRATION] 迁移已中止，放弃切换")
+            return False
+        logging.info("[MIGRATION] 预拷贝完成，关闭源虚拟机进入切换")
+        if not stop_source():
+            logging.error("[MIGRATION] 源虚拟机关闭失败，放弃切换")
+            return False
+        delta = self._diff_round("cutover")
+        if delta is None:
+            logging.error("[MIGRATION] 切换阶段最终增量同步失败")
+            return False
+        logging.info(f"[MIGRATION] 切换完成，最终差异 {delta / 1024 ** 2:.1f} MB")
+        if not all(self._for_each_volume(self._verify)):
+            logging.error("[MIGRATION] 切换后数据校验失败")
+            return False
+        return True
@@ -0,0 +1,206 @@
+"""
+批次级别的资源缓存：
+目标端 flavor、子网、镜像各用一次列表调用加载，整个批次内共享，按 TTL 过期重新加载；
+源端 IP → 虚拟机索引一次遍历全部虚拟机建立，之后按 changes-since 增量刷新。
+"""
+import ipaddress
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import config
+
+
+class TargetInventory:
+    def __init__(self, ttl=None):
+        self.ttl = config.INVENTORY_TTL if ttl is None else ttl
+        self._lock = threading.RLock()
+        self._loaded_at = {}
+        self._flavors = {}
+        self._subnets_by_cidr = {}
+        self._subnet_networks = []
+        self._images_by_id = {}
+        self._images_by_name = {}
+        self._name_locks = {}
+
+    def _fresh(self, section):
+        loaded_at = self._loaded_at.get(section)
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl
+
+    def invalidate(self, section=None):
+        """:param section: flavors / subnets / images，为空时全部失效"""
+        with self._lock:
+            if section is None:
+                self._loaded_at.clear()
+            else:
+                self._loaded_at.pop(section, None)
+
+    def _name_lock(self, key):
+        with self._lock:
+            return self._name_locks.setdefault(key, threading.Lock())
+
+    # flavor
+
+    def _load_flavors(self, conn):
+        if not self._fresh('flavors'):
+            self._flavors = {flavor.name: flavor for flavor in conn.compute.flavors()}
+            self._loaded_at['flavors'] = time.monotonic()
+            logging.info(f"[MIGRATION] 已加载目标环境 flavor {len(self._flavors)} 个")
+
+    def flavor(self, conn, name):
+        with self._lock:
+            self._load_flavors(conn)
+            return self._flavors.get(name)
+
+    def add_flavor(self, flavor):
+        with self._lock:
+            self._flavors[flavor.name] = flavor
+
+    def get_or_create_flavor(self, conn, name, create):
+        """
+        同名 flavor 的查找与创建串行执行，避免并发迁移重复创建
+        :param create: 不存在时调用，返回新建的 flavor 或 None
+        """
+        with self._name_lock(f"flavor:{name}"):
+            flavor = self.flavor(conn, name)
+            if flavor is None:
+                flavor = create()
+                if flavor is not None:
+                    self.add_flavor(flavor)
+            return flavor
+
+    # 子网
+
+    def _load_subnets(self, conn):
+        if not self._fresh('subnets'):
+            by_cidr = {}
+            networks = []
+            for subnet in conn.network.subnets():
+                by_cidr.setdefault(subnet.cidr, []).append(subnet)
+                try:
+                    networks.append((ipaddress.ip_network(subnet.cidr, strict=False), subnet))
+                except ValueError:
+                    continue
+            # 前缀越长越精确，最长前缀优先匹配
+            networks.sort(key=lambda item: item[0].prefixlen, reverse=True)
+            self._subnets_by_cidr = by_cidr
+            self._subnet_networks = networks
+            self._loaded_at['subnets'] = time.monotonic()
+            logging.info(f"[MIGRATION] 已加载目标环境子网 {sum(len(s) for s in by_cidr.values())} 个")
+
+    def find_subnet(self, conn, cidr, ip_address=None):
+        """
+        先按 CIDR 精确匹配，找不到时按 IP 地址做最长前缀匹配
+        :return: 目标子网，找不到返回 None
+        """
+        with self._lock:
+            self._load_subnets(conn)
+            subnets = self._subnets_by_cidr.get(cidr)
+            if subnets:
+                return subnets[0]
+            if ip_address:
+                address = ipaddress.ip_address(ip_address)
+                for network, subnet in self._subnet_networks:
+                    if address.version == network.version and address in network:
+                        return subnet
+        return None
+
+    # 镜像
+
+    def _load_images(self, conn):
+        if not self._fresh('images'):
+            self._images_by_id = {}
+            self._images_by_name = {}
+            for image in conn.image.images():
+                self._images_by_id[image.id] = image
+                self._images_by_name.setdefault(image.name, image)
+            self._loaded_at['images'] = time.monotonic()
+            logging.info(f"[MIGRATION] 已加载目标环境镜像 {len(self._images_by_id)} 个")
+
+    def image(self, conn, name_or_id):
+        with self._lock:
+            self._load_images(conn)
+            return self._images_by_id.get(name_or_id) or self._images_by_name.get(name_or_id)
+
+
+class ServerIpIndex:
+    """
+    源端 IP 地址 → 虚拟机索引，替代逐个 IP 遍历所有虚拟机的查找方式
+    """
+    # 增量刷新时向前多取一段时间，避免时钟偏差漏掉变更
+    CLOCK_SKEW = timedelta(seconds=60)
+
+    def __init__(self, ttl=None):
+        self.ttl = config.INVENTORY_TTL if ttl is None else ttl
+        self._lock = threading.RLock()
+        self._by_ip = {}
+        self._ips_by_server = {}
+        self._synced_at = None
+        self._refreshed_at = None
+
+    @staticmethod
+    def _server_ips(server):
+        return {address['addr'] for addresses in (server.addresses or {}).values() for address in addresses}
+
+    def _index(self, server):
+        for ip in self._ips_by_server.pop(server.id, ()):
+            if self._by_ip.get(ip) is not None and self._by_ip[ip].id == server.id:
+                del self._by_ip[ip]
+        if server.status == 'DELETED':
+            return
+        ips = self._server_ips(server)
+        self._ips_by_server[server.id] = ips
+        for ip in ips:
+            self._by_ip[ip] = server
+
+    def build(self, conn):
+        """一次列表调用重建整个索引"""
+        with self._lock:
+            synced_at = datetime.now(timezone.utc)
+            self._by_ip = {}
+            self._ips_by_server = {}
+            for server in conn.compute.servers(details=True):
+                self._index(server)
+            self._synced_at = synced_at
+            self._refreshed_at = time.monotonic()
+            logging.info(f"[MIGRATION] 已建立源端 IP 索引，虚拟机 {len(self._ips_by_server)} 台，IP {len(self._by_ip)} 个")
+
+    def refresh(self, conn):
+        """只拉取上次同步之后有变化（含已删除）的虚拟机"""
+        with self._lock:
+            if self._synced_at is None:
+                return self.build(conn)
+            synced_at = datetime.now(timezone.utc)
+            changes_since = (self._synced_at - self.CLOCK_SKEW).strftime('%Y-%m-%dT%H:%M:%SZ')
+            changed = 0
+            for server in conn.compute.servers(details=True, changes_since=changes_since):
+                self._index(server)
+                changed += 1
+            self._synced_at = synced_at
+            self._refreshed_at = time.monotonic()
+            logging.info(f"[MIGRATION] 源端 IP 索引增量刷新，变化虚拟机 {changed} 台")
+
+    def _ensure_fresh(self, conn):
+        if self._synced_at is None:
+            self.build(conn)
+        elif time.monotonic() - self._refreshed_at >= self.ttl:
+            self.refresh(conn)
+
+    def lookup(self, conn, ip_address):
+        """
+        :return: 拥有该 IP 的虚拟机，找不到返回 None；未命中时增量刷新一次再查
+        """
+        return self.resolve(conn, [ip_address])[ip_address]
+
+    def resolve(self, conn, ip_addresses):
+        """
+        批量解析一列 IP，未命中的 IP 合并成一次增量刷新
+        :return: {ip: 虚拟机或 None}
+        """
+        with self._lock:
+            self._ensure_fresh(conn)
+            result = {ip: self._by_ip.get(ip) for ip in ip_addresses}
+            if any(server is None for server in result.values()):
+                self.refresh(conn)
+                result = {ip: server or self._by_ip.get(ip) for ip, server in result.items()}
+            return result
@@ -0,0 +1,153 @@
+"""
+迁移任务队列：提交后立即返回任务 ID，任务在有界线程池中后台执行，
+任务状态保存在 UPLOAD_FOLDER 下的 SQLite 中，可查询、列出和取消。
+多副本模式下各 Pod 共享同一个任务库，每个任务记录提交它的 Pod（owner）。
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+import concurrent.futures
+import config
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_INTERRUPTED = 'interrupted'
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+
+class JobManager:
+    def __init__(self, db_path=None, max_workers=None):
+        self.db_path = db_path or config.JOB_DB
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                dedup_key TEXT,
+                status TEXT NOT NULL,
+                params TEXT,
+                failed_vms TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if 'owner' not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        # 进程重启时本 Pod 仍处于排队/运行中的任务已无法继续，标记为中断；其他 Pod 的任务不受影响
+        self._conn.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE status IN (?, ?) "
+                           "AND (owner IS NULL OR owner = ?)",
+                           (JOB_INTERRUPTED, time.time()) + ACTIVE_STATUSES + (config.POD_NAME,))
+        self._conn.commit()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or config.JOB_WORKERS,
+                                                               thread_name_prefix='migration-job')
+        self._cancel_events = {}
+        self._futures = {}
+
+    def interrupted(self):
+        """:return: 本 Pod 提交、因进程重启而中断的任务 ID 列表"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM jobs WHERE status = ? AND owner = ?",
+                                      (JOB_INTERRUPTED, config.POD_NAME)).fetchall()
+        return [row['id'] for row in rows]
+
+    def new_job_id(self):
+        return uuid.uuid4().hex
+
+    def _update(self, job_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", tuple(fields.values()) + (job_id,))
+            self._conn.commit()
+
+    def find_active(self, dedup_key):
+        """:return: 相同去重键仍在排队或运行中的任务 ID"""
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM jobs WHERE dedup_key = ? AND status IN (?, ?)",
+                                     (dedup_key,) + ACTIVE_STATUSES).fetchone()
+        return row['id'] if row else None
+
+    def submit(self, job_id, name, fn, params=None, dedup_key=None):
+        """
+        提交任务
+        :param fn: fn(cancel_event) 执行迁移，返回迁移失败的虚拟机列表
+        :param params: 任务参数（不含密码），仅用于展示
+        """
+        cancel_event = threading.Event()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, name, dedup_key, status, params, owner, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, name, dedup_key, JOB_QUEUED, json.dumps(params or {}, ensure_ascii=False), config.POD_NAME,
+                 time.time()))
+            self._conn.commit()
+            self._cancel_events[job_id] = cancel_event
+            self._futures[job_id] = self._executor.submit(self._run, job_id, fn, cancel_event)
+        logging.info(f"[MIGRATION] 任务 {job_id} ({name}) 已提交")
+        return job_id
+
+    def _run(self, job_id, fn, cancel_event):
+        if cancel_event.is_set():
+            return
+        self._update(job_id, status=JOB_RUNNING, started_at=time.time())
+        logging.info(f"[MIGRATION] 任务 {job_id} 开始执行")
+        try:
+            failed_vms = fn(cancel_event) or []
+            status = JOB_CANCELLED if cancel_event.is_set() else JOB_COMPLETED
+            self._update(job_id, status=status, failed_vms=json.dumps(failed_vms, ensure_ascii=False),
+                         finished_at=time.time())
+            logging.info(f"[MIGRATION] 任务 {job_id} 结束，状态 {status}，失败虚拟机 {len(failed_vms)} 台")
+        except Exception as e:
+            logging.error(f"[MIGRATION] 任务 {job_id} 执行出错: {e}")
+            self._update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+                self._futures.pop(job_id, None)
+
+    def cancel(self, job_id):
+        """
+        取消任务：排队中的任务直接取消，运行中的任务不再启动新的虚拟机迁移，已开始的虚拟机会执行完
+        :return: 是否发出了取消
+        """
+        with self._lock:
+            cancel_event = self._cancel_events.get(job_id)
+            future = self._futures.get(job_id)
+        if cancel_event is None:
+            return False
+        cancel_event.set()
+        if future is not None and future.cancel():
+            # 排队中被取消的任务不会执行 _run，由这里清理登记
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+                self._futures.pop(job_id, None)
+            self._update(job_id, status=JOB_CANCELLED, finished_at=time.time())
+        logging.info(f"[MIGRATION] 任务 {job_id} 已请求取消")
+        return True
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job.pop('dedup_key', None)
+        job['params'] = json.loads(job['params'] or '{}')
+        job['failed_vms'] = json.loads(job['failed_vms'] or '[]')
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, limit=100):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(row) for row in rows]
@@ -0,0 +1,249 @@
+"""
+Prometheus 指标：进程内的 Counter / Gauge / Histogram 以及 /metrics 使用的文本格式输出，
+不依赖 prometheus_client。
+"""
+import threading
+import time
+import types
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """:return: 指定标签的累计值，未给出标签时为所有标签之和"""
+        with self._lock:
+            if labels:
+                return self._values.get(self._key(labels), 0)
+            return sum(self._values.values())
+
+    def _render_samples(self):
+        return [f"{self.name}_total{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _render_samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def _render_samples(self):
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+OPENSTACK_API_SECONDS = Histogram(
+    'vm_migrate_openstack_api_seconds', 'OpenStack SDK 调用耗时（列表调用计算到遍历结束）',
+    ['cloud', 'service', 'method'])
+CEPH_OP_SECONDS = Histogram(
+    'vm_migrate_ceph_op_seconds', 'RBD 操作耗时', ['backend', 'op'])
+POLL_WAIT_SECONDS = Histogram(
+    'vm_migrate_poll_wait_seconds', '等待虚拟机状态变化的轮询耗时', ['loop'])
+COPIED_BYTES = Counter(
+    'vm_migrate_copied_bytes', 'RBD 复制引擎已写入目标端的字节数', ['backend'])
+BYTES_IN_FLIGHT = Gauge(
+    'vm_migrate_bytes_in_flight', 'RBD 复制引擎已读出尚未写入完成的字节数')
+ACTIVE_WORKERS = Gauge(
+    'vm_migrate_active_workers', '正在执行的工作线程数', ['kind'])
+WIRE_BYTES = Counter(
+    'vm_migrate_wire_bytes', '帧格式传输的字节数：raw 为原始数据量，wire 为实际发送量，zero 为省略的零区段', ['kind'])
+RBD_CACHE_LOOKUPS = Counter(
+    'vm_migrate_rbd_cache_lookups', 'RBD 元数据缓存查询次数，result 为 hit / miss', ['op', 'result'])
+THROTTLE_WAIT_SECONDS = Counter(
+    'vm_migrate_throttle_wait_seconds', '因限速等待令牌的累计时间', ['scope', 'kind'])
+
+
+class _InstrumentedProxy:
+    """
+    包装 SDK 服务代理（conn.compute 等），记录每个方法调用的耗时；
+    返回生成器的列表调用计时到遍历结束
+    """
+
+    def __init__(self, target, cloud, service):
+        self._target = target
+        self._cloud = cloud
+        self._service = service
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+        labels = {'cloud': self._cloud, 'service': self._service, 'method': name}
+
+        def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                OPENSTACK_API_SECONDS.observe(time.monotonic() - start, **labels)
+                raise
+            if isinstance(result, types.GeneratorType):
+                return _timed_generator(result, start, labels)
+            OPENSTACK_API_SECONDS.observe(time.monotonic() - start, **labels)
+            return result
+
+        return wrapper
+
+
+def _timed_generator(generator, start, labels):
+    try:
+        yield from generator
+    finally:
+        OPENSTACK_API_SECONDS.observe(time.monotonic() - start, **labels)
+
+
+class InstrumentedConnection:
+    """包装 openstack.connection.Connection，对各服务代理的调用计时"""
+    SERVICES = ('compute', 'network', 'block_storage', 'image', 'identity')
+
+    def __init__(self, conn, cloud):
+        self._conn = conn
+        self._cloud = cloud
+        self._proxies = {}
+
+    def __getattr__(self, name):
+        if name in self.SERVICES:
+            proxy = self._proxies.get(name)
+            if proxy is None:
+                proxy = self._proxies[name] = _InstrumentedProxy(getattr(self._conn, name), self._cloud, name)
+            return proxy
+        attr = getattr(self._conn, name)
+        if name == 'authorize':
+            return _InstrumentedProxy(self._conn, self._cloud, 'identity').__getattr__(name)
+        return attr
+
+
+def instrument_connection(conn, auth_url):
+    """按认证地址的主机名区分云环境"""
+    return InstrumentedConnection(conn, urlparse(auth_url or '').hostname or 'unknown')
+
+
+class InstrumentedBackend:
+    """包装 RbdBackend，记录每个公开操作的耗时"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if not callable(attr) or name.startswith('_') or name == 'close':
+            return attr
+        labels = {'backend': self._backend.name, 'op': name}
+
+        def wrapper(*args, **kwargs):
+            with CEPH_OP_SECONDS.time(**labels):
+                return attr(*args, **kwargs)
+
+        return wrapper
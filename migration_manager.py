@@ -1,74 +1,352 @@
-import pandas as pd
 import logging
+import time
 from openstack_utils import OpenStackUtils
 from ceph_utils import CephUtils
+from incremental_sync import IncrementalSync
+from metrics import ACTIVE_WORKERS
+from inventory import TargetInventory, ServerIpIndex
+from scheduler import MigrationScheduler
+from batch_input import BatchInput
+from batch_order import BatchOrder
+from preflight import Preflight, PreflightError
+from planner import BatchPlanner
+from async_orchestrator import AsyncBatchRunner
+from rbd_backend import cluster_id
+from work_queue import TERMINAL_STATUSES, WORK_PENDING, WORK_DONE, WORK_FAILED, WORK_CANCELLED
 import concurrent.futures
+import config
+import connection_pool
+
+# 工作项结束状态对应的虚拟机进度阶段
+WORK_PHASES = {WORK_DONE: 'completed', WORK_FAILED: 'failed', WORK_CANCELLED: 'cancelled'}
 
 class MigrationManager:
-    def __init__(self, source_auth_args, target_auth_args, source_ceph_conf, source_ceph_pool, target_ceph_conf, target_ceph_pool):
+    def __init__(self, source_auth_args, target_auth_args, source_ceph_conf, source_ceph_pool, target_ceph_conf, target_ceph_pool, rbd_backend=None, queue_depth=None, copy_workers=None, scheduler=None, wire_transfer=None):
         self.source_auth_args = source_auth_args
         self.target_auth_args = target_auth_args
         self.source_ceph_conf = source_ceph_conf
         self.source_ceph_pool = source_ceph_pool
         self.target_ceph_conf = target_ceph_conf
         self.target_ceph_pool = target_ceph_pool
+        self.rbd_backend = rbd_backend
+        self.queue_depth = queue_depth
+        self.copy_workers = copy_workers
+        self.wire_transfer = wire_transfer
+        # 目标端 flavor/子网/镜像在整个批次内只加载一次
+        self.target_inventory = TargetInventory()
+        # 源端 IP → 虚拟机索引，一次遍历建立，按 IP 查找不再逐台扫描
+        self.source_ip_index = ServerIpIndex()
+        # 虚拟机创建与 RBD 复制分开限流，批量迁移的所有虚拟机共享
+        self.scheduler = scheduler or MigrationScheduler()
+        # 所属迁移任务 ID，由提交任务的一方设置，目标端创建的资源带上该标记（见 OpenStackUtils.resource_tags）
+        self.job_id = None
+
+    def to_spec(self):
+        """
+        :return: 构造参数，多副本模式下写入共享工作队列，供其他 Pod 用 from_spec 还原；
+                 认证信息只保存凭据名称，不含密码，缺少凭据名称时抛出 ValueError
+        """
+        return {
+            'source_auth_args': connection_pool.credential_reference(self.source_auth_args),
+            'target_auth_args': connection_pool.credential_reference(self.target_auth_args),
+            'source_ceph_conf': self.source_ceph_conf,
+            'source_ceph_pool': self.source_ceph_pool,
+            'target_ceph_conf': self.target_ceph_conf,
+            'target_ceph_pool': self.target_ceph_pool,
+            'rbd_backend': self.rbd_backend,
+            'queue_depth': self.queue_depth,
+            'copy_workers': self.copy_workers,
+            'wire_transfer': self.wire_transfer,
+            'scheduler': [self.scheduler.provision_limit, self.scheduler.copy_limit,
+                          self.scheduler.per_source_pool, self.scheduler.per_target_pool],
+        }
+
+    @classmethod
+    def from_spec(cls, spec):
+        """按 to_spec 的结果构造，调度器限额在每个 Pod 内分别生效"""
+        spec = dict(spec)
+        scheduler = MigrationScheduler(*spec.pop('scheduler'))
+        return cls(scheduler=scheduler, **spec)
+
+    def locality_labels(self, row):
+        """工作项的就近标签：源/目标 ceph 集群与目标可用区，与 config.WORKER_LOCALITY 匹配"""
+        return [f"source:{cluster_id(self.source_ceph_conf)}", f"target:{cluster_id(self.target_ceph_conf)}",
+                f"az:{row.target_az}"]
 
     def find_vm_by_ip(self, source_conn, ip_address):
-        servers = source_conn.conn.compute.servers()
-        for server in servers:
-            for network in server.addresses.values():
-                for ip in network:
-                    if ip['addr'] == ip_address:
-                        return server
-        return None
-    
-    def migrate_vm_cross_openstack_ceph(self, vm_name, concurrency, target_az, migration_method):
+        return self.source_ip_index.lookup(source_conn.conn, ip_address)
+
+    def find_vms_by_ips(self, source_conn, ip_addresses):
+        """
+        批量按 IP 查找源虚拟机
+        :return: {ip: 虚拟机或 None}
+        """
+        return self.source_ip_index.resolve(source_conn.conn, ip_addresses)
+
+    def preflight(self):
+        """:return: 使用批次共享目标端缓存的 Preflight，调用 load() 后可为任意虚拟机生成计划"""
+        return Preflight(OpenStackUtils(self.source_auth_args), OpenStackUtils(self.target_auth_args, self.target_inventory))
+
+    def migrate_vm_cross_openstack_ceph(self, vm_name, target_az, migration_method, vm_progress=None, target_pool=None, bandwidth_class=None, plan=None):
+        """
+        :param target_pool: 目标 RBD 存储池，为空时使用 self.target_ceph_pool
+        :param bandwidth_class: 单卷限速档位，见 config.BANDWIDTH_CLASSES
+        :param plan: preflight.VmPlan，批量迁移由预检阶段生成；为空时单独预检这台虚拟机
+        """
         # 为每个线程创建独立的连接
         source_conn = OpenStackUtils(self.source_auth_args)
-        target_conn = OpenStackUtils(self.target_auth_args)
-        ceph_utils = CephUtils(self.source_ceph_conf, self.source_ceph_pool, self.target_ceph_conf, self.target_ceph_pool)
+        target_conn = OpenStackUtils(self.target_auth_args, self.target_inventory)
+        target_conn.job_id = self.job_id
+        ceph_utils = CephUtils(self.source_ceph_conf, self.source_ceph_pool, self.target_ceph_conf, target_pool or self.target_ceph_pool, self.rbd_backend, self.queue_depth, self.copy_workers, self.wire_transfer)
+        ceph_utils.progress = vm_progress
+        ceph_utils.bandwidth_class = bandwidth_class
         try:
-            
-            
-            #获取源环境的虚拟机信息
-            sources_server = source_conn.conn.compute.find_server(vm_name)
-            #源环境的虚拟机启动方式为boot from image 还是boot from volume
-            is_boot_from_volume = source_conn.is_vm_boot_from_volume(sources_server)
-            # 获取虚拟机的所有卷
-            sources_volumes = source_conn.get_vm_volumes(vm_name)
-            # 在目标 OpenStack 环境中创建虚拟机,返回创建好的虚拟机信息
-            if migration_method == 'snapshot' or migration_method == 'full_migrate':
-                create_target_vm = target_conn.create_vm_in_target(vm_name, source_conn, is_boot_from_volume, target_az)
-                if not create_target_vm:
-                    logging.error(f"[MIGRATION] 虚拟机 {vm_name} 创建创建失败: {e}")
-                    return
-            target_volumes = target_conn.get_vm_volumes(vm_name+"2")
+            if plan is None:
+                plan = self.preflight().plan(vm_name)
+            # 预检时记录的状态可能已过时，校验前再查询
+            ceph_utils.source_stopped = lambda: source_conn.is_vm_stopped(plan.server.id)
+            #源环境的虚拟机信息、启动方式（boot from image 或 boot from volume）与所有卷均取自迁移计划
+            sources_server = plan.server
+            is_boot_from_volume = plan.is_boot_from_volume
+            sources_volumes = plan.volumes
+            provision = migration_method in ('snapshot', 'full_migrate', 'precopy')
+            # manage 模式：先把数据写入按源卷命名的目标镜像，复制完成后再纳管并创建虚拟机，配对按源卷精确对应
+            direct = provision and config.TARGET_VOLUME_MODE == 'manage'
+            if direct:
+                volume_pairs = ceph_utils.direct_volume_pairs(sources_server, sources_volumes, is_boot_from_volume)
+            else:
+                # 在目标 OpenStack 环境中创建虚拟机,返回创建好的虚拟机信息
+                if provision:
+                    self._set_vm_phase(vm_progress, 'provisioning')
+                    with self.scheduler.provisioning():
+                        self._check_aborted(vm_progress)
+                        create_target_vm = target_conn.create_vm_in_target(plan, target_az, vm_progress=vm_progress)
+                    if not create_target_vm:
+                        logging.error(f"[MIGRATION] 虚拟机 {vm_name} 创建创建失败")
+                        self._set_vm_phase(vm_progress, 'failed', "目标虚拟机创建失败")
+                        return vm_name
+                    # 目标卷由创建阶段直接给出，顺序与源卷对应
+                    target_volumes = create_target_vm.volumes
+                else:
+                    target_volumes = target_conn.get_vm_volumes(vm_name+"2")
+                volume_pairs = ceph_utils.pair_volumes(sources_server, sources_volumes, target_volumes, is_boot_from_volume)
             #rbd同步源目标端数据
-            ceph_utils.create_volumes_in_target(sources_server, sources_volumes, target_volumes, is_boot_from_volume, concurrency, migration_method)
+            self._check_aborted(vm_progress)
+            self._set_vm_phase(vm_progress, 'copying')
+            if migration_method == 'precopy':
+                # 预拷贝期间源虚拟机保持运行，最后一轮前关机
+                incremental_sync = IncrementalSync(ceph_utils, volume_pairs, self.scheduler)
+                if not incremental_sync.run(lambda: source_conn.stop_vm(sources_server.id)):
+                    self._set_vm_phase(vm_progress, 'failed', "预拷贝切换失败")
+                    return vm_name
+            elif not ceph_utils.copy_volume_pairs(volume_pairs, self.scheduler, migration_method):
+                self._set_vm_phase(vm_progress, 'failed', "卷数据复制失败")
+                return vm_name
+            self._check_aborted(vm_progress)
+            if direct and not self._adopt_and_provision(target_conn, ceph_utils, plan, target_az, volume_pairs, vm_progress):
+                return vm_name
+            self._set_vm_phase(vm_progress, 'completed')
         except Exception as e:
             logging.error(f"[MIGRATION] 迁移虚拟机 {vm_name} 时出现错误: {e}")
+            self._set_vm_phase(vm_progress, 'failed', str(e))
             return vm_name
-    def batch_migrate_from_excel(self, file_path, concurrency, migration_method):
+
+    def _adopt_and_provision(self, target_conn, ceph_utils, plan, target_az, volume_pairs, vm_progress):
+        """manage 模式复制完成后纳管目标镜像，并挂载这些卷创建目标虚拟机"""
+        self._set_vm_phase(vm_progress, 'provisioning')
+        with self.scheduler.provisioning():
+            self._check_aborted(vm_progress)
+            target_volumes = target_conn.manage_volumes(
+                plan, [(target["pool"], target["volume_id"], target["name"]) for _, target in volume_pairs])
+            ceph_utils.record_adopted(volume_pairs, target_volumes)
+            create_target_vm = target_conn.create_vm_in_target(plan, target_az, target_volumes, vm_progress)
+        if not create_target_vm:
+            logging.error(f"[MIGRATION] 虚拟机 {plan.vm_name} 创建失败，已纳管的卷保留在目标环境中")
+            self._set_vm_phase(vm_progress, 'failed', "目标虚拟机创建失败")
+            return False
+        return True
+
+    @staticmethod
+    def _check_aborted(vm_progress):
+        """:raise progress.MigrationAborted: 迁移已被中止（如本 Pod 失去了工作项的租约）"""
+        if vm_progress is not None:
+            vm_progress.check_aborted()
+
+    @staticmethod
+    def _set_vm_phase(vm_progress, phase, error=None):
+        if vm_progress is not None:
+            vm_progress.set_phase(phase, error)
+
+
+    def _migrate_unless_cancelled(self, cancel_event, vm_name, target_az, migration_method, vm_progress, target_pool=None, bandwidth_class=None, plan=None):
+        if cancel_event is not None and cancel_event.is_set():
+            logging.info(f"[MIGRATION] 任务已取消，跳过虚拟机 {vm_name}")
+            self._set_vm_phase(vm_progress, 'cancelled')
+            return None
+        with ACTIVE_WORKERS.track_inprogress(kind='vm'):
+            return self.migrate_vm_cross_openstack_ceph(vm_name, target_az, migration_method, vm_progress, target_pool, bandwidth_class, plan)
+
+    def _batch_worker(self, order, cancel_event, progress):
+        """从 BatchOrder 依次取虚拟机迁移，直到取完"""
+        error_vms = []
+        while True:
+            entry = order.get()
+            if entry is None:
+                return error_vms
+            row, plan = entry
+            vm_name = plan.vm_name
+            logging.info(f"[MIGRATION] 开始处理虚拟机 {vm_name} 的迁移任务，目标可用区: {row.target_az}，"
+                         f"迁移方式: {row.method}，优先级: {row.priority}")
+            vm_progress = progress.vm(vm_name) if progress is not None else None
+            try:
+                result = self._migrate_unless_cancelled(cancel_event, vm_name, row.target_az, row.method, vm_progress,
+                                                        row.target_pool, row.bandwidth_class, plan)
+            finally:
+                order.done(plan)
+            if result:
+                error_vms.append(result)
+
+    def iter_plans(self, batch, failures, progress=None):
+        """
+        逐行读取清单，用预检一次加载的源端资源为每台虚拟机生成迁移计划，解析 IP 后仍按虚拟机去重
+        :param batch: batch_input.BatchInput
+        :param failures: 预检失败的虚拟机追加到该列表 [(虚拟机名称或 IP, 原因), ...]
+        :return: 生成器，产出 (清单顺序, BatchRow, VmPlan)
+        """
+        preflight = self.preflight()
+        preflight.load()
+        seen = set()
+        for seq, row in enumerate(batch):
+            try:
+                plan = preflight.plan(row.vm_name, row.ip)
+            except PreflightError as e:
+                logging.error(f"[MIGRATION] 迁移清单第 {row.line} 行预检失败: {e}")
+                failures.append((row.label, str(e)))
+                if progress is not None:
+                    progress.vm(row.label).set_phase('failed', str(e))
+                continue
+            if plan.vm_name in seen:
+                logging.warning(f"[MIGRATION] 迁移清单第 {row.line} 行的虚拟机 {plan.vm_name} 重复，已忽略")
+                continue
+            seen.add(plan.vm_name)
+            yield seq, row, plan
+
+    def plan_batch_from_file(self, file_path, concurrency, migration_method):
+        """
+        预演批量迁移，只读查询源端，不创建虚拟机也不复制数据
+        :return: 每台虚拟机与整个批次的数据量、预计耗时，见 planner.BatchPlanner.plan
+        """
+        return BatchPlanner(self).plan(file_path, concurrency, migration_method)
+
+    def batch_migrate_from_file(self, file_path, concurrency, migration_method, cancel_event=None, progress=None):
+        """
+        :param file_path: 迁移清单，xlsx / csv / jsonl，列定义见 batch_input
+        :param concurrency: 同时处理的虚拟机数量；创建与复制阶段另由 self.scheduler 限流
+        :param migration_method: 清单未指定 method 列时使用的迁移方式
+        :param cancel_event: threading.Event，置位后不再开始新的虚拟机迁移
+        :param progress: progress.JobProgress，按虚拟机/卷记录进度
+        :return: 迁移出错的虚拟机名称列表，无效行记为“第 N 行”
+        """
+        if config.ORCHESTRATION == 'asyncio':
+            return AsyncBatchRunner(self).run(file_path, concurrency, migration_method, cancel_event, progress)
+        error_vms = []
+        # 源/目标端共享连接的 keep-alive 连接数按并发数放大
+        connection_pool.reserve(self.source_auth_args, concurrency)
+        connection_pool.reserve(self.target_auth_args, concurrency)
+        batch = BatchInput(file_path, migration_method, self.target_ceph_pool)
+        order = BatchOrder(self)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            workers = [executor.submit(self._batch_worker, order, cancel_event, progress) for _ in range(concurrency)]
+            failures = []
+            try:
+                # 工作线程已在等待，出队顺序见 batch_order
+                for seq, row, plan in self.iter_plans(batch, failures, progress):
+                    order.put(seq, row, plan)
+            except FileNotFoundError:
+                logging.error(f"[MIGRATION] 未找到迁移清单文件: {file_path}")
+                raise
+            except Exception as e:
+                logging.error(f"[MIGRATION] 读取迁移清单时出现错误: {e}")
+                raise
+            finally:
+                # 读取出错时工作线程做完已放入的虚拟机后退出
+                order.close()
+            error_vms.extend(label for label, _ in failures)
+            if failures:
+                logging.warning(f"[MIGRATION] 预检共 {len(failures)} 台虚拟机无法迁移: "
+                                + "; ".join(f"{label}: {reason}" for label, reason in failures))
+            for future in workers:
+                error_vms.extend(future.result())
+        error_vms.extend(f"第 {line} 行" for line, _ in batch.errors)
+        logging.info(f"[MIGRATION] 迁移清单共 {batch.rows} 行，无效 {len(batch.errors)} 行，重复 {len(batch.duplicates)} 行")
+        if error_vms:
+            logging.warning(f"[MIGRATION]以下虚拟机迁移出错: {', '.join(error_vms)}")
+        return error_vms
+
+    def distribute_batch_from_file(self, job_id, file_path, migration_method, work_queue, cancel_event=None, progress=None):
+        """
+        多副本模式的批量迁移：本 Pod 预检后把虚拟机作为工作项放入共享队列，由各 Pod 的 QueueWorker 领取执行，
+        本 Pod 等待所有工作项结束并汇总结果。同时迁移的虚拟机数量由各 Pod 的 config.WORKER_SLOTS 决定
+        :param work_queue: work_queue.WorkQueue
+        :return: 迁移出错的虚拟机名称列表，无效行记为“第 N 行”
+        """
+        error_vms = []
+        self.job_id = job_id
+        batch = BatchInput(file_path, migration_method, self.target_ceph_pool)
+        failures = []
+        work_queue.put_job(job_id, self.to_spec())
         try:
-            error_vms = []
-            df = pd.read_excel(file_path)
-            vm_names = df['vm_name'].dropna().tolist()
-            target_azs = df['target_az'].dropna().tolist()
-            with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
-                futures = []
-                for vm_name, target_az in zip(vm_names, target_azs):
-                    logging.info(f"[MIGRATION] 开始处理虚拟机 {vm_name} 的迁移任务，目标可用区: {target_az}")
-                    future = executor.submit(self.migrate_vm_cross_openstack_ceph, vm_name, concurrency, target_az, migration_method)
-                    futures.append(future)
-
-                for future in concurrent.futures.as_completed(futures):
-                    result = future.result()
-                    if result:
-                        error_vms.append(result)
-
-            if error_vms:
-                logging.warning(f"[MIGRATION]以下虚拟机迁移出错: {', '.join(error_vms)}")
-        except FileNotFoundError:
-            logging.error(f"[MIGRATION] 未找到 Excel 文件: {file_path}")
-        except Exception as e:
-            logging.error(f"[MIGRATION] 处理 Excel 文件时出现错误: {e}")
+            items = []
+            try:
+                # 清单边读边入队，工作 Pod 不必等整个清单预检完
+                for _, row, plan in self.iter_plans(batch, failures, progress):
+                    items.append((plan.vm_name, {'target_az': row.target_az, 'method': row.method,
+                                                 'target_pool': row.target_pool, 'bandwidth_class': row.bandwidth_class},
+                                  row.priority, self.locality_labels(row)))
+                    if len(items) >= config.WORK_ENQUEUE_BATCH:
+                        work_queue.enqueue(job_id, items)
+                        items = []
+                work_queue.enqueue(job_id, items)
+            except FileNotFoundError:
+                logging.error(f"[MIGRATION] 未找到迁移清单文件: {file_path}")
+                raise
+            except Exception as e:
+                logging.error(f"[MIGRATION] 读取迁移清单时出现错误: {e}")
+                raise
+            finally:
+                error_vms.extend(label for label, _ in failures)
+                if failures:
+                    logging.warning(f"[MIGRATION] 预检共 {len(failures)} 台虚拟机无法迁移: "
+                                    + "; ".join(f"{label}: {reason}" for label, reason in failures))
+                error_vms.extend(self._await_work_items(job_id, work_queue, cancel_event, progress))
+        finally:
+            work_queue.finish_job(job_id)
+        error_vms.extend(f"第 {line} 行" for line, _ in batch.errors)
+        logging.info(f"[MIGRATION] 迁移清单共 {batch.rows} 行，无效 {len(batch.errors)} 行，重复 {len(batch.duplicates)} 行")
+        if error_vms:
+            logging.warning(f"[MIGRATION]以下虚拟机迁移出错: {', '.join(error_vms)}")
+        return error_vms
+
+    def _await_work_items(self, job_id, work_queue, cancel_event, progress):
+        """
+        等待任务的工作项全部结束；其他 Pod 执行的虚拟机只有状态，卷级进度在执行的 Pod 上
+        :return: 迁移失败的虚拟机名称列表
+        """
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                work_queue.cancel_job(job_id)
+            elif work_queue.is_cancelled(job_id) and cancel_event is not None:
+                # 由其他 Pod 的 /jobs/<id>/cancel 发起
+                cancel_event.set()
+            items = work_queue.job_items(job_id)
+            if progress is not None:
+                for item in items:
+                    if item['owner'] != config.POD_NAME and item['status'] != WORK_PENDING:
+                        phase = WORK_PHASES.get(item['status']) or f"running@{item['owner']}"
+                        progress.vm(item['vm_name']).set_phase(phase, item['error'])
+            if all(item['status'] in TERMINAL_STATUSES for item in items):
+                for item in items:
+                    if item['status'] == WORK_FAILED:
+                        logging.error(f"[MIGRATION] 虚拟机 {item['vm_name']} 在 {item['owner']} 上迁移失败: {item['error']}")
+                return [item['vm_name'] for item in items if item['status'] == WORK_FAILED]
+            time.sleep(config.WORK_POLL_INTERVAL)
@@ -1,13 +1,33 @@
-import openstack
-import requests
 import logging
-import time
+import re
+import concurrent.futures
 import xml.etree.ElementTree as ET
+from collections import namedtuple
 import config
+import connection_pool
+from metrics import POLL_WAIT_SECONDS
+from server_waiter import get_server_waiter
+from inventory import TargetInventory
+
+# 卷纳管失败时的卷状态
+MANAGE_FAILURES = ['error', 'error_managing']
+
+# 目标端创建完成的虚拟机及其卷，卷顺序与 CephUtils.pair_volumes 的源卷一致
+ProvisionedVm = namedtuple('ProvisionedVm', ['server', 'volumes'])
+
+# 本工具创建的虚拟机与卷的元数据键：所属任务、虚拟机与源卷，remove_leftovers 只删除带有这些标记的资源
+TAG_JOB_ID = 'migrate_job_id'
+TAG_VM_NAME = 'migrate_vm_name'
+TAG_SOURCE_VOLUME = 'migrate_source_volume'
 
 class OpenStackUtils:
-    def __init__(self, auth_args):
-        self.conn = openstack.connect(**auth_args)
+    def __init__(self, auth_args, inventory=None):
+        # 同一云环境共享已认证连接，不再每台虚拟机重新认证
+        self.conn = connection_pool.get_connection(auth_args)
+        # 目标端 flavor/子网/镜像缓存，批量迁移时由 MigrationManager 传入批次共享的实例
+        self.inventory = inventory if inventory is not None else TargetInventory()
+        # 所属迁移任务，由 MigrationManager 设置，写入创建的虚拟机、卷与端口的标记
+        self.job_id = None
 
     def get_vm_volumes(self, vm_name):
         try:
@@ -43,46 +63,45 @@ class OpenStackUtils:
             return server.status
         return None
 
+    def is_vm_stopped(self, vm_id):
+        """重新查询虚拟机当前状态，已关机（SHUTOFF）返回 True，查询失败时按未关机处理"""
+        try:
+            return self.conn.compute.get_server(vm_id).status == 'SHUTOFF'
+        except Exception as e:
+            logging.error(f"[MIGRATION] 查询虚拟机 {vm_id} 状态时出错: {e}")
+            return False
+
     def stop_vm(self, vm_id):
+        """关闭虚拟机，虚拟机已关闭或成功关闭返回 True"""
         try:
             server = self.conn.compute.get_server(vm_id)
             if server.status == 'ACTIVE':
                 self.conn.compute.stop_server(vm_id)
                 logging.info(f"[MIGRATION]正在关闭虚拟机 {vm_id}...")
-                # 等待虚拟机状态变为 SHUTOFF
-                while True:
-                    server = self.conn.compute.get_server(vm_id)
-                    if server.status == 'SHUTOFF':
-                        logging.info(f"[MIGRATION]虚拟机 {vm_id} 已成功关闭。")
-                        break
-                    elif server.status in ['ERROR', 'PAUSED', 'SUSPENDED']:
-                        logging.error(f"[MIGRATION]虚拟机 {vm_id} 关闭失败，状态为 {server.status}。")
-                        break
-                    time.sleep(10)
+                # 等待虚拟机状态变为 SHUTOFF，由共享轮询线程合并查询
+                with POLL_WAIT_SECONDS.time(loop='stop_vm'):
+                    server = get_server_waiter(self.conn).wait(
+                        vm_id, ['SHUTOFF', 'ERROR', 'PAUSED', 'SUSPENDED'], config.SERVER_STOP_TIMEOUT)
+                if server.status == 'SHUTOFF':
+                    logging.info(f"[MIGRATION]虚拟机 {vm_id} 已成功关闭。")
+                    return True
+                logging.error(f"[MIGRATION]虚拟机 {vm_id} 关闭失败，状态为 {server.status}。")
+                return False
             else:
                 logging.info(f"[MIGRATION]虚拟机 {vm_id} 当前状态为 {server.status}，无需关闭。")
+                return True
         except Exception as e:
             logging.error(f"[MIGRATION]关闭虚拟机 {vm_id} 时出错: {e}")
+            return False
             
     def get_server_xml(self, server_id):
         try:
-            # 获取认证令牌
-            token = self.conn.authorize()
-            # 获取 Nova API 端点
-            nova_endpoint = self.conn.compute.get_endpoint()
-            # 构建请求 URL
-            url = f"{nova_endpoint}/servers/{server_id}/xml"
-            # 设置请求头
-            headers = {
-                "X-Auth-Token": token,
-                "Content-Type": "application/xml"
-            }
-            # 发送 GET 请求
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            # 通过 SDK 的 compute 适配器发送请求，复用共享会话的令牌与 keep-alive 连接
+            response = self.conn.compute.get(f"/servers/{server_id}/xml",
+                                             headers={"Accept": "application/xml"}, raise_exc=True)
             # 返回 XML 描述信息
             return response.text
-        except requests.exceptions.RequestException as e:
+        except Exception as e:
             logging.error(f"[MIGRATION] 获取虚拟机 {server_id} 的 XML 描述信息时出现错误: {e}")
             return None
 
@@ -135,7 +154,9 @@ class OpenStackUtils:
         return subnet_info 
 
 
-    def create_port_with_ip(self, network_id,subnet_id, ip_address):
+    def create_port_with_ip(self, network_id,subnet_id, ip_address, vm_name=None):
+        """:param vm_name: 端口所属的虚拟机，给出时端口描述带上任务与虚拟机标记（见 port_description）"""
+        attrs = {'description': self.port_description(vm_name)} if vm_name else {}
         try:
             port = self.conn.network.create_port(
             name = ip_address,
@@ -143,7 +164,8 @@ class OpenStackUtils:
             fixed_ips=[{
                 "subnet_id": subnet_id,
                 "ip_address": ip_address,
-                }]
+                }],
+            **attrs
                 )
             logging.info(f"[MIGRATION] 成功在网络 {network_id} 中创建端口,IP 地址为 {ip_address}")
             return port
@@ -152,64 +174,55 @@ class OpenStackUtils:
         return None
 
     def find_flavor_by_name(self, flavor_name):
-        all_flavors = self.conn.compute.flavors()
-        for flavor in all_flavors:
-            if flavor.name == flavor_name:
-                return flavor
-        return None
+        return self.inventory.flavor(self.conn, flavor_name)
 
     def volmue_setbootable(self, target_volume):
-        token = self.conn.authorize()
-        cinder_endpoint = self.conn.block_storage.get_endpoint()
-        url = f"{cinder_endpoint}/volumes/{target_volume.id}/action"
-        headers = {
-            "X-Auth-Token": token,
-            "Content-Type": "application/json"
-        }
         data = {
             "os-set_bootable": {
                 "bootable": True
             }
         }
         try:
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
+            self.conn.block_storage.post(f"/volumes/{target_volume.id}/action", json=data, raise_exc=True)
             logging.info(f"[MIGRATION] 成功设置卷 {target_volume.id} 为可启动状态。")
-        except requests.exceptions.RequestException as e:
+        except Exception as e:
             logging.error(f"[MIGRATION] 设置卷可启动状态时出错: {e}")
 
     def ensure_flavor_exists(self, source_flavor):
-        target_flavor = self.find_flavor_by_name(source_flavor.get('original_name'))
-        if not target_flavor:
-            try:
-                target_flavor = self.conn.compute.create_flavor(
-                    name=source_flavor.get('original_name'),
-                    ram=source_flavor.get("ram"),
-                    vcpus=source_flavor.get("vcpus"),
-                    disk=source_flavor.get("disk"),
-                    ephemeral=source_flavor.get("ephemeral"),
-                    swap=source_flavor.get("swap"),
-                    #rxtx_factor=source_flavor.rxtx_factor,
-                    #is_public=source_flavor.is_public
-                )
-                logging.info(f"[MIGRATION] 在目标环境中创建 flavor {source_flavor.get('original_name')} 成功。")
-            except Exception as e:
-                logging.error(f"[MIGRATION] 在目标环境中创建 flavor {source_flavor.get('original_name')} 时出现错误: {e}")
+        return self.inventory.get_or_create_flavor(self.conn, source_flavor.get('original_name'),
+                                                   lambda: self._create_flavor(source_flavor))
+
+    def _create_flavor(self, source_flavor):
+        try:
+            target_flavor = self.conn.compute.create_flavor(
+                name=source_flavor.get('original_name'),
+                ram=source_flavor.get("ram"),
+                vcpus=source_flavor.get("vcpus"),
+                disk=source_flavor.get("disk"),
+                ephemeral=source_flavor.get("ephemeral"),
+                swap=source_flavor.get("swap"),
+                #rxtx_factor=source_flavor.rxtx_factor,
+                #is_public=source_flavor.is_public
+            )
+            logging.info(f"[MIGRATION] 在目标环境中创建 flavor {source_flavor.get('original_name')} 成功。")
+        except Exception as e:
+            logging.error(f"[MIGRATION] 在目标环境中创建 flavor {source_flavor.get('original_name')} 时出现错误: {e}")
+            return None
         return target_flavor
     
     def ensure_network_exists(self, source_network):
         result = []
-        for target_network in self.conn.network.networks():
-            target_subnets = list(self.conn.network.subnets(network_id=target_network.id))
-            target_cidrs= [subnet.cidr for subnet in target_subnets]
-            for index, cidr in enumerate(target_cidrs):
-                #if cidr in source_network.cidr:
-                if cidr in source_network[0]["subnet"].cidr:
-                    result.append({
-                        "network_id": target_network.id,
-                        "subnet_id": target_subnets[index].id,
-                        "ipaddr":source_network[0]["ipaddr"]
-                      })
+        # 每块网卡按源子网 CIDR 在目标端子网索引中查找
+        for nic in source_network:
+            target_subnet = self.inventory.find_subnet(self.conn, nic["subnet"].cidr, nic["ipaddr"])
+            if target_subnet is None:
+                logging.warning(f"[MIGRATION] 目标环境中没有与 {nic['subnet'].cidr} 匹配的子网，IP {nic['ipaddr']}")
+                continue
+            result.append({
+                "network_id": target_subnet.network_id,
+                "subnet_id": target_subnet.id,
+                "ipaddr": nic["ipaddr"]
+              })
         return result
 
     def ensure_security_group_exists(self, source_security_group):
@@ -236,102 +249,282 @@ class OpenStackUtils:
         return target_security_group
 
 
-    def create_vm_in_target(self, vm_name, source_conn, is_boot_from_volume, target_az):
+    def _create_ports(self, network_info, executor, vm_name=None):
+        """每块网卡的端口并发创建，返回创建成功的端口"""
+        futures = [executor.submit(self.create_port_with_ip, info['network_id'], info["subnet_id"], info['ipaddr'], vm_name)
+                   for info in network_info]
+        return [port for port in (future.result() for future in futures) if port]
+
+    def _create_blank_volume(self, name, size, bootable=False, image=None, metadata=None):
+        """
+        创建空白卷并等待可用；启动卷设置可启动标记，并带上目标镜像的元数据（hw_* 等属性）
+        """
+        volume = self.request_blank_volume(name, size, metadata)
+        volume = self.conn.block_storage.wait_for_status(volume, status='available', failures=['error'],
+                                                         interval=config.SERVER_WAIT_MIN_INTERVAL,
+                                                         wait=config.VOLUME_CREATE_TIMEOUT)
+        self.finish_blank_volume(volume, bootable, image)
+        return volume
+
+    def request_blank_volume(self, name, size, metadata=None):
+        """
+        :param metadata: 卷元数据，创建虚拟机时为 resource_tags 给出的任务、虚拟机与源卷标记
+        :return: 刚提交创建、尚未可用的空白卷
+        """
+        return self.conn.block_storage.create_volume(name=name, size=size, volume_type=config.DEFAULT_CINDER_TYPE,
+                                                     metadata=metadata or {})
+
+    def finish_blank_volume(self, volume, bootable=False, image=None):
+        """空白卷可用后，启动卷设置可启动标记与镜像元数据"""
+        if bootable:
+            self.volmue_setbootable(volume)
+            if image is not None:
+                self.set_volume_image_metadata(volume, image)
+
+    def set_volume_image_metadata(self, volume, image):
+        metadata = {"image_id": image.id, "image_name": image.name}
+        metadata.update({key: str(value) for key, value in (getattr(image, 'properties', None) or {}).items()
+                         if key.startswith(('hw_', 'os_'))})
         try:
-            # 获取源虚拟机信息
-            sources_server = source_conn.conn.compute.find_server(vm_name)
-            # 获取源虚拟机的信息
-            source_server_info = source_conn.conn.compute.get_server(sources_server.id).to_dict()
-            # 获取源虚拟机的网络信息
-            source_network=source_conn.get_vm_network_info(source_conn,sources_server)
-            # 获取源虚拟机的flavor信息
-            source_flavor = source_server_info.get('flavor', {})
-            #获取源环境虚拟机镜像信息
-            source_image_id = source_server_info.get('image', {}).get('id')
-            if source_image_id == None:
-                volume_vda = self.conn.block_storage.get_volume(source_server_info.get("attached_volumes")[0].get('id'))
-                source_image_id = volume_vda.volume_image_metadata.get("image_id")
-            image_name=source_conn.conn.compute.find_image(source_image_id).name
-            target_image_id=self.conn.compute.find_image(image_name).id
-            if target_image_id == None:
-                target_image_id=self.conn.compute.find_image(config.DEFAULT_MIGRATE_IMAGE).id
-            #获取源环境硬盘信息
-            sources_volumes = source_conn.get_vm_volumes(vm_name)
-            # 获取源虚拟机的安全组信息
-            source_security_groups = source_server_info.get('security_groups', {})
-            target_flavor = self.ensure_flavor_exists(source_flavor)
-            target_network = self.ensure_network_exists(source_network)
-            #target_security_groups = [self.ensure_security_group_exists(sg) for sg in source_security_groups]
-
-            if not target_flavor or not target_network:
-                logging.warning(f"[MIGRATION] 无法在目标环境中创建必要的资源，跳过虚拟机创建。")
-                return None
+            self.conn.block_storage.post(f"/volumes/{volume.id}/action",
+                                         json={"os-set_image_metadata": {"metadata": metadata}}, raise_exc=True)
+        except Exception as e:
+            logging.warning(f"[MIGRATION] 设置卷 {volume.id} 的镜像元数据时出错: {e}")
 
-            if sources_volumes[0].is_bootable:
-                volume_size=sources_volumes[0].size
-            else:
-                volume_size=source_flavor.get("disk")
-
-            block_device_mapping = []
-            block_device_mapping.append({
-              "uuid": target_image_id,
-              "boot_index": 0,
-              "source_type": "image",
-              "volume_type": config.DEFAULT_CINDER_TYPE,
-              "volume_size": volume_size,
-              "destination_type": "volume",
-              "delete_on_termination": False
-          })
-            for volume in sources_volumes:
-                if not volume.is_bootable:
-                    block_device_mapping.append({
-                        "source_type": "blank",
-                        "volume_size": volume.size,
-                        "volume_type": config.DEFAULT_CINDER_TYPE,
-                        "destination_type": "volume",
-                        "delete_on_termination": False
-                    })
-            # 获取源虚拟机的网络信息
-            network_info = target_network
-            ports = []
-            for info in network_info:
-                port = self.create_port_with_ip(info['network_id'],info["subnet_id"], info['ipaddr'])
-                if port:
-                    ports.append({"port": port.id})
-
-            if not ports:
-                logging.warning(f"[MIGRATION] 无法为虚拟机 {vm_name} 创建端口，使用默认网络配置。")
-                if network_info:
-                    ports = [{"uuid": network_info[0]['network_id']}]
-                else:
-                    logging.error(f"[MIGRATION] 没有可用的网络信息，无法创建虚拟机。")
-                    return None
+    def manage_volume(self, pool, image_name, name, bootable=False, image=None):
+        """
+        通过 Cinder 卷纳管接管目标集群中已写好数据的 RBD 镜像，Cinder 会把镜像重命名为 volume-<卷 ID>
+        :param pool: 镜像所在的存储池，按 config.CINDER_MANAGE_HOSTS 找到接管它的 cinder-volume 主机
+        :return: 可用状态的卷
+        """
+        volume = self.request_manage_volume(pool, image_name, name, bootable)
+        volume = self.conn.block_storage.wait_for_status(volume, status='available', failures=MANAGE_FAILURES,
+                                                         interval=config.SERVER_WAIT_MIN_INTERVAL,
+                                                         wait=config.VOLUME_CREATE_TIMEOUT)
+        self.finish_managed_volume(volume, pool, image_name, bootable, image)
+        return volume
 
+    def request_manage_volume(self, pool, image_name, name, bootable=False):
+        """:return: 刚提交纳管、尚未可用的卷"""
+        host = config.CINDER_MANAGE_HOSTS.get(pool)
+        if not host:
+            raise RuntimeError(f"config.CINDER_MANAGE_HOSTS 中没有存储池 {pool} 对应的 cinder-volume 主机")
+        data = {
+            "volume": {
+                "host": host,
+                "ref": {"source-name": image_name},
+                "name": name,
+                "volume_type": config.DEFAULT_CINDER_TYPE,
+                "bootable": bootable,
+            }
+        }
+        response = self.conn.block_storage.post("/manageable_volumes", json=data, raise_exc=True)
+        return self.conn.block_storage.get_volume(response.json()["volume"]["id"])
 
-            server = self.conn.compute.create_server(
-                name=vm_name,
-                adminPass=config.default_vm_pass,
-                flavor_id=target_flavor.id,
-                networks=ports,
-                block_device_mapping_v2=block_device_mapping,
-                #security_groups=[{'name': sg.name} for sg in target_security_groups],
-                security_groups=[{"name": config.DEFAULT_SEC_GROUP}],
-                availability_zone=target_az  # 指定目标计算可用区
-            )
+    def finish_managed_volume(self, volume, pool, image_name, bootable=False, image=None):
+        if bootable and image is not None:
+            self.set_volume_image_metadata(volume, image)
+        logging.info(f"[MIGRATION] 镜像 {pool}/{image_name} 已纳管为卷 {volume.id}")
+
+    def manage_volumes(self, plan, images):
+        """
+        并发纳管一台虚拟机的所有目标镜像
+        :param images: [(存储池, 镜像名, 卷名称), ...]，第一个为启动卷
+        :return: 与 images 顺序一致的卷列表
+        """
+        target_image = self._target_image(plan)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=config.PROVISION_PARALLEL_REQUESTS) as executor:
+            futures = [executor.submit(self.manage_volume, pool, image_name, name or f"{plan.vm_name}_{index}",
+                                       index == 0, target_image)
+                       for index, (pool, image_name, name) in enumerate(images)]
+            volumes, errors = [], []
+            for future in futures:
+                try:
+                    volumes.append(future.result())
+                except Exception as e:
+                    errors.append(str(e))
+        if errors:
+            raise RuntimeError(f"纳管目标镜像失败: {'; '.join(errors)}")
+        return volumes
+
+    def _target_image(self, plan):
+        # 镜像只用于启动卷的元数据，找不到时不影响创建
+        return (plan.image_name and self.inventory.image(self.conn, plan.image_name)) \
+            or self.inventory.image(self.conn, config.DEFAULT_MIGRATE_IMAGE)
+
+    def _target_volume_specs(self, plan):
+        """
+        :return: [(卷名称, 大小 GB, 是否启动卷, 卷元数据), ...]，顺序与 CephUtils.pair_volumes 的源卷一致：
+                 启动卷在前，其后为源虚拟机的非启动卷；元数据标记所属任务、虚拟机与源卷（从镜像启动时为源系统盘）
+        """
+        sources_volumes = plan.volumes
+        if sources_volumes and sources_volumes[0].is_bootable:
+            boot = (sources_volumes[0].name or f"{plan.vm_name}_vda", sources_volumes[0].size, sources_volumes[0].id)
+        else:
+            boot = (f"{plan.vm_name}_vda", plan.server_info.get('flavor', {}).get("disk"), f"{plan.server.id}_disk")
+        return [(boot[0], boot[1], True, self.resource_tags(plan.vm_name, boot[2]))] + \
+            [(volume.name or f"{plan.vm_name}_{index}", volume.size, False, self.resource_tags(plan.vm_name, volume.id))
+             for index, volume in enumerate(sources_volumes) if not volume.is_bootable]
+
+    def resource_tags(self, vm_name, source_volume=None):
+        """:return: 本工具为 vm_name 创建的虚拟机（与卷，带 source_volume）的元数据"""
+        tags = {TAG_JOB_ID: self.job_id or '', TAG_VM_NAME: vm_name}
+        if source_volume is not None:
+            tags[TAG_SOURCE_VOLUME] = source_volume
+        return tags
+
+    def port_description(self, vm_name):
+        """端口没有元数据，标记写在描述中"""
+        return f"{TAG_JOB_ID}={self.job_id or ''} {TAG_VM_NAME}={vm_name}"
+
+    @staticmethod
+    def _tagged(resource, tags):
+        metadata = getattr(resource, 'metadata', None) or {}
+        return all(metadata.get(key) == value for key, value in tags.items())
+
+    def _cleanup(self, ports, volumes):
+        """创建虚拟机失败时删除已创建的端口与卷"""
+        for port in ports:
+            try:
+                self.conn.network.delete_port(port)
+            except Exception as e:
+                logging.warning(f"[MIGRATION] 删除端口 {port.id} 失败: {e}")
+        for volume in volumes:
+            try:
+                self.conn.block_storage.delete_volume(volume)
+            except Exception as e:
+                logging.warning(f"[MIGRATION] 删除卷 {volume.id} 失败: {e}")
 
-            while True:
-                server = self.conn.compute.get_server(server.id)
-                if server.status == 'ACTIVE':
-                    logging.info(f"[MIGRATION] 虚拟机 {vm_name} 已在目标 OpenStack 环境中创建完成，目标可用区: {target_az}。")
-                    self.stop_vm(server.id)
-                    break
-                elif server.status in ['ERROR', 'PAUSED', 'SUSPENDED']:
-                    logging.error(f"[MIGRATION] 虚拟机 {vm_name} 创建失败，状态为 {server.status}，目标可用区: {target_az}。")
-                    break
-                import time
-                time.sleep(5)
-
-            return server
+    def remove_leftovers(self, plan):
+        """
+        删除上次未完成的迁移在目标端留下的虚拟机、固定 IP 端口与未挂载的卷，
+        多副本模式下其他 Pod 的租约过期、本 Pod 重新执行这台虚拟机之前调用。
+        只删除带有本任务、本虚拟机标记（见 resource_tags）的资源，同名的其他虚拟机与卷不受影响
+        :raise: 删除失败或固定 IP 被其他端口占用时抛出，调用方不再继续迁移
+        """
+        if not self.job_id:
+            raise RuntimeError("未设置所属任务，无法识别上次执行创建的资源")
+        conn = self.conn
+        vm_name = plan.vm_name
+        server_tags = self.resource_tags(vm_name)
+        for server in conn.compute.servers(name=f"^{re.escape(vm_name)}$"):
+            if server.name != vm_name:
+                continue
+            if not self._tagged(server, server_tags):
+                logging.warning(f"[MIGRATION] 目标虚拟机 {vm_name}（{server.id}）不是本任务创建的，保留")
+                continue
+            logging.warning(f"[MIGRATION] 删除上次执行留下的目标虚拟机 {vm_name}（{server.id}）")
+            conn.compute.delete_server(server)
+            conn.compute.wait_for_delete(server, interval=config.SERVER_WAIT_MIN_INTERVAL, wait=config.SERVER_STOP_TIMEOUT)
+        description = self.port_description(vm_name)
+        for info in self.ensure_network_exists(plan.network):
+            for port in conn.network.ports(network_id=info['network_id'], fixed_ips=[f"ip_address={info['ipaddr']}"]):
+                if not any(fixed_ip.get('ip_address') == info['ipaddr'] for fixed_ip in port.fixed_ips):
+                    continue
+                if getattr(port, 'description', None) != description:
+                    raise RuntimeError(f"IP {info['ipaddr']} 已被不是本任务创建的端口 {port.id} 占用")
+                logging.warning(f"[MIGRATION] 删除上次执行留下的端口 {port.id}，IP {info['ipaddr']}")
+                conn.network.delete_port(port)
+        for name, _, _, tags in self._target_volume_specs(plan):
+            for volume in conn.block_storage.volumes(details=True, name=name):
+                if volume.name != name or not self._tagged(volume, tags):
+                    continue
+                if volume.status not in ('available', 'error'):
+                    raise RuntimeError(f"上次执行留下的卷 {volume.id} 状态为 {volume.status}，无法删除")
+                logging.warning(f"[MIGRATION] 删除上次执行留下的卷 {name}（{volume.id}）")
+                conn.block_storage.delete_volume(volume)
+
+    def server_request(self, vm_name, target_az, target_flavor, target_network, ports, volumes):
+        """
+        :return: create_server 的参数，虚拟机挂载 volumes（第一个为启动卷）并使用 ports 创建
+        :raise RuntimeError: 有网卡的端口未创建成功（如 IP 已被占用），不退回到自动分配 IP 的默认网络
+        """
+        if len(ports) < len(target_network):
+            raise RuntimeError(f"虚拟机 {vm_name} 有 {len(target_network) - len(ports)} 个固定 IP 端口创建失败")
+        networks = [{"port": port.id} for port in ports]
+
+        block_device_mapping = []
+        for index, volume in enumerate(volumes):
+            mapping = {
+                "uuid": volume.id,
+                "source_type": "volume",
+                "destination_type": "volume",
+                "delete_on_termination": False
+            }
+            if index == 0:
+                mapping["boot_index"] = 0
+            block_device_mapping.append(mapping)
+
+        return dict(
+            name=vm_name,
+            metadata=self.resource_tags(vm_name),
+            adminPass=config.default_vm_pass,
+            flavor_id=target_flavor.id,
+            networks=networks,
+            block_device_mapping_v2=block_device_mapping,
+            #security_groups=[{'name': sg.name} for sg in target_security_groups],
+            security_groups=[{"name": config.DEFAULT_SEC_GROUP}],
+            availability_zone=target_az  # 指定目标计算可用区
+        )
+
+    def create_vm_in_target(self, plan, target_az, volumes=None, vm_progress=None):
+        """
+        端口、空白卷、flavor 并发准备，虚拟机直接挂载这些空白卷创建，不再从镜像克隆随后被 rbd rm 覆盖的启动卷；
+        虚拟机启动后关机，数据复制在关机之后写入这些卷
+        :param plan: preflight.VmPlan，源虚拟机的详情、卷、网卡与镜像均取自预检结果
+        :param volumes: 已纳管、写好数据的目标卷（manage 模式），第一个为启动卷；给出时不再创建空白卷，失败时也不删除
+        :param vm_progress: progress.VmProgress，迁移被中止时不再创建虚拟机，删除已创建的端口与卷
+        :return: ProvisionedVm，失败返回 None
+        """
+        vm_name = plan.vm_name
+        ports = []
+        managed = volumes is not None
+        volumes = list(volumes) if managed else []
+        try:
+            source_flavor = plan.server_info.get('flavor', {})
+            target_network = self.ensure_network_exists(plan.network)
+            if not target_network:
+                logging.warning(f"[MIGRATION] 目标环境中没有与虚拟机 {vm_name} 匹配的网络，跳过虚拟机创建。")
+                return None
+            target_image = self._target_image(plan)
+            volume_specs = [] if managed else self._target_volume_specs(plan)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=config.PROVISION_PARALLEL_REQUESTS) as executor:
+                flavor_future = executor.submit(self.ensure_flavor_exists, source_flavor)
+                volume_futures = [executor.submit(self._create_blank_volume, name, size, bootable, target_image, tags)
+                                  for name, size, bootable, tags in volume_specs]
+                ports = self._create_ports(target_network, executor, vm_name)
+                target_flavor = flavor_future.result()
+                errors = []
+                for future in volume_futures:
+                    try:
+                        volumes.append(future.result())
+                    except Exception as e:
+                        errors.append(str(e))
+            if errors:
+                raise RuntimeError(f"创建目标卷失败: {'; '.join(errors)}")
+            if not target_flavor:
+                raise RuntimeError("无法在目标环境中创建 flavor")
+            if vm_progress is not None:
+                vm_progress.check_aborted()
+
+            server = self.conn.compute.create_server(
+                **self.server_request(vm_name, target_az, target_flavor, target_network, ports, volumes))
         except Exception as e:
             logging.error(f"[MIGRATION] 在目标 OpenStack 环境中创建虚拟机时出现错误，目标可用区: {target_az}: {e}")
+            self._cleanup(ports, [] if managed else volumes)
+            return None
+
+        try:
+            with POLL_WAIT_SECONDS.time(loop='create_vm'):
+                server = get_server_waiter(self.conn).wait(
+                    server.id, ['ACTIVE', 'ERROR', 'PAUSED', 'SUSPENDED'], config.SERVER_CREATE_TIMEOUT)
+            if server.status != 'ACTIVE':
+                logging.error(f"[MIGRATION] 虚拟机 {vm_name} 创建失败，状态为 {server.status}，目标可用区: {target_az}。")
+                return None
+            logging.info(f"[MIGRATION] 虚拟机 {vm_name} 已在目标 OpenStack 环境中创建完成，目标可用区: {target_az}。")
+            if not self.stop_vm(server.id):
+                return None
+            return ProvisionedVm(server, volumes)
+        except Exception as e:
+            logging.error(f"[MIGRATION] 等待目标虚拟机 {vm_name} 创建完成时出现错误，目标可用区: {target_az}: {e}")
             return None
@@ -0,0 +1,237 @@
+"""
+迁移预演（dry-run）：不创建虚拟机、不复制数据，估算一个批次的传输量与耗时。
+预检（preflight）解析清单中的每台虚拟机，按卷查询 Ceph 的分配大小与实际占用（rbd du 或已分配区间），
+再按 MigrationScheduler 的创建/复制上限、历次复制记录的单流速率与当前限速模拟调度，得到每台虚拟机与整个批次的预计完成时间。
+虚拟机按 config.BATCH_ORDERING 的出队顺序模拟（见 batch_order，不模拟源计算节点的分散）。
+"""
+import heapq
+import itertools
+import logging
+import time
+import concurrent.futures
+from collections import deque
+import config
+from batch_input import BatchInput
+from batch_order import order_key, transfer_seconds
+from ceph_utils import CephUtils
+from copy_journal import get_copy_journal
+from rbd_backend import cluster_id
+from throttle import get_throttle
+
+# 需要先创建目标虚拟机的迁移方式
+PROVISION_METHODS = ('snapshot', 'full_migrate', 'precopy')
+
+
+class _SimCopy:
+    def __init__(self, vm, source_pool, target_pool, nbytes, rate_limit):
+        self.vm = vm
+        self.source_pool = source_pool
+        self.target_pool = target_pool
+        self.remaining = float(nbytes)
+        self.rate_limit = rate_limit
+        self.rate = 0.0
+
+
+def simulate_batch(vms, scheduler, concurrency, stream_rate, source_limit=None, target_limit=None,
+                   provision_seconds=None):
+    """
+    按 MigrationScheduler 的规则模拟一个批次：最多 concurrency 台虚拟机同时处理，
+    创建阶段最多 provision_limit 台，复制按提交顺序派发并受总数与每个存储池的上限约束
+    :param vms: [{'name': ..., 'provision': 是否先创建目标虚拟机, 'copies': [(源池, 目标池, 字节数, 单卷限速或 None), ...]}]，按出队顺序
+    :param stream_rate: 单个复制流的速率（字节/秒）
+    :param source_limit: 源集群总限速（字节/秒），同时进行的复制平分
+    :param target_limit: 目标集群总限速
+    :return: ({虚拟机名称: (开始秒数, 完成秒数)}, 批次总秒数)
+    """
+    provision_seconds = config.PLAN_PROVISION_SECONDS if provision_seconds is None else provision_seconds
+    waiting = deque(vms)
+    provision_queue = deque()
+    provisioning = []
+    pending = []
+    running = []
+    copies_left = {}
+    timeline = {}
+    now = 0.0
+    active = 0
+    order = itertools.count()
+
+    def submit(vm):
+        copies = [_SimCopy(vm['name'], *copy) for copy in vm['copies']]
+        copies_left[vm['name']] = len(copies)
+        pending.extend(copies)
+        return bool(copies)
+
+    def finish(name):
+        nonlocal active
+        timeline[name] = (timeline[name][0], now)
+        active -= 1
+
+    while True:
+        while waiting and active < concurrency:
+            vm = waiting.popleft()
+            active += 1
+            timeline[vm['name']] = (now, None)
+            if vm['provision']:
+                provision_queue.append(vm)
+            elif not submit(vm):
+                finish(vm['name'])
+        while provision_queue and len(provisioning) < scheduler.provision_limit:
+            vm = provision_queue.popleft()
+            heapq.heappush(provisioning, (now + provision_seconds, next(order), vm))
+        # 与 MigrationScheduler._dispatch 相同：按提交顺序，存储池满时跳过
+        source_running, target_running = {}, {}
+        for copy in running:
+            source_running[copy.source_pool] = source_running.get(copy.source_pool, 0) + 1
+            target_running[copy.target_pool] = target_running.get(copy.target_pool, 0) + 1
+        for copy in list(pending):
+            if len(running) >= scheduler.copy_limit:
+                break
+            if source_running.get(copy.source_pool, 0) >= scheduler.per_source_pool \
+                    or target_running.get(copy.target_pool, 0) >= scheduler.per_target_pool:
+                continue
+            pending.remove(copy)
+            running.append(copy)
+            source_running[copy.source_pool] = source_running.get(copy.source_pool, 0) + 1
+            target_running[copy.target_pool] = target_running.get(copy.target_pool, 0) + 1
+        if not running and not provisioning:
+            break
+        share = stream_rate
+        for limit in (source_limit, target_limit):
+            if limit and running:
+                share = min(share, limit / len(running))
+        next_event = provisioning[0][0] - now if provisioning else None
+        for copy in running:
+            copy.rate = min(share, copy.rate_limit) if copy.rate_limit else share
+            eta = copy.remaining / copy.rate
+            if next_event is None or eta < next_event:
+                next_event = eta
+        now += next_event
+        for copy in list(running):
+            copy.remaining -= copy.rate * next_event
+            if copy.remaining <= 1e-6 * max(1.0, copy.rate):
+                running.remove(copy)
+                copies_left[copy.vm] -= 1
+                if not copies_left[copy.vm]:
+                    finish(copy.vm)
+        while provisioning and provisioning[0][0] <= now + 1e-9:
+            _, _, vm = heapq.heappop(provisioning)
+            if not submit(vm):
+                finish(vm['name'])
+    return timeline, now
+
+
+class BatchPlanner:
+    def __init__(self, manager):
+        """:param manager: migration_manager.MigrationManager，使用它的连接参数、Ceph 配置与调度上限"""
+        self.manager = manager
+
+    def _ceph_utils(self):
+        manager = self.manager
+        return CephUtils(manager.source_ceph_conf, manager.source_ceph_pool, manager.target_ceph_conf,
+                         manager.target_ceph_pool, manager.rbd_backend, manager.queue_depth, manager.copy_workers,
+                         manager.wire_transfer)
+
+    def _stream_rate(self):
+        rate, samples = get_copy_journal().copy_rate(cluster_id(self.manager.source_ceph_conf),
+                                                     cluster_id(self.manager.target_ceph_conf))
+        return (rate or config.PLAN_DEFAULT_RATE), samples
+
+    def plan(self, file_path, concurrency, migration_method):
+        """
+        :return: 可 JSON 序列化的预演结果，字节数为整数，时间单位为秒
+        """
+        batch = BatchInput(file_path, migration_method, self.manager.target_ceph_pool)
+        failures = []
+        entries = sorted(self.manager.iter_plans(batch, failures), key=lambda entry: (-entry[1].priority, entry[0]))
+        ceph_utils = self._ceph_utils()
+        volumes = {}
+        for _, row, plan in entries:
+            volumes[plan.vm_name] = ceph_utils.source_volumes(plan.server, plan.volumes, plan.is_boot_from_volume)
+        tasks = [(plan.vm_name, volume, row.method) for _, row, plan in entries for volume in volumes[plan.vm_name]]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=config.PLAN_WORKERS) as executor:
+            futures = {(name, volume['volume_id']): executor.submit(ceph_utils.estimate_volume, volume['pool'],
+                                                                    volume['volume_id'], method)
+                       for name, volume, method in tasks}
+
+        limits = get_throttle().limits()
+        vm_results, simulated, ordering = [], [], []
+        for seq, row, plan in entries:
+            vm_volumes, copies, errors = [], [], []
+            rate_limit = config.BANDWIDTH_CLASSES[row.bandwidth_class]['bytes'] if row.bandwidth_class \
+                else limits['volume']['bytes']
+            for volume in volumes[plan.vm_name]:
+                try:
+                    provisioned, used, transfer = futures[(plan.vm_name, volume['volume_id'])].result()
+                except Exception as e:
+                    errors.append(f"{volume['pool']}/{volume['volume_id']}: {e}")
+                    continue
+                vm_volumes.append({'name': volume['name'], 'pool': volume['pool'], 'image': volume['volume_id'],
+                                   'provisioned_bytes': provisioned, 'used_bytes': used, 'transfer_bytes': transfer})
+                copies.append((volume['pool'], row.target_pool, transfer, rate_limit))
+            if errors:
+                reason = f"查询卷占用失败: {'; '.join(errors)}"
+                logging.error(f"[MIGRATION] 预演虚拟机 {plan.vm_name} {reason}")
+                failures.append((plan.vm_name, reason))
+                continue
+            simulated.append({'name': plan.vm_name, 'provision': row.method in PROVISION_METHODS, 'copies': copies})
+            ordering.append((seq, row, rate_limit))
+            vm_results.append({
+                'name': plan.vm_name,
+                'target_az': row.target_az,
+                'method': row.method,
+                'priority': row.priority,
+                'target_pool': row.target_pool,
+                'bandwidth_class': row.bandwidth_class,
+                'deadline': row.deadline.isoformat(sep=' ') if row.deadline is not None else None,
+                'volumes': vm_volumes,
+                'provisioned_bytes': sum(v['provisioned_bytes'] for v in vm_volumes),
+                'used_bytes': sum(v['used_bytes'] for v in vm_volumes),
+                'transfer_bytes': sum(v['transfer_bytes'] for v in vm_volumes),
+            })
+
+        stream_rate, samples = self._stream_rate()
+        # 与实际迁移相同的出队顺序
+        keys = [order_key(config.BATCH_ORDERING, row.priority, seq,
+                          transfer_seconds(vm['transfer_bytes'], stream_rate, rate_limit),
+                          row.deadline.timestamp() if row.deadline is not None else None)
+                for vm, (seq, row, rate_limit) in zip(vm_results, ordering)]
+        ranked = sorted(range(len(vm_results)), key=keys.__getitem__)
+        vm_results = [vm_results[index] for index in ranked]
+        simulated = [simulated[index] for index in ranked]
+        timeline, total_seconds = simulate_batch(simulated, self.manager.scheduler, concurrency, stream_rate,
+                                                 limits['source']['bytes'], limits['target']['bytes'])
+        now = time.time()
+        for vm, index in zip(vm_results, ranked):
+            start, finish = timeline[vm['name']]
+            vm['start_seconds'] = round(start)
+            vm['eta_seconds'] = round(finish)
+            deadline = ordering[index][1].deadline
+            vm['deadline_missed'] = deadline is not None and now + finish > deadline.timestamp()
+        scheduler = self.manager.scheduler
+        logging.info(f"[MIGRATION] 预演完成：可迁移 {len(vm_results)} 台，预计传输 "
+                     f"{sum(vm['transfer_bytes'] for vm in vm_results) / 1024 ** 3:.1f} GB，预计耗时 {total_seconds / 60:.0f} 分钟")
+        return {
+            'vms': vm_results,
+            'failures': [{'name': name, 'reason': reason} for name, reason in failures],
+            'invalid_rows': [{'line': line, 'message': message} for line, message in batch.errors],
+            'total': {
+                'vms': len(vm_results),
+                'provisioned_bytes': sum(vm['provisioned_bytes'] for vm in vm_results),
+                'used_bytes': sum(vm['used_bytes'] for vm in vm_results),
+                'transfer_bytes': sum(vm['transfer_bytes'] for vm in vm_results),
+                'eta_seconds': round(total_seconds),
+            },
+            'assumptions': {
+                'stream_rate_bytes': round(stream_rate),
+                'rate_samples': samples,
+                'source_limit_bytes': limits['source']['bytes'],
+                'target_limit_bytes': limits['target']['bytes'],
+                'provision_seconds': config.PLAN_PROVISION_SECONDS,
+                'concurrency': concurrency,
+                'ordering': config.BATCH_ORDERING,
+                'provision_limit': scheduler.provision_limit,
+                'copy_limit': scheduler.copy_limit,
+                'per_source_pool': scheduler.per_source_pool,
+                'per_target_pool': scheduler.per_target_pool,
+            },
+        }
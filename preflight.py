@@ -0,0 +1,141 @@
+"""
+迁移前的批量预检：源端虚拟机、卷、端口、子网、镜像各用一次列表调用加载（按当前项目过滤），
+为每台虚拟机生成迁移计划 VmPlan，之后的创建与复制只读计划，不再逐台调用 find_server / get_volume / get_subnet；
+找不到虚拟机、卷、网卡，或目标端没有匹配子网的虚拟机在开始迁移前即报告失败。
+"""
+import logging
+import time
+from collections import namedtuple
+import config
+
+# 可以迁移的源虚拟机状态
+MIGRATABLE_STATUSES = ('ACTIVE', 'SHUTOFF')
+
+
+class PreflightError(Exception):
+    """虚拟机无法生成迁移计划"""
+
+
+class VmPlan(namedtuple('VmPlan', ['vm_name', 'server', 'server_info', 'is_boot_from_volume', 'volumes', 'network',
+                                   'image_name'])):
+    """
+    一台虚拟机的迁移计划
+    server_info: 源虚拟机详情 server.to_dict()
+    volumes: 按挂载顺序排列的源卷
+    network: [{"subnet": 源子网, "ipaddr": IP 地址}, ...]
+    image_name: 源镜像名称，镜像已删除时为 None
+    """
+    __slots__ = ()
+
+
+class Preflight:
+    def __init__(self, source_conn, target_conn=None):
+        """
+        :param source_conn: 源端 OpenStackUtils
+        :param target_conn: 目标端 OpenStackUtils，给出时同时检查目标端子网与镜像
+        """
+        self.source_conn = source_conn
+        self.target_conn = target_conn
+        self._servers_by_name = {}
+        self._servers_by_ip = {}
+        self._volumes = {}
+        self._ports_by_device = {}
+        self._subnets = {}
+        self._image_names = {}
+        self.loaded = False
+
+    def load(self):
+        """一次性加载源端资源"""
+        conn = self.source_conn.conn
+        start = time.monotonic()
+        project_id = getattr(conn, 'current_project_id', None)
+        project_filter = {'project_id': project_id} if project_id else {}
+        servers_by_name, servers_by_ip = {}, {}
+        # 计算服务默认只列出当前项目的虚拟机；网络服务以管理员身份会列出所有项目的端口，需显式过滤
+        for server in conn.compute.servers(details=True):
+            servers_by_name.setdefault(server.name, []).append(server)
+            for addresses in (server.addresses or {}).values():
+                for address in addresses:
+                    servers_by_ip[address['addr']] = server
+        self._servers_by_name = servers_by_name
+        self._servers_by_ip = servers_by_ip
+        self._volumes = {volume.id: volume for volume in conn.block_storage.volumes(details=True)}
+        ports_by_device = {}
+        for port in conn.network.ports(**project_filter):
+            ports_by_device.setdefault(port.device_id, []).append(port)
+        self._ports_by_device = ports_by_device
+        # 子网可能来自共享网络，不按项目过滤
+        self._subnets = {subnet.id: subnet for subnet in conn.network.subnets()}
+        self._image_names = {image.id: image.name for image in conn.image.images()}
+        self.loaded = True
+        logging.info(f"[MIGRATION] 预检已加载源端资源：虚拟机 {sum(map(len, servers_by_name.values()))} 台，"
+                     f"卷 {len(self._volumes)} 个，端口 {sum(map(len, ports_by_device.values()))} 个，"
+                     f"子网 {len(self._subnets)} 个，用时 {time.monotonic() - start:.1f} 秒")
+
+    def _find_server(self, vm_name, ip_address):
+        if vm_name:
+            servers = self._servers_by_name.get(vm_name, [])
+            if not servers:
+                raise PreflightError(f"源环境中未找到虚拟机 {vm_name}")
+            if len(servers) > 1:
+                raise PreflightError(f"源环境中有 {len(servers)} 台名为 {vm_name} 的虚拟机")
+            return servers[0]
+        server = self._servers_by_ip.get(ip_address)
+        if server is None:
+            raise PreflightError(f"源环境中未找到 IP 为 {ip_address} 的虚拟机")
+        return server
+
+    def _volume(self, volume_id):
+        volume = self._volumes.get(volume_id)
+        if volume is None:
+            # 列表之后新挂载的卷，单独查询一次
+            try:
+                volume = self._volumes[volume_id] = self.source_conn.conn.block_storage.get_volume(volume_id)
+            except Exception as e:
+                raise PreflightError(f"找不到挂载的卷 {volume_id}: {e}")
+        return volume
+
+    def _network(self, server):
+        network = []
+        for port in self._ports_by_device.get(server.id, []):
+            for fixed_ip in port.fixed_ips:
+                subnet = self._subnets.get(fixed_ip.get('subnet_id'))
+                if subnet is not None:
+                    network.append({"subnet": subnet, "ipaddr": fixed_ip["ip_address"]})
+        return network
+
+    def _check_target(self, vm_name, network, image_name):
+        target = self.target_conn
+        if not any(target.inventory.find_subnet(target.conn, nic["subnet"].cidr, nic["ipaddr"]) for nic in network):
+            raise PreflightError(f"目标环境中没有与虚拟机 {vm_name} 任一网卡匹配的子网")
+        if target.inventory.image(target.conn, image_name) is None \
+                and target.inventory.image(target.conn, config.DEFAULT_MIGRATE_IMAGE) is None:
+            raise PreflightError(f"目标环境中找不到镜像 {image_name} 或 {config.DEFAULT_MIGRATE_IMAGE}")
+
+    def plan(self, vm_name=None, ip_address=None):
+        """
+        :param vm_name: 虚拟机名称，与 ip_address 二选一
+        :return: VmPlan
+        :raise PreflightError: 虚拟机不满足迁移条件
+        """
+        if not self.loaded:
+            self.load()
+        server = self._find_server(vm_name, ip_address)
+        if server.status not in MIGRATABLE_STATUSES:
+            raise PreflightError(f"虚拟机 {server.name} 状态为 {server.status}，无法迁移")
+        server_info = server.to_dict()
+        volumes = [self._volume(attachment['id']) for attachment in server_info.get('attached_volumes') or []]
+        is_boot_from_volume = not (server_info.get('image') or {}).get('id')
+        if is_boot_from_volume and not volumes:
+            raise PreflightError(f"虚拟机 {server.name} 从卷启动但没有挂载卷")
+        network = self._network(server)
+        if not network:
+            raise PreflightError(f"虚拟机 {server.name} 没有可迁移的网卡")
+        if is_boot_from_volume:
+            image_id = (volumes[0].volume_image_metadata or {}).get('image_id')
+        else:
+            image_id = server_info['image']['id']
+        image_name = self._image_names.get(image_id)
+        if self.target_conn is not None:
+            self._check_target(server.name, network, image_name)
+        return VmPlan(server.name, server, server_info, is_boot_from_volume, volumes, network, image_name)
@@ -0,0 +1,182 @@
+"""
+迁移进度跟踪：按 任务 → 虚拟机 → 卷 记录阶段、已复制字节、总字节、实时速率与预计剩余时间，
+数据由 CephUtils 的 RBD 复制路径直接上报。
+"""
+import threading
+import time
+
+# 速率按指数滑动平均计算，采样间隔至少 1 秒
+RATE_SAMPLE_INTERVAL = 1.0
+RATE_SMOOTHING = 0.3
+
+
+class MigrationAborted(Exception):
+    """迁移被中止（如多副本模式下本 Pod 失去了工作项的租约），已开始的复制与创建不再继续"""
+
+
+class VolumeProgress:
+    def __init__(self, name, lock, vm=None):
+        self.name = name
+        self._lock = lock
+        self._vm = vm
+        self.phase = 'pending'
+        self.bytes_copied = 0
+        self.total_bytes = None
+        self.rate = 0.0
+        self.started_at = None
+        self.updated_at = time.time()
+        self._sample_at = None
+        self._sample_bytes = 0
+
+    @property
+    def aborted(self):
+        """所属虚拟机的迁移已被中止，复制循环据此提前退出"""
+        return self._vm is not None and self._vm.aborted
+
+    def set_phase(self, phase):
+        with self._lock:
+            self.phase = phase
+            self.updated_at = time.time()
+
+    def set_total(self, total_bytes):
+        """开始一次新的复制（例如预拷贝的新一轮），已复制字节清零"""
+        with self._lock:
+            now = time.time()
+            self.total_bytes = total_bytes
+            self.bytes_copied = 0
+            self.started_at = self.started_at or now
+            self._sample_at = now
+            self._sample_bytes = 0
+            self.updated_at = now
+
+    def add(self, nbytes):
+        with self._lock:
+            now = time.time()
+            self.bytes_copied += nbytes
+            self.updated_at = now
+            if self._sample_at is None:
+                self._sample_at = now
+                return
+            elapsed = now - self._sample_at
+            if elapsed >= RATE_SAMPLE_INTERVAL:
+                current = (self.bytes_copied - self._sample_bytes) / elapsed
+                self.rate = current if not self.rate else RATE_SMOOTHING * current + (1 - RATE_SMOOTHING) * self.rate
+                self._sample_at = now
+                self._sample_bytes = self.bytes_copied
+
+    def to_dict(self):
+        eta = None
+        if self.total_bytes is not None and self.rate > 0:
+            eta = max(0, self.total_bytes - self.bytes_copied) / self.rate
+        return {
+            'name': self.name,
+            'phase': self.phase,
+            'bytes_copied': self.bytes_copied,
+            'total_bytes': self.total_bytes,
+            'rate_mbps': round(self.rate / 1024 ** 2, 2),
+            'eta_seconds': round(eta) if eta is not None else None,
+            'updated_at': self.updated_at,
+        }
+
+
+class VmProgress:
+    def __init__(self, name, lock):
+        self.name = name
+        self._lock = lock
+        self.phase = 'queued'
+        self.error = None
+        self.volumes = {}
+        self._aborted = threading.Event()
+        self.abort_reason = None
+
+    def abort(self, reason):
+        """中止这台虚拟机的迁移，复制与创建在下一次检查时退出"""
+        self.abort_reason = reason
+        self._aborted.set()
+
+    @property
+    def aborted(self):
+        return self._aborted.is_set()
+
+    def check_aborted(self):
+        """:raise MigrationAborted: 迁移已被中止"""
+        if self._aborted.is_set():
+            raise MigrationAborted(self.abort_reason)
+
+    def set_phase(self, phase, error=None):
+        with self._lock:
+            self.phase = phase
+            self.error = error
+
+    def volume(self, name):
+        with self._lock:
+            volume = self.volumes.get(name)
+            if volume is None:
+                volume = self.volumes[name] = VolumeProgress(name, self._lock, self)
+            return volume
+
+    def to_dict(self):
+        volumes = [volume.to_dict() for volume in self.volumes.values()]
+        return {
+            'name': self.name,
+            'phase': self.phase,
+            'error': self.error,
+            'bytes_copied': sum(v['bytes_copied'] for v in volumes),
+            'total_bytes': sum(v['total_bytes'] or 0 for v in volumes),
+            'rate_mbps': round(sum(v['rate_mbps'] for v in volumes if v['phase'] not in ('completed', 'failed')), 2),
+            'volumes': volumes,
+        }
+
+
+class JobProgress:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._lock = threading.RLock()
+        self.vms = {}
+
+    def vm(self, name):
+        with self._lock:
+            vm = self.vms.get(name)
+            if vm is None:
+                vm = self.vms[name] = VmProgress(name, self._lock)
+            return vm
+
+    def restart_vm(self, name):
+        """虚拟机重新执行时换用新的进度记录，被中止的上一次执行仍持有旧记录，不影响本次"""
+        with self._lock:
+            vm = self.vms[name] = VmProgress(name, self._lock)
+            return vm
+
+    def to_dict(self):
+        with self._lock:
+            vms = [vm.to_dict() for vm in self.vms.values()]
+        phases = {}
+        for vm in vms:
+            phases[vm['phase']] = phases.get(vm['phase'], 0) + 1
+        return {
+            'job_id': self.job_id,
+            'vm_phases': phases,
+            'bytes_copied': sum(vm['bytes_copied'] for vm in vms),
+            'total_bytes': sum(vm['total_bytes'] for vm in vms),
+            'rate_mbps': round(sum(vm['rate_mbps'] for vm in vms), 2),
+            'vms': vms,
+        }
+
+
+class ProgressTracker:
+    """进程内所有任务的进度"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._jobs[job_id] = JobProgress(job_id)
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
@@ -0,0 +1,188 @@
+"""
+多副本模式下每个 Pod 的工作线程：从共享工作队列领取虚拟机，在本 Pod 执行迁移并回写结果，
+后台线程为本 Pod 持有的工作项续约。同一任务在本 Pod 只构造一次 MigrationManager 并做一次预检加载，
+该任务的所有虚拟机共享目标端缓存、调度器与源端资源。
+"""
+import logging
+import threading
+import time
+import config
+import connection_pool
+from metrics import ACTIVE_WORKERS
+from migration_manager import MigrationManager
+from openstack_utils import OpenStackUtils
+from planner import PROVISION_METHODS
+from preflight import PreflightError
+from progress import VmProgress
+from work_queue import get_work_queue
+
+
+class QueueWorker:
+    """
+    :param work_queue: work_queue.WorkQueue，默认共享队列
+    :param progress: progress.ProgressTracker，本 Pod 执行的虚拟机进度记在其中
+    :param slots: 本 Pod 同时迁移的虚拟机数量，默认 config.WORKER_SLOTS
+    """
+
+    def __init__(self, work_queue=None, progress=None, owner=None, labels=None, slots=None):
+        self.work_queue = work_queue or get_work_queue()
+        self.progress = progress
+        self.owner = owner or config.POD_NAME
+        self.labels = set(config.WORKER_LOCALITY if labels is None else labels)
+        self.slots = slots or config.WORKER_SLOTS
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        # 本 Pod 正在执行的工作项 ID → (执行序号, VmProgress)，失去租约时通过 VmProgress.abort 中止
+        self._held = {}
+        # 构造任务时要加载源端资源，单独加锁，不阻塞续约线程
+        self._jobs_lock = threading.Lock()
+        self._jobs = {}
+        self._threads = []
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._run_slot, name=f"queue-worker-{slot}", daemon=True)
+                         for slot in range(self.slots)]
+        self._threads.append(threading.Thread(target=self._renew_leases, name='queue-lease', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logging.info(f"[MIGRATION] {self.owner} 开始领取迁移工作项，并发 {self.slots}，就近标签 {sorted(self.labels)}")
+
+    def stop(self):
+        """不再领取新的工作项，已开始的虚拟机执行完后线程退出"""
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _run_slot(self):
+        while not self._stopped.is_set():
+            try:
+                item = self.work_queue.claim(self.owner, self.labels)
+            except Exception as e:
+                logging.error(f"[MIGRATION] 领取迁移工作项出错: {e}")
+                item = None
+            if item is None:
+                self._evict_finished_jobs()
+                self._stopped.wait(config.WORK_POLL_INTERVAL)
+                continue
+            if self.work_queue.is_cancelled(item.job_id):
+                if self.progress is not None:
+                    self.progress.job(item.job_id).vm(item.vm_name).set_phase('cancelled')
+                self.work_queue.complete(item.id, self.owner, cancelled=True)
+                continue
+            vm_progress = self._vm_progress(item)
+            with self._lock:
+                previous = self._held.get(item.id)
+                self._held[item.id] = (item.attempts, vm_progress)
+            if previous is not None:
+                # 本 Pod 自己过期的租约又被本 Pod 领取，先中止上一次执行
+                previous[1].abort(f"第 {item.attempts} 次执行已开始")
+            try:
+                error = self._execute(item, vm_progress)
+            except Exception as e:
+                logging.error(f"[MIGRATION] 执行虚拟机 {item.vm_name} 的工作项出错: {e}")
+                error = str(e)
+            finally:
+                with self._lock:
+                    if self._held.get(item.id, (None,))[0] == item.attempts:
+                        del self._held[item.id]
+            if not self.work_queue.complete(item.id, self.owner, error, attempt=item.attempts):
+                logging.warning(f"[MIGRATION] 虚拟机 {item.vm_name} 的租约已被其他 Pod 接手，本次结果未记录")
+                # 本次执行已经停止，接手的 Pod 可以清理目标端资源
+                self.work_queue.release(item.id, item.attempts)
+
+    def _vm_progress(self, item):
+        """每次执行使用新的进度记录，同时作为中止这次执行的标志"""
+        if self.progress is None:
+            return VmProgress(item.vm_name, threading.RLock())
+        return self.progress.job(item.job_id).restart_vm(item.vm_name)
+
+    def _renew_leases(self):
+        renewed_at = time.monotonic()
+        while not self._stopped.wait(config.LEASE_SECONDS / 3):
+            with self._lock:
+                held = dict(self._held)
+            if not held:
+                renewed_at = time.monotonic()
+                continue
+            try:
+                renewed = self.work_queue.renew(self.owner, set(held))
+                renewed_at = time.monotonic()
+            except Exception as e:
+                logging.error(f"[MIGRATION] 续约迁移工作项出错: {e}")
+                if time.monotonic() - renewed_at < config.LEASE_SECONDS:
+                    continue
+                # 超过租约时长未能续约，租约可能已被其他 Pod 接手，全部中止
+                renewed = set()
+            for item_id in set(held) - renewed:
+                logging.warning(f"[MIGRATION] 工作项 {item_id} 的租约已失效，可能已由其他 Pod 接手，中止本 Pod 的执行")
+                held[item_id][1].abort("租约已失效，工作项可能已由其他 Pod 接手")
+
+    def _job(self, job_id):
+        """:return: (MigrationManager, 已加载的 Preflight)，同一任务在本 Pod 只构造一次"""
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                spec = self.work_queue.job_spec(job_id)
+                if spec is None:
+                    raise RuntimeError(f"任务 {job_id} 已结束")
+                manager = MigrationManager.from_spec(spec)
+                manager.job_id = job_id
+                connection_pool.reserve(manager.source_auth_args, self.slots)
+                connection_pool.reserve(manager.target_auth_args, self.slots)
+                preflight = manager.preflight()
+                preflight.load()
+                job = self._jobs[job_id] = (manager, preflight)
+            return job
+
+    def _evict_finished_jobs(self):
+        with self._jobs_lock:
+            finished = set(self._jobs) - self.work_queue.active_jobs()
+            for job_id in finished:
+                manager, _ = self._jobs.pop(job_id)
+                manager.scheduler.shutdown()
+
+    def _await_previous_attempt(self, item):
+        """
+        等待上一次执行的持有者确认已停止，最多 config.LEASE_RELEASE_WAIT 秒
+        :return: 是否得到确认，未确认时原 Pod 多半已崩溃
+        """
+        deadline = time.monotonic() + config.LEASE_RELEASE_WAIT
+        while self.work_queue.released(item.id) < item.attempts - 1:
+            if time.monotonic() >= deadline or self._stopped.is_set():
+                return False
+            time.sleep(min(config.WORK_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+        return True
+
+    def _execute(self, item, vm_progress):
+        """:return: 失败原因，成功返回 None"""
+        payload = item.payload
+        manager, preflight = self._job(item.job_id)
+        try:
+            plan = preflight.plan(item.vm_name)
+        except PreflightError as e:
+            return str(e)
+        if item.attempts > 1:
+            # 上次执行的 Pod 未完成就失去了租约，先删除它在目标端创建的虚拟机、端口与卷，否则固定 IP 端口无法重建
+            logging.warning(f"[MIGRATION] 虚拟机 {item.vm_name} 第 {item.attempts} 次执行")
+            if payload['method'] in PROVISION_METHODS:
+                if not self._await_previous_attempt(item):
+                    logging.warning(f"[MIGRATION] 虚拟机 {item.vm_name} 上次执行的 Pod 未确认停止，"
+                                    f"已等待 {config.LEASE_RELEASE_WAIT} 秒，按已崩溃处理")
+                if vm_progress.aborted:
+                    return vm_progress.abort_reason
+                try:
+                    target_conn = OpenStackUtils(manager.target_auth_args, manager.target_inventory)
+                    target_conn.job_id = item.job_id
+                    target_conn.remove_leftovers(plan)
+                except Exception as e:
+                    logging.error(f"[MIGRATION] 清理虚拟机 {item.vm_name} 上次执行留下的目标资源失败: {e}")
+                    return f"清理上次执行留下的目标资源失败: {e}"
+        logging.info(f"[MIGRATION] {self.owner} 开始处理虚拟机 {item.vm_name} 的迁移任务，目标可用区: {payload['target_az']}，"
+                     f"迁移方式: {payload['method']}，优先级: {item.priority}")
+        with ACTIVE_WORKERS.track_inprogress(kind='vm'):
+            failed = manager.migrate_vm_cross_openstack_ceph(item.vm_name, payload['target_az'], payload['method'],
+                                                             vm_progress, payload['target_pool'],
+                                                             payload['bandwidth_class'], plan)
+        if failed:
+            return vm_progress.error if vm_progress is not None and vm_progress.error else "迁移失败"
+        return None
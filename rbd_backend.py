@@ -0,0 +1,820 @@
+import subprocess
+import json
+import logging
+import os
+import threading
+import queue
+import signal
+import collections
+import concurrent.futures
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+import config
+from metrics import InstrumentedBackend, BYTES_IN_FLIGHT, COPIED_BYTES, ACTIVE_WORKERS
+from rbd_cache import CachedBackend
+from throttle import get_throttle
+
+MiB = 1024 * 1024
+# 命令行管道运行期间检查迁移是否被中止的间隔（秒）
+ABORT_POLL_INTERVAL = 1
+
+
+class RbdBackendError(Exception):
+    """RBD 后端操作失败"""
+
+
+class ImageSpec(namedtuple('ImageSpec', ['conf', 'pool', 'image', 'snap'])):
+    """描述一个 RBD 镜像（或其快照）的位置：ceph 配置文件、池、镜像名、快照名"""
+    __slots__ = ()
+
+    def __new__(cls, conf, pool, image, snap=None):
+        return super().__new__(cls, conf, pool, image, snap)
+
+    @property
+    def path(self):
+        if self.snap:
+            return f"{self.pool}/{self.image}@{self.snap}"
+        return f"{self.pool}/{self.image}"
+
+    def at(self, snap):
+        return self._replace(snap=snap)
+
+
+class ImageLayout(namedtuple('ImageLayout', ['object_size', 'stripe_unit', 'stripe_count'])):
+    """新建镜像的对象大小与条带参数（字节 / 个），为 None 的项使用集群默认值"""
+    __slots__ = ()
+
+    def __new__(cls, object_size=None, stripe_unit=None, stripe_count=None):
+        return super().__new__(cls, object_size, stripe_unit, stripe_count)
+
+    def cli_args(self):
+        args = ""
+        if self.object_size:
+            args += f" --object-size {self.object_size // 1024}K"
+        if self.stripe_unit:
+            args += f" --stripe-unit {self.stripe_unit // 1024}K"
+        if self.stripe_count:
+            args += f" --stripe-count {self.stripe_count}"
+        return args
+
+
+_cluster_ids = {}
+
+
+def cluster_id(conf):
+    """
+    集群标识：取 ceph 配置文件中的 fsid，读不到时依次退回 mon_host 与文件名，
+    每个任务上传的配置文件路径不同，按 fsid 才能把历次任务的数据归到同一集群
+    """
+    cached = _cluster_ids.get(conf)
+    if cached is not None:
+        return cached
+    options = {}
+    try:
+        with open(conf) as f:
+            for line in f:
+                key, sep, value = line.split('#', 1)[0].split(';', 1)[0].partition('=')
+                if sep:
+                    options.setdefault('_'.join(key.strip().replace('-', ' ').split()), value.strip())
+    except OSError:
+        pass
+    identity = options.get('fsid') or options.get('mon_host') or os.path.basename(conf or '')
+    _cluster_ids[conf] = identity
+    return identity
+
+
+def connection_key(conf):
+    """
+    集群连接与元数据缓存的键：配置文件能识别出集群时用集群标识，使历次任务上传的配置文件共用同一连接；
+    识别不出时退回配置文件路径，避免不同集群因文件名相同而混用
+    """
+    identity = cluster_id(conf)
+    return conf if identity == os.path.basename(conf or '') else identity
+
+
+def merge_extents(extents):
+    """排序并合并相邻/重叠的区间"""
+    merged = []
+    for offset, length in sorted(extents):
+        if merged and offset <= merged[-1][0] + merged[-1][1]:
+            last_offset, last_length = merged[-1]
+            merged[-1] = (last_offset, max(last_length, offset + length - last_offset))
+        else:
+            merged.append((offset, length))
+    return merged
+
+
+def split_extents(extents, parts, align):
+    """
+    将区间按数据量均分为最多 parts 组，切分点对齐到 align（对象大小），
+    保证不同组不会写入同一个 RADOS 对象
+    """
+    total = sum(length for _, length in extents)
+    if parts <= 1 or total == 0:
+        return [list(extents)] if total else []
+    target = -(-total // parts)
+    target = -(-target // align) * align
+    groups, current, filled = [], [], 0
+    for offset, length in extents:
+        while length:
+            n = min(length, target - filled)
+            if n < length:
+                # 切分点向上取整到对象边界
+                n = min(length, -(-(offset + n) // align) * align - offset)
+            current.append((offset, n))
+            offset += n
+            length -= n
+            filled += n
+            if filled >= target:
+                groups.append(current)
+                current, filled = [], 0
+    if current:
+        groups.append(current)
+    return groups
+
+
+class RbdBackend:
+    """
+    RBD 操作后端接口，CephUtils 只通过该接口访问 Ceph。
+    所有大小、偏移量单位均为字节。
+    """
+    name = None
+    # 是否支持按区间断点续传（Checkpoint）
+    supports_checkpoint = False
+    # 是否支持按块读出/写入数据流（read_chunks / apply_frames），帧格式传输依赖该能力
+    supports_streaming = False
+    # 是否支持按块随机读取计算摘要（chunk_digests）并按块修复（copy_chunks），数据校验依赖该能力
+    supports_chunk_verify = False
+
+    def remove_image(self, spec):
+        """删除镜像，镜像不存在时返回 False"""
+        raise NotImplementedError
+
+    def create_image(self, spec, size, object_size=None, stripe_unit=None, stripe_count=None):
+        """stripe_unit / stripe_count 非默认值时新镜像启用条带（STRIPINGV2）"""
+        raise NotImplementedError
+
+    def image_size(self, spec):
+        raise NotImplementedError
+
+    def resize_image(self, spec, size):
+        raise NotImplementedError
+
+    def create_snapshot(self, spec, snap):
+        raise NotImplementedError
+
+    def remove_snapshot(self, spec, snap):
+        raise NotImplementedError
+
+    def rollback_snapshot(self, spec, snap):
+        raise NotImplementedError
+
+    def list_snapshots(self, spec):
+        """
+        :return: [(快照名称, 创建时间 datetime 或 None), ...]
+        """
+        raise NotImplementedError
+
+    def list_extents(self, spec, from_snap=None):
+        """
+        :return: spec 中已分配（或相对 from_snap 有变化）的区间 [(offset, length), ...]
+        """
+        raise NotImplementedError
+
+    def image_usage(self, spec):
+        """
+        :return: (分配大小, 实际占用字节数)，spec 带快照时为该快照的占用
+        """
+        return self.image_size(spec), sum(length for _, length in self.list_extents(spec))
+
+    def copy_image(self, src, dst, queue_depth=None, workers=None, checkpoint=None, progress=None, layout=None):
+        """
+        完整复制 src（镜像或快照）到新建的 dst 镜像，dst 必须不存在
+        :param layout: ImageLayout，dst 的对象大小与条带，未指定的对象大小沿用 src
+        :param workers: 单个镜像内按区间并行复制的线程数
+        :param checkpoint: copy_journal.Checkpoint，续传时 dst 已存在，跳过已提交的区间
+        :param progress: progress.VolumeProgress，上报待复制总量与已复制字节
+        :return: 写入的字节数，无法统计时返回 None
+        """
+        raise NotImplementedError
+
+    def copy_diff(self, src, dst, from_snap=None, queue_depth=None, workers=None, checkpoint=None, progress=None):
+        """
+        将 src 相对 from_snap 的差异写入已存在的 dst 镜像（等价于 export-diff | import-diff），
+        src 为快照时在 dst 上创建同名快照
+        """
+        raise NotImplementedError
+
+    def chunk_digests(self, spec, chunks, new_hash, workers=None, transfer=None):
+        """
+        按块计算摘要，超出镜像末尾的部分按零补齐
+        :param chunks: [(offset, length), ...]，按偏移升序且互不重叠
+        :param new_hash: 返回新哈希对象的函数
+        :param transfer: throttle.Transfer，不为空时读取前按源端取限速令牌
+        :return: {offset: 十六进制摘要}
+        """
+        raise NotImplementedError
+
+    def copy_chunks(self, src, dst, chunks, queue_depth=None):
+        """将 src 的指定块重新写入已存在的 dst，用于校验不一致后的修复"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _digest(new_hash, data, length):
+    digest = new_hash()
+    digest.update(data)
+    if len(data) < length:
+        digest.update(bytes(length - len(data)))
+    return digest.hexdigest()
+
+
+class CliRbdBackend(RbdBackend):
+    """通过 rbd 命令行执行，数据经 export | import 管道传输"""
+    name = 'cli'
+
+    def _run(self, command, progress=None):
+        """:param progress: progress.VolumeProgress，迁移被中止时结束整个管道"""
+        # 使用 bash 的 pipefail，管道前半段 export 失败时也能感知；独立进程组，中止时连同 rbd 子进程一起结束
+        process = subprocess.Popen(f"set -o pipefail; {command}", shell=True, executable='/bin/bash',
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, start_new_session=True)
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=None if progress is None else ABORT_POLL_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                if progress.aborted:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.communicate()
+                    raise RbdBackendError(f"{command}: 迁移已中止")
+        if process.returncode != 0:
+            raise RbdBackendError(f"{command}: {(stderr or '').strip()}")
+        return stdout
+
+    def remove_image(self, spec):
+        try:
+            self._run(f"rbd --conf {spec.conf} rm {spec.path}")
+            return True
+        except RbdBackendError as e:
+            if 'No such file or directory' in str(e):
+                return False
+            raise
+
+    def create_image(self, spec, size, object_size=None, stripe_unit=None, stripe_count=None):
+        # rbd --size 默认单位为 MB
+        layout = ImageLayout(object_size, stripe_unit, stripe_count)
+        self._run(f"rbd --conf {spec.conf} create --size {-(-size // MiB)}{layout.cli_args()} {spec.path}")
+
+    def image_size(self, spec):
+        output = self._run(f"rbd --conf {spec.conf} info --format json {spec.path}")
+        return int(json.loads(output)['size'])
+
+    def resize_image(self, spec, size):
+        self._run(f"rbd --conf {spec.conf} resize --allow-shrink --size {-(-size // MiB)} {spec.at(None).path}")
+
+    def create_snapshot(self, spec, snap):
+        self._run(f"rbd --conf {spec.conf} snap create {spec.at(snap).path}")
+
+    def remove_snapshot(self, spec, snap):
+        self._run(f"rbd --conf {spec.conf} snap rm {spec.at(snap).path}")
+
+    def rollback_snapshot(self, spec, snap):
+        self._run(f"rbd --conf {spec.conf} snap rollback {spec.at(snap).path}")
+
+    def list_snapshots(self, spec):
+        output = self._run(f"rbd --conf {spec.conf} snap ls --format json {spec.path}")
+        snapshots = []
+        for snap in json.loads(output or '[]'):
+            timestamp = None
+            if snap.get('timestamp'):
+                try:
+                    timestamp = datetime.strptime(' '.join(snap['timestamp'].split()), "%a %b %d %H:%M:%S %Y")
+                except ValueError:
+                    logging.warning(f"[MIGRATION] 无法解析快照 {snap['name']} 的创建时间: {snap['timestamp']}")
+            snapshots.append((snap['name'], timestamp))
+        return snapshots
+
+    def image_usage(self, spec):
+        # 开启 fast-diff 的镜像 rbd du 直接读对象位图，不逐个检查对象
+        output = self._run(f"rbd --conf {spec.conf} du --format json {spec.path}")
+        for image in json.loads(output or '{}').get('images', []):
+            if image.get('snapshot') == spec.snap:
+                return int(image['provisioned_size']), int(image['used_size'])
+        raise RbdBackendError(f"rbd du 没有返回 {spec.path} 的占用信息")
+
+    def list_extents(self, spec, from_snap=None):
+        from_arg = f" --from-snap {from_snap}" if from_snap else ""
+        output = self._run(f"rbd --conf {spec.conf} diff --format json{from_arg} {spec.path}")
+        return merge_extents((int(e['offset']), int(e['length'])) for e in json.loads(output or '[]')
+                             if e.get('exists') in (True, 'true'))
+
+    def copy_image(self, src, dst, queue_depth=None, workers=None, checkpoint=None, progress=None, layout=None):
+        # 管道只能整卷串行传输，workers 对命令行后端无效；限速通过 librbd QoS 参数实现
+        layout_args = layout.cli_args() if layout is not None else ""
+        with get_throttle().transfer(cluster_id(src.conf), cluster_id(dst.conf), dst.at(None).path) as transfer:
+            self._run(f"rbd --conf {src.conf}{transfer.qos_args('source')} export {src.path} - | "
+                      f"rbd --conf {dst.conf}{transfer.qos_args('target')} import{layout_args} - {dst.path}", progress)
+
+    def copy_diff(self, src, dst, from_snap=None, queue_depth=None, workers=None, checkpoint=None, progress=None):
+        from_arg = f" --from-snap {from_snap}" if from_snap else ""
+        with get_throttle().transfer(cluster_id(src.conf), cluster_id(dst.conf), dst.at(None).path) as transfer:
+            self._run(f"rbd --conf {src.conf}{transfer.qos_args('source')} export-diff {src.path}{from_arg} - | "
+                      f"rbd --conf {dst.conf}{transfer.qos_args('target')} import-diff - {dst.path}", progress)
+
+    def chunk_digests(self, spec, chunks, new_hash, workers=None, transfer=None):
+        # 命令行只能顺序读取 rbd export 的输出，跳过不需要的区域，读完最后一块即结束进程
+        digests = {}
+        if not chunks:
+            return digests
+        process = subprocess.Popen(["rbd", "--conf", spec.conf, "export", "--no-progress", spec.path, "-"],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        position = 0
+
+        def read(length):
+            nonlocal position
+            parts = []
+            while length:
+                data = process.stdout.read(min(length, MiB))
+                if not data:
+                    break
+                parts.append(data)
+                position += len(data)
+                length -= len(data)
+            return b"".join(parts)
+
+        try:
+            for offset, length in chunks:
+                while position < offset:
+                    if not read(min(offset - position, MiB)):
+                        break
+                if transfer is not None:
+                    transfer.read(length)
+                digests[offset] = _digest(new_hash, read(length) if position == offset else b"", length)
+        finally:
+            finished = process.poll() is not None
+            if not finished:
+                process.kill()
+            process.stdout.close()
+            stderr = process.stderr.read().decode(errors='replace').strip()
+            process.stderr.close()
+            returncode = process.wait()
+        if finished and returncode != 0:
+            raise RbdBackendError(f"rbd export {spec.path}: {stderr}")
+        return digests
+
+    def copy_chunks(self, src, dst, chunks, queue_depth=None):
+        raise RbdBackendError("命令行后端不支持按块修复，请使用 librbd 后端或重新迁移")
+
+
+class NativeRbdBackend(RbdBackend):
+    """
+    基于 rados/rbd Python 绑定的进程内复制引擎。
+    每个集群（见 connection_key）只建立一个连接，每个（集群, 存储池）只打开一个 IoCtx，所有线程与任务共享，
+    连接使用第一次访问该集群时的配置文件；
+    数据以对象大小对齐的大块 AIO 读写，读写并发深度由 queue_depth 控制，不经过任何管道。
+    """
+    supports_checkpoint = True
+    supports_streaming = True
+    supports_chunk_verify = True
+
+    def __init__(self, rados_module, rbd_module, buffer_size=None, queue_depth=None):
+        self._rados = rados_module
+        self._rbd = rbd_module
+        self.buffer_size = buffer_size or config.RBD_COPY_BUFFER_SIZE
+        self.queue_depth = queue_depth or config.RBD_COPY_QUEUE_DEPTH
+        self._clusters = {}
+        self._ioctxs = {}
+        self._lock = threading.Lock()
+
+    def _cluster(self, conf):
+        key = connection_key(conf)
+        with self._lock:
+            cluster = self._clusters.get(key)
+            if cluster is None:
+                cluster = self._rados.Rados(conffile=conf)
+                cluster.connect()
+                self._clusters[key] = cluster
+                logging.info(f"[MIGRATION] 已建立到集群 {conf} 的连接")
+            return cluster
+
+    @contextmanager
+    def _ioctx(self, spec):
+        """共享的 IoCtx，librados 的 IoCtx 可多线程同时使用，用完不关闭"""
+        key = (connection_key(spec.conf), spec.pool)
+        with self._lock:
+            ioctx = self._ioctxs.get(key)
+        if ioctx is None:
+            cluster = self._cluster(spec.conf)
+            with self._lock:
+                ioctx = self._ioctxs.get(key)
+                if ioctx is None:
+                    ioctx = self._ioctxs[key] = cluster.open_ioctx(spec.pool)
+        yield ioctx
+
+    @contextmanager
+    def _image(self, spec, read_only=False):
+        with self._ioctx(spec) as ioctx:
+            try:
+                image = self._rbd.Image(ioctx, spec.image, snapshot=spec.snap, read_only=read_only)
+            except self._rbd.ImageNotFound as e:
+                raise RbdBackendError(f"镜像 {spec.path} 不存在") from e
+            try:
+                yield image
+            finally:
+                image.close()
+
+    def close(self):
+        with self._lock:
+            for ioctx in self._ioctxs.values():
+                ioctx.close()
+            self._ioctxs.clear()
+            for cluster in self._clusters.values():
+                cluster.shutdown()
+            self._clusters.clear()
+
+    def remove_image(self, spec):
+        with self._ioctx(spec) as ioctx:
+            try:
+                self._rbd.RBD().remove(ioctx, spec.image)
+                return True
+            except self._rbd.ImageNotFound:
+                return False
+
+    def create_image(self, spec, size, object_size=None, stripe_unit=None, stripe_count=None):
+        order = object_size.bit_length() - 1 if object_size else None
+        with self._ioctx(spec) as ioctx:
+            self._rbd.RBD().create(ioctx, spec.image, size, order=order, old_format=False,
+                                   stripe_unit=stripe_unit or 0, stripe_count=stripe_count or 0)
+
+    def image_size(self, spec):
+        with self._image(spec, read_only=True) as image:
+            return image.size()
+
+    def resize_image(self, spec, size):
+        with self._image(spec.at(None)) as image:
+            image.resize(size)
+
+    def create_snapshot(self, spec, snap):
+        with self._image(spec.at(None)) as image:
+            image.create_snap(snap)
+
+    def remove_snapshot(self, spec, snap):
+        with self._image(spec.at(None)) as image:
+            image.remove_snap(snap)
+
+    def rollback_snapshot(self, spec, snap):
+        with self._image(spec.at(None)) as image:
+            image.rollback_to_snap(snap)
+
+    def list_snapshots(self, spec):
+        with self._image(spec.at(None), read_only=True) as image:
+            return [(snap['name'], image.get_snap_timestamp(snap['id'])) for snap in image.list_snaps()]
+
+    def _buffer_size(self, object_size):
+        # 缓冲区取对象大小的整数倍，保证每次 IO 不跨越多余的对象边界
+        return max(object_size, self.buffer_size // object_size * object_size)
+
+    def _write_zeroes(self, image, offset, length):
+        """
+        把已有镜像的区间置零。discard 在区间不覆盖整个对象时可能不清零（rbd_skip_partial_discard），
+        只能用于新建的镜像；librbd 不支持 write_zeroes 时逐块写入零缓冲区
+        """
+        if hasattr(image, 'write_zeroes'):
+            image.write_zeroes(offset, length)
+            return
+        zeros = bytes(min(length, self.buffer_size))
+        end = offset + length
+        while offset < end:
+            n = min(len(zeros), end - offset)
+            image.write(zeros[:n], offset)
+            offset += n
+
+    @staticmethod
+    def _split(extents, buffer_size):
+        """将区间切分为按 buffer_size 边界对齐的块"""
+        for offset, length in extents:
+            end = offset + length
+            while offset < end:
+                chunk_end = min(end, (offset // buffer_size + 1) * buffer_size)
+                yield offset, chunk_end - offset
+                offset = chunk_end
+
+    def _pump(self, src_image, dst_image, chunks, queue_depth, skip_zeros, checkpoint=None, progress=None,
+              transfer=None):
+        """
+        AIO 流水线：最多 queue_depth 个读和 queue_depth 个写同时在途，
+        每块写入完成后提交到 checkpoint；transfer 不为空时每次读写前先取限速令牌
+        :return: 实际写入的字节数
+        """
+        ready = queue.Queue()
+        writes = threading.BoundedSemaphore(queue_depth)
+        errors = []
+        written = 0
+        inflight = 0
+
+        def on_read(offset, length, completion, data):
+            ready.put((offset, completion.get_return_value(), data, length))
+
+        def on_write(offset, length, completion):
+            ret = completion.get_return_value()
+            BYTES_IN_FLIGHT.dec(length)
+            if ret < 0:
+                errors.append(f"写入偏移 {offset} 失败: {ret}")
+            else:
+                COPIED_BYTES.inc(length, backend=self.name)
+                if checkpoint is not None:
+                    checkpoint.commit(offset, length)
+                if progress is not None:
+                    progress.add(length)
+            writes.release()
+
+        def write_ready():
+            nonlocal inflight, written
+            offset, ret, data, length = ready.get()
+            inflight -= 1
+            if ret < 0:
+                BYTES_IN_FLIGHT.dec(length)
+                errors.append(f"读取偏移 {offset} 失败: {ret}")
+                return
+            # 读出的数据可能短于请求长度，在途字节按实际数据修正
+            BYTES_IN_FLIGHT.dec(length - len(data))
+            # 全零块判断：count 在 C 层扫描，any() 会逐字节迭代
+            if skip_zeros and data.count(0) == len(data):
+                BYTES_IN_FLIGHT.dec(len(data))
+                if checkpoint is not None:
+                    checkpoint.commit(offset, len(data))
+                if progress is not None:
+                    progress.add(len(data))
+                return
+            if transfer is not None:
+                transfer.write(len(data))
+            writes.acquire()
+            dst_image.aio_write(data, offset, partial(on_write, offset, len(data)))
+            written += len(data)
+
+        for offset, length in chunks:
+            if errors:
+                break
+            if progress is not None and progress.aborted:
+                errors.append("迁移已中止")
+                break
+            if checkpoint is not None and checkpoint.is_committed(offset, length):
+                if progress is not None:
+                    progress.add(length)
+                continue
+            while inflight >= queue_depth:
+                write_ready()
+            if transfer is not None:
+                transfer.read(length)
+            BYTES_IN_FLIGHT.inc(length)
+            src_image.aio_read(offset, length, partial(on_read, offset, length))
+            inflight += 1
+        while inflight:
+            write_ready()
+        # 等待所有写完成
+        for _ in range(queue_depth):
+            writes.acquire()
+        if errors:
+            raise RbdBackendError("; ".join(errors[:5]))
+        return written
+
+    def list_extents(self, spec, from_snap=None):
+        with self._image(spec, read_only=True) as image:
+            return self._diff_extents(image, from_snap)[0]
+
+    def image_layout(self, spec):
+        """:return: (镜像大小, 对象大小)"""
+        with self._image(spec, read_only=True) as image:
+            return image.size(), image.stat()['obj_size']
+
+    def list_changes(self, spec, from_snap=None):
+        """:return: (有数据的区间, 相对 from_snap 已被删除的区间)"""
+        with self._image(spec, read_only=True) as image:
+            return self._diff_extents(image, from_snap)
+
+    def read_chunks(self, spec, chunks, queue_depth=None):
+        """
+        按顺序读出各块，最多 queue_depth 个 AIO 读预先在途
+        :return: 生成 (offset, data)，超出镜像末尾的部分被截掉
+        """
+        queue_depth = queue_depth or self.queue_depth
+        with self._image(spec, read_only=True) as image:
+            size = image.size()
+            pending = collections.deque()
+
+            def on_read(slot, completion, data):
+                slot.append((completion.get_return_value(), data))
+                slot[0].set()
+
+            for offset, length in chunks:
+                if offset >= size:
+                    continue
+                slot = [threading.Event()]
+                image.aio_read(offset, min(length, size - offset), partial(on_read, slot))
+                pending.append((offset, slot))
+                while len(pending) >= queue_depth or (pending and pending[0][1][0].is_set()):
+                    yield self._take_read(pending)
+            while pending:
+                yield self._take_read(pending)
+
+    @staticmethod
+    def _take_read(pending):
+        offset, slot = pending.popleft()
+        slot[0].wait()
+        ret, data = slot[1]
+        if ret < 0:
+            raise RbdBackendError(f"读取偏移 {offset} 失败: {ret}")
+        return offset, data
+
+    def apply_frames(self, spec, frames, queue_depth=None, progress=None, fresh=False):
+        """
+        把帧流写入已存在的镜像：数据帧 AIO 写入，零帧置零
+        :param frames: 生成 ('data', offset, bytes) / ('zero', offset, length)
+        :param fresh: 镜像是否刚新建，新建镜像的零帧用 discard 即可，否则必须确实写零
+        :return: 写入的数据字节数
+        """
+        queue_depth = queue_depth or self.queue_depth
+        writes = threading.BoundedSemaphore(queue_depth)
+        errors = []
+        written = 0
+
+        def on_write(offset, length, completion):
+            if completion.get_return_value() < 0:
+                errors.append(f"写入偏移 {offset} 失败: {completion.get_return_value()}")
+            else:
+                COPIED_BYTES.inc(length, backend=self.name)
+                if progress is not None:
+                    progress.add(length)
+            writes.release()
+
+        with self._image(spec.at(None)) as image:
+            try:
+                for kind, offset, payload in frames:
+                    if errors:
+                        break
+                    if kind == 'zero':
+                        if fresh:
+                            image.discard(offset, payload)
+                        else:
+                            self._write_zeroes(image, offset, payload)
+                        if progress is not None:
+                            progress.add(payload)
+                        continue
+                    writes.acquire()
+                    image.aio_write(payload, offset, partial(on_write, offset, len(payload)))
+                    written += len(payload)
+            finally:
+                for _ in range(queue_depth):
+                    writes.acquire()
+        if errors:
+            raise RbdBackendError("; ".join(errors[:5]))
+        return written
+
+    def chunk_digests(self, spec, chunks, new_hash, workers=None, transfer=None):
+        chunks = list(chunks)
+        if not chunks:
+            return {}
+        group_size = -(-len(chunks) // max(1, workers or 1))
+        groups = [chunks[i:i + group_size] for i in range(0, len(chunks), group_size)]
+
+        def digest_group(group):
+            digests = {}
+            with ACTIVE_WORKERS.track_inprogress(kind='verify'), self._image(spec, read_only=True) as image:
+                size = image.size()
+                for offset, length in group:
+                    if transfer is not None:
+                        transfer.read(length)
+                    data = image.read(offset, min(length, size - offset)) if offset < size else b""
+                    digests[offset] = _digest(new_hash, data, length)
+            return digests
+
+        digests = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            for group_digests in executor.map(digest_group, groups):
+                digests.update(group_digests)
+        return digests
+
+    def copy_chunks(self, src, dst, chunks, queue_depth=None):
+        with self._image(src, read_only=True) as src_image, self._image(dst.at(None)) as dst_image:
+            size = src_image.size()
+            buffer_size = self._buffer_size(src_image.stat()['obj_size'])
+            # 源镜像末尾之后的部分在目标端应为零
+            for offset, length in chunks:
+                if offset + length > size:
+                    start = max(offset, size)
+                    self._write_zeroes(dst_image, start, offset + length - start)
+            chunks = [(offset, min(length, size - offset)) for offset, length in chunks if offset < size]
+            return self._pump(src_image, dst_image, self._split(chunks, buffer_size), queue_depth or self.queue_depth,
+                              skip_zeros=False)
+
+    @staticmethod
+    def _diff_extents(image, from_snap):
+        """:return: (有数据的区间, 已被删除需要 discard 的区间)"""
+        extents, discards = [], []
+
+        def collect(offset, length, exists):
+            (extents if exists else discards).append((offset, length))
+            return 0
+
+        image.diff_iterate(0, image.size(), from_snap, collect)
+        return merge_extents(extents), merge_extents(discards)
+
+    def _copy_extents(self, src, dst, extents, object_size, queue_depth, workers, skip_zeros, checkpoint=None,
+                      progress=None):
+        """
+        按对象边界将区间平均分给 workers 个线程，每个线程使用独立的镜像句柄并行写入同一目标镜像
+        """
+        queue_depth = queue_depth or self.queue_depth
+        buffer_size = self._buffer_size(object_size)
+        groups = split_extents(extents, workers or 1, object_size)
+        if progress is not None:
+            progress.set_total(sum(length for _, length in extents))
+
+        def copy_group(group, transfer):
+            with ACTIVE_WORKERS.track_inprogress(kind='copy'), \
+                    self._image(src, read_only=True) as src_image, self._image(dst.at(None)) as dst_image:
+                return self._pump(src_image, dst_image, self._split(group, buffer_size), queue_depth, skip_zeros,
+                                  checkpoint, progress, transfer)
+
+        try:
+            # 同一个卷的所有线程共享一个限速传输
+            with get_throttle().transfer(cluster_id(src.conf), cluster_id(dst.conf), dst.at(None).path) as transfer:
+                if len(groups) <= 1:
+                    return sum(copy_group(group, transfer) for group in groups)
+                with concurrent.futures.ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                    return sum(executor.map(lambda group: copy_group(group, transfer), groups))
+        finally:
+            if checkpoint is not None:
+                checkpoint.flush()
+
+    def copy_image(self, src, dst, queue_depth=None, workers=None, checkpoint=None, progress=None, layout=None):
+        with self._image(src, read_only=True) as src_image:
+            size = src_image.size()
+            object_size = src_image.stat()['obj_size']
+            # 只复制已分配的区间，未分配区域既不读也不写
+            extents, _ = self._diff_extents(src_image, None)
+        if checkpoint is None or not checkpoint.resumed:
+            layout = layout or ImageLayout()
+            self.create_image(dst, size, layout.object_size or object_size, layout.stripe_unit, layout.stripe_count)
+        # 新建镜像本身全为零，零块无需写入，保持目标精简
+        return self._copy_extents(src, dst, extents, object_size, queue_depth, workers, skip_zeros=True,
+                                  checkpoint=checkpoint, progress=progress)
+
+    def copy_diff(self, src, dst, from_snap=None, queue_depth=None, workers=None, checkpoint=None, progress=None):
+        with self._image(src, read_only=True) as src_image, self._image(dst.at(None)) as dst_image:
+            size = src_image.size()
+            object_size = src_image.stat()['obj_size']
+            if dst_image.size() != size:
+                dst_image.resize(size)
+            extents, discards = self._diff_extents(src_image, from_snap)
+            for offset, length in discards:
+                self._write_zeroes(dst_image, offset, length)
+        written = self._copy_extents(src, dst, extents, object_size, queue_depth, workers, skip_zeros=False,
+                                     checkpoint=checkpoint, progress=progress)
+        # 续传时目标快照可能已在上次中断前创建
+        if src.snap and src.snap not in [name for name, _ in self.list_snapshots(dst)]:
+            self.create_snapshot(dst, src.snap)
+        return written
+
+
+class LibrbdBackend(NativeRbdBackend):
+    """使用系统安装的 python3-rados / python3-rbd"""
+    name = 'librbd'
+
+    def __init__(self, **kwargs):
+        try:
+            import rados
+            import rbd
+        except ImportError as e:
+            raise RbdBackendError("librbd 后端需要安装 python3-rados 与 python3-rbd") from e
+        super().__init__(rados, rbd, **kwargs)
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_rbd_backend(name=None):
+    """
+    按名称获取共享的后端实例（cli / librbd / fake），同名后端在进程内复用集群连接
+    """
+    name = name or config.RBD_BACKEND
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            if name == 'cli':
+                backend = CliRbdBackend()
+            elif name == 'librbd':
+                backend = LibrbdBackend()
+            elif name == 'fake':
+                from fake_rbd import FakeRbdBackend
+                backend = FakeRbdBackend()
+            else:
+                raise RbdBackendError(f"不支持的 RBD 后端: {name}")
+            # 统一记录各 RBD 操作的耗时，元数据查询先经过缓存，命中时不计入操作耗时
+            backend = _backends[name] = CachedBackend(InstrumentedBackend(backend), cluster_key=connection_key)
+        return backend
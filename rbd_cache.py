@@ -0,0 +1,104 @@
+"""
+RBD 元数据缓存：包装 RbdBackend，缓存镜像大小、快照列表、布局与快照的占用量，
+同一批次内对同一镜像的重复查询（预演、建目标镜像、找最新快照、续传检查等）不再访问集群或启动 rbd 进程。
+本进程对镜像的写操作（建删镜像、快照增删与回滚、调整大小、写入数据）会使该镜像的缓存失效；
+其他客户端的修改（例如 Cinder 备份新建快照）最迟在 config.RBD_METADATA_CACHE_TTL 秒后可见。
+镜像本身（非快照）的占用量与区间随虚拟机写入变化，不缓存。
+"""
+import threading
+import time
+import config
+from metrics import RBD_CACHE_LOOKUPS
+
+# 缓存的只读操作
+CACHED_OPS = ('image_size', 'list_snapshots', 'image_layout', 'image_usage')
+# 写操作及其修改的镜像参数位置（位置参数下标, 关键字参数名）
+MUTATING_OPS = {
+    'remove_image': (0, 'spec'),
+    'create_image': (0, 'spec'),
+    'resize_image': (0, 'spec'),
+    'create_snapshot': (0, 'spec'),
+    'remove_snapshot': (0, 'spec'),
+    'rollback_snapshot': (0, 'spec'),
+    'copy_image': (1, 'dst'),
+    'copy_diff': (1, 'dst'),
+    'copy_chunks': (1, 'dst'),
+    'apply_frames': (0, 'spec'),
+}
+
+
+def _copy(result):
+    # 快照列表由调用方自由修改，不影响缓存
+    return list(result) if isinstance(result, list) else result
+
+
+class CachedBackend:
+    """
+    :param backend: 被包装的 RbdBackend（或 InstrumentedBackend）
+    :param ttl: 缓存有效期（秒），默认 config.RBD_METADATA_CACHE_TTL，为 0 时不缓存
+    :param cluster_key: cluster_key(conf) 返回配置文件所属集群的标识，不同任务上传的同一集群配置命中同一缓存；
+                        默认按配置文件路径
+    """
+
+    def __init__(self, backend, ttl=None, cluster_key=None):
+        self._backend = backend
+        self.ttl = config.RBD_METADATA_CACHE_TTL if ttl is None else ttl
+        self._cluster_key = cluster_key or (lambda conf: conf)
+        self._lock = threading.Lock()
+        # {(集群, pool, image): {(op, snap): (过期时间, 结果)}}
+        self._entries = {}
+        # 每个镜像的失效次数，查询期间镜像被修改时不写入查询结果
+        self._generations = {}
+
+    def _image_key(self, spec):
+        return self._cluster_key(spec.conf), spec.pool, spec.image
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+        if name in CACHED_OPS:
+            return lambda spec: self._cached(name, attr, spec)
+        if name in MUTATING_OPS:
+            index, keyword = MUTATING_OPS[name]
+
+            def mutate(*args, **kwargs):
+                spec = args[index] if len(args) > index else kwargs[keyword]
+                try:
+                    return attr(*args, **kwargs)
+                finally:
+                    self.invalidate(spec)
+
+            return mutate
+        return attr
+
+    def _cached(self, name, fn, spec):
+        # 镜像本身的占用量随写入变化，只缓存快照的
+        if not self.ttl or (name == 'image_usage' and spec.snap is None):
+            return fn(spec)
+        key, entry = self._image_key(spec), (name, spec.snap)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key, {}).get(entry)
+            generation = self._generations.get(key, 0)
+        if cached is not None and cached[0] > now:
+            RBD_CACHE_LOOKUPS.inc(op=name, result='hit')
+            return _copy(cached[1])
+        RBD_CACHE_LOOKUPS.inc(op=name, result='miss')
+        result = fn(spec)
+        with self._lock:
+            if self._generations.get(key, 0) == generation:
+                self._entries.setdefault(key, {})[entry] = (now + self.ttl, result)
+        return _copy(result)
+
+    def invalidate(self, spec=None):
+        """使镜像的全部缓存失效，spec 为空时清空"""
+        with self._lock:
+            keys = list(self._entries) if spec is None else [self._image_key(spec)]
+            for key in keys:
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def close(self):
+        self.invalidate()
+        self._backend.close()
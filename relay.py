@@ -0,0 +1,397 @@
+"""
+跨数据中心中继：目标数据中心运行 relay.py 服务，迁移进程在源端读取 RBD 数据，
+按 stream_format 帧格式（零区段省略、数据压缩）发送给中继，由中继写入目标集群。
+目标端的元数据操作（建卷、删卷、快照、校验摘要）也经中继执行，迁移进程不需要直连目标集群。
+
+协议：每个请求一个 TCP 连接，先发送一行 JSON 请求，write 请求之后紧跟帧流，最后服务端回一行 JSON 结果。
+
+中继可以删除、回滚、调整目标集群任意存储池中的镜像：默认只监听 127.0.0.1；监听其他地址时必须设置口令并启用 TLS，
+否则口令与数据明文经过网络。迁移进程一端设置 config.RELAY_TLS_CA 后以 TLS 连接并校验中继的证书。
+
+启动中继：
+    python relay.py --conf /etc/ceph/ceph.conf --listen 0.0.0.0:7700 --token <口令> \
+        --tls-cert /etc/relay/tls.crt --tls-key /etc/relay/tls.key
+"""
+import argparse
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import socket
+import socketserver
+import ssl
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import config
+from metrics import InstrumentedBackend, WIRE_BYTES
+from rbd_backend import RbdBackend, RbdBackendError, ImageSpec, ImageLayout, get_rbd_backend, cluster_id
+from stream_format import FrameReader, FrameWriter, resolve_codec, CODEC_NONE
+from throttle import get_throttle
+import verify
+
+# 可经中继调用的目标端操作
+REMOTE_METHODS = ('remove_image', 'create_image', 'image_size', 'resize_image', 'create_snapshot', 'remove_snapshot',
+                  'rollback_snapshot', 'list_snapshots', 'list_extents', 'image_layout', 'list_changes')
+
+
+def _encode(value):
+    if isinstance(value, ImageSpec):
+        return {'__spec__': list(value)}
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if '__spec__' in value:
+            return ImageSpec(*value['__spec__'])
+        if '__datetime__' in value:
+            return datetime.fromisoformat(value['__datetime__'])
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def _send_json(wfile, payload):
+    wfile.write(json.dumps(payload).encode() + b"\n")
+    wfile.flush()
+
+
+def _recv_json(rfile):
+    line = rfile.readline()
+    if not line:
+        raise RbdBackendError("中继连接已断开")
+    return json.loads(line)
+
+
+class RelayHandler:
+    """在目标端执行中继请求"""
+
+    def __init__(self, backend, conf=None, token=None):
+        """
+        :param backend: 目标集群的 librbd 后端
+        :param conf: 目标集群配置文件，替换请求中的配置路径；为空时使用请求中的路径（进程内模式）
+        """
+        self.backend = backend
+        self.conf = conf
+        self.token = token
+
+    def _spec(self, spec):
+        return spec._replace(conf=self.conf) if self.conf else spec
+
+    def _localize(self, value):
+        if isinstance(value, ImageSpec):
+            return self._spec(value)
+        if isinstance(value, list):
+            return [self._localize(item) for item in value]
+        return value
+
+    def handle(self, rfile, wfile):
+        try:
+            request = _decode(_recv_json(rfile))
+            if self.token and not hmac.compare_digest(str(request.get('token') or ''), self.token):
+                raise RbdBackendError("中继口令校验失败")
+            method = request['method']
+            args = self._localize(request.get('args', []))
+            if method == 'write':
+                result = self._write(rfile, *args)
+            elif method == 'chunk_digests':
+                spec, chunks, workers, algorithm = args
+                digests = self.backend.chunk_digests(spec, [tuple(chunk) for chunk in chunks],
+                                                     verify.hash_factory(algorithm), workers)
+                result = {str(offset): digest for offset, digest in digests.items()}
+            elif method in REMOTE_METHODS:
+                result = getattr(self.backend, method)(*args)
+            else:
+                raise RbdBackendError(f"中继不支持的操作: {method}")
+            _send_json(wfile, {'result': _encode(result)})
+        except Exception as e:
+            logging.error(f"[MIGRATION] 中继请求处理失败: {e}")
+            try:
+                _send_json(wfile, {'error': str(e)})
+            except OSError:
+                pass
+
+    def _write(self, rfile, spec, create=None, resize=None, snap=None):
+        """
+        :param create: [size, object_size, stripe_unit, stripe_count]，写入前新建镜像
+        :param resize: 写入前把镜像调整为该大小
+        :param snap: 写入完成后在镜像上创建的快照
+        """
+        if create:
+            self.backend.create_image(spec, *create)
+        elif resize is not None and self.backend.image_size(spec) != resize:
+            self.backend.resize_image(spec, resize)
+        reader = FrameReader(rfile)
+        written = self.backend.apply_frames(spec, iter(reader), fresh=bool(create))
+        if snap and snap not in [name for name, _ in self.backend.list_snapshots(spec)]:
+            self.backend.create_snapshot(spec, snap)
+        logging.info(f"[MIGRATION] 中继写入 {spec.path} 完成，{reader.frames} 帧，数据 {written / 1024 ** 2:.1f} MB")
+        return written
+
+
+class RelayBackend(RbdBackend):
+    """
+    源端数据由本地 librbd 后端读取，配置文件为 remote_conf 的镜像（目标端）经中继访问
+    """
+    name = 'relay'
+    supports_chunk_verify = True
+
+    def __init__(self, local, remote_conf, address=None, codec=CODEC_NONE, level=None, chunk_size=None, token=None):
+        """
+        :param local: 支持 read_chunks 的本地后端（librbd / fake）
+        :param address: 中继地址 host:port，为空时为进程内模式，由本进程的 RelayHandler 写入目标集群
+        """
+        self.local = local
+        self.remote_conf = remote_conf
+        self.address = address
+        self.codec = codec
+        self.level = level
+        self.chunk_size = chunk_size or config.WIRE_CHUNK_SIZE
+        self.token = token
+        self._handler = None if address else RelayHandler(local)
+
+    def _remote(self, spec):
+        return spec.conf == self.remote_conf
+
+    @contextmanager
+    def _connect(self):
+        if self.address:
+            host, port = self.address.rsplit(':', 1)
+            sock = socket.create_connection((host, int(port)))
+            if config.RELAY_TLS_CA:
+                context = ssl.create_default_context(cafile=config.RELAY_TLS_CA)
+                sock = context.wrap_socket(sock, server_hostname=host)
+            server_thread = None
+        else:
+            sock, server_sock = socket.socketpair()
+            server_thread = threading.Thread(target=self._serve_local, args=(server_sock,), daemon=True)
+            server_thread.start()
+        rfile, wfile = sock.makefile('rb'), sock.makefile('wb')
+        try:
+            yield rfile, wfile
+        finally:
+            rfile.close()
+            wfile.close()
+            sock.close()
+            if server_thread is not None:
+                server_thread.join()
+
+    def _serve_local(self, sock):
+        rfile, wfile = sock.makefile('rb'), sock.makefile('wb')
+        try:
+            self._handler.handle(rfile, wfile)
+        finally:
+            rfile.close()
+            wfile.close()
+            sock.close()
+
+    def _request(self, method, *args):
+        return {'method': method, 'args': _encode(list(args)), 'token': self.token}
+
+    @staticmethod
+    def _result(response):
+        if 'error' in response:
+            raise RbdBackendError(f"中继执行失败: {response['error']}")
+        return _decode(response['result'])
+
+    def _call(self, method, *args):
+        with self._connect() as (rfile, wfile):
+            _send_json(wfile, self._request(method, *args))
+            return self._result(_recv_json(rfile))
+
+    def _route(self, method, spec, *args):
+        if self._remote(spec):
+            return self._call(method, spec, *args)
+        return getattr(self.local, method)(spec, *args)
+
+    def remove_image(self, spec):
+        return self._route('remove_image', spec)
+
+    def create_image(self, spec, size, object_size=None, stripe_unit=None, stripe_count=None):
+        return self._route('create_image', spec, size, object_size, stripe_unit, stripe_count)
+
+    def image_size(self, spec):
+        return self._route('image_size', spec)
+
+    def resize_image(self, spec, size):
+        return self._route('resize_image', spec, size)
+
+    def create_snapshot(self, spec, snap):
+        return self._route('create_snapshot', spec, snap)
+
+    def remove_snapshot(self, spec, snap):
+        return self._route('remove_snapshot', spec, snap)
+
+    def rollback_snapshot(self, spec, snap):
+        return self._route('rollback_snapshot', spec, snap)
+
+    def list_snapshots(self, spec):
+        return [tuple(snap) for snap in self._route('list_snapshots', spec)]
+
+    def list_extents(self, spec, from_snap=None):
+        return [tuple(extent) for extent in self._route('list_extents', spec, from_snap)]
+
+    def chunk_digests(self, spec, chunks, new_hash, workers=None, transfer=None):
+        if not self._remote(spec):
+            return self.local.chunk_digests(spec, chunks, new_hash, workers, transfer)
+        digests = self._call('chunk_digests', spec, list(chunks), workers, new_hash.algorithm)
+        return {int(offset): digest for offset, digest in digests.items()}
+
+    def _split(self, extents):
+        for offset, length in extents:
+            end = offset + length
+            while offset < end:
+                chunk_end = min(end, (offset // self.chunk_size + 1) * self.chunk_size)
+                yield offset, chunk_end - offset
+                offset = chunk_end
+
+    def _stream(self, src, dst, extents, zeros=(), progress=None, **write_args):
+        """读出 src 的 extents，连同 zeros 区间以帧流写入 dst"""
+        if progress is not None:
+            progress.set_total(sum(length for _, length in extents) + sum(length for _, length in zeros))
+        with get_throttle().transfer(cluster_id(src.conf), cluster_id(dst.conf), dst.at(None).path) as transfer, \
+                self._connect() as (rfile, wfile):
+            _send_json(wfile, self._request('write', dst, write_args.get('create'), write_args.get('resize'),
+                                            write_args.get('snap')))
+            writer = FrameWriter(wfile, self.codec, self.level)
+            for offset, length in zeros:
+                writer.zero(offset, length)
+                if progress is not None:
+                    progress.add(length)
+            for offset, data in self.local.read_chunks(src, self._split(extents)):
+                if progress is not None and progress.aborted:
+                    # 不发送结束帧，中继端读到断开的连接后放弃这次写入
+                    raise RbdBackendError(f"{src.path} -> {dst.path} 迁移已中止")
+                transfer.read(len(data))
+                wire_before = writer.wire_bytes
+                writer.write(offset, data)
+                transfer.write(writer.wire_bytes - wire_before)
+                if progress is not None:
+                    progress.add(len(data))
+            writer.close()
+            written = self._result(_recv_json(rfile))
+        WIRE_BYTES.inc(writer.raw_bytes, kind='raw')
+        WIRE_BYTES.inc(writer.wire_bytes, kind='wire')
+        WIRE_BYTES.inc(writer.zero_bytes, kind='zero')
+        logging.info(f"[MIGRATION] {src.path} -> {dst.path} 帧格式传输原始 {writer.raw_bytes / 1024 ** 2:.1f} MB，"
+                     f"实际发送 {writer.wire_bytes / 1024 ** 2:.1f} MB，省略零区段 {writer.zero_bytes / 1024 ** 2:.1f} MB")
+        return written
+
+    def copy_image(self, src, dst, queue_depth=None, workers=None, checkpoint=None, progress=None, layout=None):
+        size, object_size = self.local.image_layout(src)
+        extents, _ = self.local.list_changes(src)
+        layout = layout or ImageLayout()
+        return self._stream(src, dst, extents, progress=progress,
+                            create=[size, layout.object_size or object_size, layout.stripe_unit, layout.stripe_count])
+
+    def copy_diff(self, src, dst, from_snap=None, queue_depth=None, workers=None, checkpoint=None, progress=None):
+        size, _ = self.local.image_layout(src)
+        extents, discards = self.local.list_changes(src, from_snap)
+        return self._stream(src, dst, extents, discards, progress=progress, resize=size, snap=src.snap)
+
+    def copy_chunks(self, src, dst, chunks, queue_depth=None):
+        size, _ = self.local.image_layout(src)
+        # 源镜像末尾之后的部分在目标端应为零
+        zeros = [(max(offset, size), offset + length - max(offset, size)) for offset, length in chunks
+                 if offset + length > size]
+        chunks = [(offset, min(length, size - offset)) for offset, length in chunks if offset < size]
+        return self._stream(src, dst, chunks, zeros)
+
+
+def wire_backend(backend, target_conf, mode=None):
+    """
+    按传输模式包装后端
+    :param mode: None / inprocess / relay，为空时取 config.WIRE_TRANSFER
+    """
+    mode = mode or config.WIRE_TRANSFER
+    if not mode:
+        return backend
+    if not backend.supports_streaming:
+        logging.warning(f"[MIGRATION] {backend.name} 后端不支持帧格式传输，使用直连复制")
+        return backend
+    if mode == 'inprocess':
+        # 数据在本进程内解码后直接写入目标集群，压缩没有收益
+        relay_backend = RelayBackend(backend, target_conf)
+    elif mode == 'relay':
+        if not config.RELAY_TLS_CA and not _is_loopback(config.RELAY_ADDRESS.rsplit(':', 1)[0]):
+            logging.warning(f"[MIGRATION] 未设置 RELAY_TLS_CA，到中继 {config.RELAY_ADDRESS} 的口令与数据以明文传输")
+        relay_backend = RelayBackend(backend, target_conf, config.RELAY_ADDRESS, resolve_codec(config.WIRE_COMPRESSION),
+                                     config.WIRE_COMPRESSION_LEVEL, token=config.RELAY_TOKEN)
+    else:
+        raise RbdBackendError(f"不支持的传输模式: {mode}")
+    return InstrumentedBackend(relay_backend)
+
+
+class _RelayRequestHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        # TLS 握手在处理线程中完成，不阻塞接受连接
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.do_handshake()
+        super().setup()
+
+    def handle(self):
+        self.server.relay_handler.handle(self.rfile, self.wfile)
+
+
+class RelayServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, relay_handler, ssl_context=None):
+        self.relay_handler = relay_handler
+        self.ssl_context = ssl_context
+        super().__init__(address, _RelayRequestHandler)
+
+    def handle_error(self, request, client_address):
+        # 例如未使用 TLS 的客户端连接，只记录一行日志
+        logging.error(f"[MIGRATION] 中继处理来自 {client_address[0]} 的连接出错: {sys.exc_info()[1]}")
+
+    def get_request(self):
+        sock, address = super().get_request()
+        if self.ssl_context is not None:
+            sock = self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+
+def _is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RBD 帧格式传输中继，运行在目标数据中心")
+    parser.add_argument('--conf', required=True, help="目标 Ceph 集群配置文件")
+    parser.add_argument('--listen', default="127.0.0.1:7700", help="监听地址 host:port，非本机地址需同时指定 --token 与 TLS 证书")
+    parser.add_argument('--backend', default='librbd', help="RBD 后端（librbd / fake）")
+    parser.add_argument('--token', default=os.environ.get('RELAY_TOKEN') or config.RELAY_TOKEN, help="共享口令")
+    parser.add_argument('--tls-cert', help="TLS 证书（PEM）")
+    parser.add_argument('--tls-key', help="TLS 私钥（PEM）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    host, port = args.listen.rsplit(':', 1)
+    if not _is_loopback(host) and not (args.token and args.tls_cert):
+        parser.error("监听非本机地址时必须指定 --token 与 --tls-cert/--tls-key")
+    ssl_context = None
+    if args.tls_cert:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(args.tls_cert, args.tls_key)
+    server = RelayServer((host, int(port)), RelayHandler(get_rbd_backend(args.backend), args.conf, args.token),
+                         ssl_context)
+    logging.info(f"[MIGRATION] 中继服务已启动，监听 {args.listen}，目标集群 {args.conf}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+两级迁移调度：虚拟机创建阶段与 RBD 数据复制阶段各自限流。
+某台虚拟机的目标端创建完成后，它的卷立即进入全局复制队列，
+复制任务在总数、源存储池、目标存储池三个上限都有空余时才开始，
+不同虚拟机的创建与复制因此可以重叠，而不会因嵌套线程池产生 并发数² 个复制流。
+"""
+import logging
+import threading
+import concurrent.futures
+from contextlib import contextmanager
+import config
+from metrics import ACTIVE_WORKERS
+
+
+class _CopyTask:
+    def __init__(self, source_pool, target_pool, fn, args):
+        self.source_pool = source_pool
+        self.target_pool = target_pool
+        self.fn = fn
+        self.args = args
+        self.future = concurrent.futures.Future()
+
+
+class MigrationScheduler:
+    def __init__(self, provision_limit=None, copy_limit=None, per_source_pool=None, per_target_pool=None):
+        self.provision_limit = provision_limit or config.PROVISION_CONCURRENCY
+        self.copy_limit = copy_limit or config.COPY_CONCURRENCY
+        self.per_source_pool = per_source_pool or config.COPY_PER_SOURCE_POOL
+        self.per_target_pool = per_target_pool or config.COPY_PER_TARGET_POOL
+        self._provision = threading.BoundedSemaphore(self.provision_limit)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._running = 0
+        self._source_running = {}
+        self._target_running = {}
+        # 线程数等于复制总上限，派发时已保证不超限，工作线程不会阻塞在存储池上限上
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.copy_limit,
+                                                               thread_name_prefix='rbd-copy')
+
+    @contextmanager
+    def provisioning(self):
+        """虚拟机创建阶段占用一个名额"""
+        with self._provision:
+            with ACTIVE_WORKERS.track_inprogress(kind='provision'):
+                yield
+
+    def submit_copy(self, source_pool, target_pool, fn, *args):
+        """
+        提交一个卷的复制任务
+        :return: Future，结果为 fn 的返回值
+        """
+        task = _CopyTask(source_pool, target_pool, fn, args)
+        with self._lock:
+            self._pending.append(task)
+            self._dispatch()
+        return task.future
+
+    def _can_start(self, task):
+        return (self._running < self.copy_limit
+                and self._source_running.get(task.source_pool, 0) < self.per_source_pool
+                and self._target_running.get(task.target_pool, 0) < self.per_target_pool)
+
+    def _dispatch(self):
+        # 按提交顺序派发，某个存储池满时跳过它的任务，不阻塞其它存储池
+        for task in list(self._pending):
+            if self._running >= self.copy_limit:
+                break
+            if not self._can_start(task):
+                continue
+            self._pending.remove(task)
+            self._running += 1
+            self._source_running[task.source_pool] = self._source_running.get(task.source_pool, 0) + 1
+            self._target_running[task.target_pool] = self._target_running.get(task.target_pool, 0) + 1
+            self._executor.submit(self._run, task)
+
+    def _run(self, task):
+        try:
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    task.future.set_result(task.fn(*task.args))
+                except Exception as e:
+                    logging.error(f"[MIGRATION] 复制任务执行出错: {e}")
+                    task.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._source_running[task.source_pool] -= 1
+                self._target_running[task.target_pool] -= 1
+                self._dispatch()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
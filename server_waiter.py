@@ -0,0 +1,140 @@
+"""
+虚拟机状态等待服务：每个云环境一个轮询线程，把所有等待中的虚拟机合并成一次
+servers(details=True, changes_since=...) 列表调用，状态到达后完成对应的 Future，
+无变化时按倍数放大轮询间隔，超过截止时间的等待以 ServerWaitTimeout 结束。
+"""
+import logging
+import threading
+import time
+import concurrent.futures
+from datetime import datetime, timedelta, timezone
+import config
+
+# 列表调用的 changes-since 向前多取一段时间，避免时钟偏差漏掉变更
+CLOCK_SKEW = timedelta(seconds=60)
+BACKOFF_FACTOR = 1.5
+
+
+class ServerWaitTimeout(Exception):
+    pass
+
+
+class _Waiter:
+    def __init__(self, server_id, statuses, deadline):
+        self.server_id = server_id
+        self.statuses = statuses
+        self.deadline = deadline
+        self.future = concurrent.futures.Future()
+
+
+class ServerWaiter:
+    def __init__(self, conn, min_interval=None, max_interval=None):
+        self.conn = conn
+        self.min_interval = min_interval or config.SERVER_WAIT_MIN_INTERVAL
+        self.max_interval = max_interval or config.SERVER_WAIT_MAX_INTERVAL
+        self._cond = threading.Condition()
+        self._waiters = {}
+        self._thread = None
+        self._interval = self.min_interval
+
+    def watch(self, server_id, statuses, timeout=None):
+        """
+        :param statuses: 任一状态到达即完成，例如 ('ACTIVE', 'ERROR')
+        :param timeout: 超时时间（秒），为空时不限
+        :return: Future，结果为到达目标状态时的虚拟机；虚拟机被删除时结果为状态 DELETED 的虚拟机
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        waiter = _Waiter(server_id, set(statuses) | {'DELETED'}, deadline)
+        # 登记前可能已经到达目标状态，先单独查询一次
+        server = self.conn.compute.get_server(server_id)
+        if server.status in waiter.statuses:
+            waiter.future.set_result(server)
+            return waiter.future
+        with self._cond:
+            self._waiters.setdefault(server_id, []).append(waiter)
+            self._interval = self.min_interval
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._poll, name='server-waiter', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return waiter.future
+
+    def wait(self, server_id, statuses, timeout=None):
+        """阻塞等待，超时抛出 ServerWaitTimeout"""
+        return self.watch(server_id, statuses, timeout).result()
+
+    def _resolve(self, server):
+        waiters = self._waiters.get(server.id)
+        if not waiters:
+            return False
+        remaining = [w for w in waiters if server.status not in w.statuses]
+        for waiter in waiters:
+            if server.status in waiter.statuses:
+                waiter.future.set_result(server)
+        if remaining:
+            self._waiters[server.id] = remaining
+        else:
+            del self._waiters[server.id]
+        return len(remaining) < len(waiters)
+
+    def _expire(self):
+        now = time.monotonic()
+        for server_id in list(self._waiters):
+            waiters = self._waiters[server_id]
+            for waiter in waiters:
+                if waiter.deadline is not None and now >= waiter.deadline:
+                    waiter.future.set_exception(ServerWaitTimeout(
+                        f"等待虚拟机 {server_id} 进入 {sorted(waiter.statuses)} 超时"))
+            waiters = [w for w in waiters if not w.future.done()]
+            if waiters:
+                self._waiters[server_id] = waiters
+            else:
+                del self._waiters[server_id]
+
+    def _poll(self):
+        since = datetime.now(timezone.utc)
+        while True:
+            with self._cond:
+                self._expire()
+                if not self._waiters:
+                    self._thread = None
+                    return
+                deadlines = [w.deadline for ws in self._waiters.values() for w in ws if w.deadline is not None]
+                delay = self._interval
+                if deadlines:
+                    delay = max(0, min(delay, min(deadlines) - time.monotonic()))
+                self._cond.wait(delay)
+                self._expire()
+                if not self._waiters:
+                    continue
+            polled_at = datetime.now(timezone.utc)
+            changes_since = (since - CLOCK_SKEW).strftime('%Y-%m-%dT%H:%M:%SZ')
+            try:
+                servers = list(self.conn.compute.servers(details=True, changes_since=changes_since))
+            except Exception as e:
+                logging.warning(f"[MIGRATION] 查询虚拟机状态出错: {e}")
+                with self._cond:
+                    self._interval = min(self._interval * BACKOFF_FACTOR, self.max_interval)
+                continue
+            since = polled_at
+            with self._cond:
+                resolved = False
+                for server in servers:
+                    resolved = self._resolve(server) or resolved
+                if resolved:
+                    self._interval = self.min_interval
+                else:
+                    self._interval = min(self._interval * BACKOFF_FACTOR, self.max_interval)
+
+
+_lock = threading.Lock()
+_waiters = {}
+
+
+def get_server_waiter(conn):
+    """同一个（连接池共享的）连接只使用一个轮询线程"""
+    with _lock:
+        waiter = _waiters.get(id(conn))
+        if waiter is None or waiter.conn is not conn:
+            waiter = _waiters[id(conn)] = ServerWaiter(conn)
+        return waiter
@@ -0,0 +1,209 @@
+"""
+跨数据中心传输的帧格式：
+  流头   magic(4s) version(B) codec(B)
+  数据帧 type=1(B) offset(Q) raw_length(I) payload_length(I) flags(B) payload
+  零帧   type=2(B) offset(Q) length(Q)          —— 全零区域只传区间，不传数据
+  结束帧 type=3(B) raw_bytes(Q) frames(Q)        —— 接收端据此确认流完整
+数据帧负载按流头指定的压缩算法压缩，压缩后不更小时原样发送（flags 第 0 位为 0）。
+压缩算法优先 zstd / lz4（需安装 zstandard / lz4），不可用时退回标准库 zlib。
+"""
+import logging
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+MAGIC = b'VMRS'
+VERSION = 1
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_LZ4 = 3
+CODEC_NAMES = {'none': CODEC_NONE, 'zlib': CODEC_ZLIB, 'zstd': CODEC_ZSTD, 'lz4': CODEC_LZ4}
+
+FRAME_DATA = 1
+FRAME_ZERO = 2
+FRAME_END = 3
+FLAG_COMPRESSED = 0x01
+
+_STREAM_HEADER = struct.Struct('>4sBB')
+_DATA_HEADER = struct.Struct('>QIIB')
+_ZERO_HEADER = struct.Struct('>QQ')
+_END_HEADER = struct.Struct('>QQ')
+_TYPE = struct.Struct('>B')
+
+# 零区段识别粒度：小于该长度的零不单独成帧
+ZERO_BLOCK = 64 * 1024
+
+
+class StreamFormatError(Exception):
+    """帧流格式错误或不完整"""
+
+
+def _codec_available(codec):
+    return codec in (CODEC_NONE, CODEC_ZLIB) or (codec == CODEC_ZSTD and zstandard is not None) \
+        or (codec == CODEC_LZ4 and lz4_frame is not None)
+
+
+def resolve_codec(name):
+    """:return: 压缩算法编号，请求的算法未安装时退回 zlib"""
+    codec = CODEC_NAMES.get(name or 'none')
+    if codec is None:
+        raise StreamFormatError(f"不支持的压缩算法: {name}")
+    if not _codec_available(codec):
+        logging.warning(f"[MIGRATION] 压缩算法 {name} 未安装，改用 zlib")
+        codec = CODEC_ZLIB
+    return codec
+
+
+def _compressor(codec, level):
+    if codec == CODEC_ZLIB:
+        return lambda data: zlib.compress(data, level if level is not None else 1)
+    if codec == CODEC_ZSTD:
+        compressor = zstandard.ZstdCompressor(level=level if level is not None else 3)
+        return compressor.compress
+    if codec == CODEC_LZ4:
+        return lambda data: lz4_frame.compress(data, compression_level=level or 0)
+    return None
+
+
+def _decompressor(codec):
+    """:return: decompress(payload, raw_length)"""
+    if codec == CODEC_ZLIB:
+        return lambda data, raw_length: zlib.decompress(data)
+    if codec == CODEC_ZSTD:
+        decompressor = zstandard.ZstdDecompressor()
+        return lambda data, raw_length: decompressor.decompress(data, max_output_size=raw_length)
+    if codec == CODEC_LZ4:
+        return lambda data, raw_length: lz4_frame.decompress(data)
+    return None
+
+
+def zero_runs(data, block=ZERO_BLOCK):
+    """
+    把 data 按 block 粒度切分为交替的数据段和零段
+    :return: [(相对偏移, 长度, 是否全零), ...]
+    """
+    segments = []
+    view = memoryview(data)
+    zero_block = bytes(block)
+    for start in range(0, len(data), block):
+        piece = view[start:start + block]
+        is_zero = piece == zero_block[:len(piece)]
+        if segments and segments[-1][2] == is_zero:
+            offset, length, _ = segments[-1]
+            segments[-1] = (offset, length + len(piece), is_zero)
+        else:
+            segments.append((start, len(piece), is_zero))
+    return segments
+
+
+class FrameWriter:
+    def __init__(self, stream, codec=CODEC_NONE, level=None):
+        self.stream = stream
+        self.codec = codec
+        self._compress = _compressor(codec, level)
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.zero_bytes = 0
+        self.frames = 0
+        self._write(_STREAM_HEADER.pack(MAGIC, VERSION, codec))
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.wire_bytes += len(data)
+
+    def zero(self, offset, length):
+        self._write(_TYPE.pack(FRAME_ZERO) + _ZERO_HEADER.pack(offset, length))
+        self.raw_bytes += length
+        self.zero_bytes += length
+        self.frames += 1
+
+    def _data(self, offset, data):
+        payload, flags = data, 0
+        if self._compress is not None:
+            compressed = self._compress(bytes(data))
+            if len(compressed) < len(data):
+                payload, flags = compressed, FLAG_COMPRESSED
+        self._write(_TYPE.pack(FRAME_DATA) + _DATA_HEADER.pack(offset, len(data), len(payload), flags))
+        self._write(payload)
+        self.raw_bytes += len(data)
+        self.frames += 1
+
+    def write(self, offset, data):
+        """写入一段数据，其中的零区段自动转为零帧"""
+        view = memoryview(data)
+        for start, length, is_zero in zero_runs(data):
+            if is_zero:
+                self.zero(offset + start, length)
+            else:
+                self._data(offset + start, view[start:start + length])
+
+    def close(self):
+        self._write(_TYPE.pack(FRAME_END) + _END_HEADER.pack(self.raw_bytes, self.frames))
+        self.stream.flush()
+
+
+class FrameReader:
+    """按顺序产出 ('data', offset, bytes) 与 ('zero', offset, length)，读到结束帧后停止"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        magic, version, codec = _STREAM_HEADER.unpack(self._read(_STREAM_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise StreamFormatError(f"无法识别的帧流: magic={magic!r} version={version}")
+        if not _codec_available(codec):
+            raise StreamFormatError(f"接收端未安装帧流使用的压缩算法 {codec}")
+        self.codec = codec
+        self._decompress = _decompressor(codec)
+        self.raw_bytes = 0
+        self.frames = 0
+
+    def _read(self, size):
+        if not size:
+            return b""
+        data = self.stream.read(size)
+        while data is not None and 0 < len(data) < size:
+            more = self.stream.read(size - len(data))
+            if not more:
+                break
+            data += more
+        if not data or len(data) != size:
+            raise StreamFormatError("帧流在结束帧之前中断")
+        return data
+
+    def __iter__(self):
+        while True:
+            frame_type, = _TYPE.unpack(self._read(_TYPE.size))
+            if frame_type == FRAME_DATA:
+                offset, raw_length, payload_length, flags = _DATA_HEADER.unpack(self._read(_DATA_HEADER.size))
+                payload = self._read(payload_length)
+                if flags & FLAG_COMPRESSED:
+                    payload = self._decompress(payload, raw_length)
+                if len(payload) != raw_length:
+                    raise StreamFormatError(f"偏移 {offset} 的数据帧长度不符: {len(payload)} != {raw_length}")
+                self.raw_bytes += raw_length
+                self.frames += 1
+                yield 'data', offset, payload
+            elif frame_type == FRAME_ZERO:
+                offset, length = _ZERO_HEADER.unpack(self._read(_ZERO_HEADER.size))
+                self.raw_bytes += length
+                self.frames += 1
+                yield 'zero', offset, length
+            elif frame_type == FRAME_END:
+                raw_bytes, frames = _END_HEADER.unpack(self._read(_END_HEADER.size))
+                if (raw_bytes, frames) != (self.raw_bytes, self.frames):
+                    raise StreamFormatError(f"帧流不完整: 收到 {self.frames} 帧 {self.raw_bytes} 字节，"
+                                            f"发送端为 {frames} 帧 {raw_bytes} 字节")
+                return
+            else:
+                raise StreamFormatError(f"未知的帧类型 {frame_type}")
@@ -0,0 +1,286 @@
+"""
+Ceph 传输限速：按 源集群 / 目标集群 / 单个卷 三个范围分别维护字节/秒与请求/秒令牌桶。
+限速值依次取 config.THROTTLE_LIMITS、当前命中的分时段配置 THROTTLE_PROFILES、运行时通过 /throttle 设置的覆盖值。
+迁移清单按虚拟机指定的 bandwidth_class 通过 set_volume_limits 设置，复制期间替代该卷的 volume 限速。
+librbd 后端在每次读写前取令牌；命令行后端无法逐块控制，改为给 rbd export/import 传入 librbd QoS 参数。
+"""
+import copy
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import config
+from metrics import THROTTLE_WAIT_SECONDS
+
+SCOPES = ('source', 'target', 'volume')
+KINDS = ('bytes', 'ops')
+# 分时段配置按该间隔重新评估
+PROFILE_CHECK_INTERVAL = 30
+
+
+class TokenBucket:
+    def __init__(self, rate=None, burst_seconds=None):
+        self.burst_seconds = config.THROTTLE_BURST_SECONDS if burst_seconds is None else burst_seconds
+        self._lock = threading.Lock()
+        self.rate = None
+        self._tokens = 0.0
+        self._updated_at = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate or None
+            if self.rate:
+                self._tokens = min(self._tokens, self.rate * self.burst_seconds)
+
+    def _refill(self, now):
+        if self.rate:
+            self._tokens = min(self._tokens + (now - self._updated_at) * self.rate, self.rate * self.burst_seconds)
+        self._updated_at = now
+
+    def consume(self, amount):
+        """
+        取走 amount 个令牌，不足时允许透支并阻塞到透支补足，单次请求大于桶容量也不会卡死
+        :return: 等待的秒数
+        """
+        with self._lock:
+            if not self.rate:
+                return 0
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def _parse_clock(value):
+    hour, minute = value.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def _profile_active(profile, now):
+    weekdays = profile.get('weekdays')
+    if weekdays and now.weekday() not in weekdays:
+        return False
+    start, end, minute = _parse_clock(profile['start']), _parse_clock(profile['end']), now.hour * 60 + now.minute
+    if start <= end:
+        return start <= minute < end
+    # 跨零点的时段
+    return minute >= start or minute < end
+
+
+def validate_limits(limits):
+    """
+    :param limits: {'source': {'bytes': 100 * 1024 ** 2, 'ops': None}, ...}
+    :raise ValueError: 范围、类型或数值不合法
+    """
+    if not isinstance(limits, dict):
+        raise ValueError("限速配置必须是对象")
+    for scope, values in limits.items():
+        if scope not in SCOPES:
+            raise ValueError(f"未知的限速范围: {scope}")
+        if not isinstance(values, dict):
+            raise ValueError(f"{scope} 的限速配置必须是对象")
+        for kind, value in values.items():
+            if kind not in KINDS:
+                raise ValueError(f"未知的限速类型: {scope}.{kind}")
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0):
+                raise ValueError(f"{scope}.{kind} 必须为正数或 null")
+
+
+class Transfer:
+    """一个卷的一次复制，读写前从对应的令牌桶取令牌"""
+
+    def __init__(self, manager, source, target, volume):
+        self._manager = manager
+        self.source = source
+        self.target = target
+        self.volume = volume
+
+    def read(self, nbytes, ops=1):
+        self._manager.consume('source', self.source, nbytes, ops)
+        self._manager.consume('volume', self.volume, nbytes, ops)
+
+    def write(self, nbytes, ops=1):
+        self._manager.consume('target', self.target, nbytes, ops)
+
+    def qos_args(self, side):
+        """
+        命令行后端使用的 librbd QoS 参数：集群限速按该集群当前的传输数平分，再与单卷限速取较小值
+        :param side: 'source' 对应 rbd export，'target' 对应 rbd import
+        """
+        limits = self._manager.limits()
+        limits['volume'] = self._manager.volume_limits(self.volume, limits['volume'])
+        shares = self._manager.active_transfers(side, self.source if side == 'source' else self.target)
+        args = ""
+        for kind, option in (('bytes', 'rbd_qos_bps_limit'), ('ops', 'rbd_qos_iops_limit')):
+            candidates = []
+            if limits[side][kind]:
+                candidates.append(limits[side][kind] / max(1, shares))
+            if side == 'source' and limits['volume'][kind]:
+                candidates.append(limits['volume'][kind])
+            if candidates:
+                args += f" --{option} {max(1, int(min(candidates)))}"
+        return args
+
+
+class ThrottleManager:
+    def __init__(self, limits=None, profiles=None):
+        self.base_limits = copy.deepcopy(config.THROTTLE_LIMITS if limits is None else limits)
+        self.profiles = list(config.THROTTLE_PROFILES if profiles is None else profiles)
+        self._lock = threading.Lock()
+        self._overrides = {}
+        # 按卷指定的限速（迁移清单的 bandwidth_class），优先于 volume 范围的全局限速
+        self._volume_limits = {}
+        self._buckets = {}
+        self._active = {}
+        self._effective = None
+        self._profile = None
+        self._checked_at = None
+
+    def _evaluate(self):
+        limits = copy.deepcopy(self.base_limits)
+        for scope in SCOPES:
+            limits.setdefault(scope, {})
+            for kind in KINDS:
+                limits[scope].setdefault(kind, None)
+        profile_name = None
+        now = datetime.now()
+        for profile in self.profiles:
+            if _profile_active(profile, now):
+                profile_name = profile.get('name')
+                for scope, values in profile.get('limits', {}).items():
+                    limits[scope].update(values)
+                break
+        for scope, values in self._overrides.items():
+            limits[scope].update(values)
+        return limits, profile_name
+
+    def _refresh(self, force=False):
+        """重新计算生效的限速值并更新所有令牌桶，调用方持有 self._lock"""
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < PROFILE_CHECK_INTERVAL:
+            return
+        limits, profile_name = self._evaluate()
+        self._checked_at = now
+        if profile_name != self._profile:
+            logging.info(f"[MIGRATION] 限速时段切换为 {profile_name or '默认'}")
+            self._profile = profile_name
+        if limits != self._effective:
+            self._effective = limits
+            for (scope, key, kind), bucket in self._buckets.items():
+                bucket.set_rate(self._rate(scope, key, kind))
+
+    def _rate(self, scope, key, kind):
+        if scope == 'volume' and key in self._volume_limits:
+            return self._volume_limits[key].get(kind)
+        return self._effective[scope][kind]
+
+    def set_volume_limits(self, volume, limits):
+        """
+        :param volume: 卷标识，与 transfer() 的 volume 参数一致
+        :param limits: {'bytes': ..., 'ops': ...}，为 None 时恢复全局限速
+        """
+        with self._lock:
+            self._refresh()
+            if limits is None:
+                self._volume_limits.pop(volume, None)
+            else:
+                self._volume_limits[volume] = dict(limits)
+            for kind in KINDS:
+                bucket = self._buckets.get(('volume', volume, kind))
+                if bucket is not None:
+                    bucket.set_rate(self._rate('volume', volume, kind))
+
+    def volume_limits(self, volume, default):
+        with self._lock:
+            return dict(self._volume_limits.get(volume, default))
+
+    def limits(self):
+        with self._lock:
+            self._refresh()
+            return copy.deepcopy(self._effective)
+
+    def status(self):
+        with self._lock:
+            self._refresh()
+            return {
+                'profile': self._profile,
+                'limits': copy.deepcopy(self._effective),
+                'overrides': copy.deepcopy(self._overrides),
+                'active_transfers': {f"{scope}:{key}": count for (scope, key), count in self._active.items()},
+            }
+
+    def set_limits(self, limits):
+        """运行时覆盖限速值，未给出的项保持不变，值为 None 表示该项不限速"""
+        validate_limits(limits)
+        with self._lock:
+            for scope, values in limits.items():
+                self._overrides.setdefault(scope, {}).update(values)
+            self._refresh(force=True)
+        logging.info(f"[MIGRATION] 限速已调整: {limits}")
+
+    def clear_overrides(self):
+        with self._lock:
+            self._overrides = {}
+            self._refresh(force=True)
+        logging.info("[MIGRATION] 已清除运行时限速设置")
+
+    def consume(self, scope, key, nbytes, ops=1):
+        with self._lock:
+            self._refresh()
+            buckets = []
+            for kind, amount in (('bytes', nbytes), ('ops', ops)):
+                rate = self._rate(scope, key, kind)
+                if rate:
+                    bucket = self._buckets.get((scope, key, kind))
+                    if bucket is None:
+                        bucket = self._buckets[(scope, key, kind)] = TokenBucket(rate)
+                    buckets.append((kind, bucket, amount))
+        for kind, bucket, amount in buckets:
+            waited = bucket.consume(amount)
+            if waited:
+                THROTTLE_WAIT_SECONDS.inc(waited, scope=scope, kind=kind)
+
+    def active_transfers(self, scope, key):
+        with self._lock:
+            return self._active.get((scope, key), 0)
+
+    @contextmanager
+    def transfer(self, source, target, volume):
+        """
+        :param source: 源集群标识 rbd_backend.cluster_id()，同一集群的所有任务共用一个令牌桶
+        :param target: 目标集群标识
+        :param volume: 卷标识
+        """
+        keys = (('source', source), ('target', target), ('volume', volume))
+        with self._lock:
+            for key in keys:
+                self._active[key] = self._active.get(key, 0) + 1
+        try:
+            yield Transfer(self, source, target, volume)
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._active[key] -= 1
+                    if not self._active[key]:
+                        del self._active[key]
+                # 卷结束后丢弃它的令牌桶
+                if ('volume', volume) not in self._active:
+                    for kind in KINDS:
+                        self._buckets.pop(('volume', volume, kind), None)
+
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+
+def get_throttle():
+    global _throttle
+    with _throttle_lock:
+        if _throttle is None:
+            _throttle = ThrottleManager()
+        return _throttle
@@ -0,0 +1,292 @@
+"""
+多副本模式的共享工作队列：迁移任务按虚拟机拆成工作项，多个 Pod 从同一个队列领取。
+领取时获得有期限的租约，持有者定期续约；Pod 崩溃后租约过期，工作项由其他 Pod 重新领取。
+工作项带就近标签（源/目标 ceph 集群、目标可用区），标签与 Pod 相交时优先领取（见 config.WORKER_LOCALITY）。
+
+默认实现 SqliteWorkQueue 把队列放在共享卷上的 SQLite 中：SQLite 在网络文件系统上不能使用 WAL，
+这里使用默认的回滚日志，领取在 BEGIN IMMEDIATE 事务中完成；工作项以虚拟机为粒度，写入频率很低。
+任务规格中含源/目标云的认证信息，数据库文件权限设为仅属主可读写，任务结束后删除。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+import config
+
+WORK_PENDING = 'pending'
+WORK_LEASED = 'leased'
+WORK_DONE = 'done'
+WORK_FAILED = 'failed'
+WORK_CANCELLED = 'cancelled'
+TERMINAL_STATUSES = (WORK_DONE, WORK_FAILED, WORK_CANCELLED)
+
+# 每次领取时按优先级取出的候选工作项数量，在其中按就近标签挑选
+CLAIM_CANDIDATES = 64
+
+# payload: 执行这台虚拟机所需的清单字段；attempts: 含本次在内的执行次数
+WorkItem = namedtuple('WorkItem', ['id', 'job_id', 'vm_name', 'payload', 'priority', 'labels', 'attempts'])
+
+
+class WorkQueue:
+    """
+    工作队列接口，其他代理（如 Redis、数据库服务）实现同样的方法即可替换 SqliteWorkQueue
+    """
+
+    def put_job(self, job_id, spec):
+        """登记任务规格（MigrationManager.to_spec()），工作 Pod 据此构造 MigrationManager"""
+        raise NotImplementedError
+
+    def job_spec(self, job_id):
+        """:return: 任务规格，任务不存在或已结束时返回 None"""
+        raise NotImplementedError
+
+    def active_jobs(self):
+        """:return: 仍在登记中的任务 ID 集合"""
+        raise NotImplementedError
+
+    def enqueue(self, job_id, items):
+        """:param items: [(vm_name, payload, priority, labels), ...]，同优先级按入队顺序领取"""
+        raise NotImplementedError
+
+    def claim(self, owner, labels=()):
+        """:return: 领取到的 WorkItem，没有可领取的工作项时返回 None"""
+        raise NotImplementedError
+
+    def renew(self, owner, item_ids):
+        """:return: 续约成功（仍由 owner 持有）的工作项 ID 集合"""
+        raise NotImplementedError
+
+    def complete(self, item_id, owner, error=None, cancelled=False, attempt=None):
+        """
+        :param cancelled: 任务已取消，领取后未执行
+        :param attempt: 本次执行的序号（WorkItem.attempts），给出时只有仍是这一次执行持有租约才记录
+        :return: 结果是否被记录，租约已被其他 Pod 接手时返回 False
+        """
+        raise NotImplementedError
+
+    def release(self, item_id, attempt):
+        """失去租约的持有者确认第 attempt 次执行已经停止，不会再写目标端资源"""
+        raise NotImplementedError
+
+    def released(self, item_id):
+        """:return: 已确认停止的最大执行序号，0 表示没有"""
+        raise NotImplementedError
+
+    def cancel_job(self, job_id):
+        """:return: 任务是否存在；尚未领取的工作项不再执行，已领取的执行完"""
+        raise NotImplementedError
+
+    def is_cancelled(self, job_id):
+        raise NotImplementedError
+
+    def job_items(self, job_id):
+        """:return: [{'vm_name', 'status', 'owner', 'attempts', 'error'}, ...]"""
+        raise NotImplementedError
+
+    def finish_job(self, job_id):
+        """任务结束，删除任务规格（含认证信息）与工作项"""
+        raise NotImplementedError
+
+    def status(self):
+        """:return: 各状态的工作项数量与各 Pod 持有的租约数"""
+        raise NotImplementedError
+
+
+class SqliteWorkQueue(WorkQueue):
+    """
+    :param path: 数据库路径，默认 config.WORK_QUEUE_DB；":memory:" 为进程内队列
+    """
+
+    def __init__(self, path=None, lease_seconds=None, max_attempts=None, locality_wait=None):
+        self.path = path or config.WORK_QUEUE_DB
+        self.lease_seconds = lease_seconds or config.LEASE_SECONDS
+        self.max_attempts = max_attempts or config.LEASE_MAX_ATTEMPTS
+        self.locality_wait = config.LOCALITY_WAIT_SECONDS if locality_wait is None else locality_wait
+        self._lock = threading.Lock()
+        # 事务显式开启，领取时用 BEGIN IMMEDIATE 先拿到写锁，多个 Pod 不会领到同一个工作项
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS work_jobs (
+                job_id TEXT PRIMARY KEY,
+                spec TEXT NOT NULL,
+                cancelled INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS work_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                vm_name TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                labels TEXT NOT NULL,
+                status TEXT NOT NULL,
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                released INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_work_items_claim ON work_items (status, priority, id);
+            CREATE INDEX IF NOT EXISTS idx_work_items_job ON work_items (job_id);
+        """)
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(work_items)")}
+        if 'released' not in columns:
+            self._conn.execute("ALTER TABLE work_items ADD COLUMN released INTEGER NOT NULL DEFAULT 0")
+        if self.path != ':memory:':
+            os.chmod(self.path, 0o600)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def put_job(self, job_id, spec):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO work_jobs (job_id, spec, created_at) VALUES (?, ?, ?)",
+                         (job_id, json.dumps(spec, ensure_ascii=False), time.time()))
+
+    def job_spec(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT spec FROM work_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row['spec']) if row else None
+
+    def active_jobs(self):
+        with self._lock:
+            return {row['job_id'] for row in self._conn.execute("SELECT job_id FROM work_jobs")}
+
+    def enqueue(self, job_id, items):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO work_items (job_id, vm_name, payload, priority, labels, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(job_id, vm_name, json.dumps(payload, ensure_ascii=False), priority, json.dumps(sorted(labels)),
+                  WORK_PENDING, now, now) for vm_name, payload, priority, labels in items])
+
+    def _claimable(self, row, labels, now):
+        """Pod 未设置标签时不区分远近；否则只领取标签相交的工作项，其余等入队超过 locality_wait 秒后再领取"""
+        if not labels:
+            return True
+        item_labels = json.loads(row['labels'])
+        return not item_labels or bool(labels.intersection(item_labels)) or \
+            now - row['created_at'] >= self.locality_wait
+
+    def claim(self, owner, labels=()):
+        labels = set(labels)
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT * FROM work_items WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                "ORDER BY priority DESC, id LIMIT ?", (WORK_PENDING, WORK_LEASED, now, CLAIM_CANDIDATES)).fetchall()
+            for row in rows:
+                if row['status'] == WORK_LEASED:
+                    if row['attempts'] >= self.max_attempts:
+                        conn.execute("UPDATE work_items SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                                     (WORK_FAILED, f"租约过期 {row['attempts']} 次，最后持有者 {row['owner']}", now,
+                                      row['id']))
+                        logging.error(f"[MIGRATION] 虚拟机 {row['vm_name']} 已执行 {row['attempts']} 次均未完成，不再重试")
+                        continue
+                    if not self._claimable(row, labels, now):
+                        continue
+                    logging.warning(f"[MIGRATION] {row['owner']} 持有的虚拟机 {row['vm_name']} 租约已过期，由 {owner} 接手")
+                elif not self._claimable(row, labels, now):
+                    continue
+                conn.execute("UPDATE work_items SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                             "updated_at = ? WHERE id = ?",
+                             (WORK_LEASED, owner, now + self.lease_seconds, now, row['id']))
+                return WorkItem(row['id'], row['job_id'], row['vm_name'], json.loads(row['payload']),
+                                row['priority'], json.loads(row['labels']), row['attempts'] + 1)
+        return None
+
+    def renew(self, owner, item_ids):
+        if not item_ids:
+            return set()
+        item_ids = list(item_ids)
+        marks = ", ".join("?" * len(item_ids))
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(f"UPDATE work_items SET lease_expires = ?, updated_at = ? "
+                         f"WHERE owner = ? AND status = ? AND id IN ({marks})",
+                         [now + self.lease_seconds, now, owner, WORK_LEASED] + item_ids)
+            rows = conn.execute(f"SELECT id FROM work_items WHERE owner = ? AND status = ? AND id IN ({marks})",
+                                [owner, WORK_LEASED] + item_ids).fetchall()
+        return {row['id'] for row in rows}
+
+    def complete(self, item_id, owner, error=None, cancelled=False, attempt=None):
+        status = WORK_CANCELLED if cancelled else WORK_FAILED if error else WORK_DONE
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE work_items SET status = ?, error = ?, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND owner = ? AND status = ? AND (? IS NULL OR attempts = ?)",
+                (status, error, time.time(), item_id, owner, WORK_LEASED, attempt, attempt))
+        return cursor.rowcount == 1
+
+    def release(self, item_id, attempt):
+        with self._transaction() as conn:
+            conn.execute("UPDATE work_items SET released = MAX(released, ?), updated_at = ? WHERE id = ?",
+                         (attempt, time.time(), item_id))
+
+    def released(self, item_id):
+        with self._lock:
+            row = self._conn.execute("SELECT released FROM work_items WHERE id = ?", (item_id,)).fetchone()
+        return row['released'] if row else 0
+
+    def cancel_job(self, job_id):
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE work_jobs SET cancelled = 1 WHERE job_id = ?", (job_id,))
+            if cursor.rowcount:
+                conn.execute("UPDATE work_items SET status = ?, updated_at = ? WHERE job_id = ? AND status = ?",
+                             (WORK_CANCELLED, time.time(), job_id, WORK_PENDING))
+        return cursor.rowcount == 1
+
+    def is_cancelled(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT cancelled FROM work_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row['cancelled'])
+
+    def job_items(self, job_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT vm_name, status, owner, attempts, error FROM work_items "
+                                      "WHERE job_id = ? ORDER BY id", (job_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def finish_job(self, job_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM work_items WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM work_jobs WHERE job_id = ?", (job_id,))
+
+    def status(self):
+        now = time.time()
+        with self._lock:
+            counts = self._conn.execute("SELECT status, COUNT(*) AS n FROM work_items GROUP BY status").fetchall()
+            leases = self._conn.execute("SELECT owner, COUNT(*) AS n FROM work_items WHERE status = ? AND lease_expires >= ? "
+                                        "GROUP BY owner", (WORK_LEASED, now)).fetchall()
+        return {
+            'items': {row['status']: row['n'] for row in counts},
+            'leases': {row['owner']: row['n'] for row in leases},
+        }
+
+
+_work_queue = None
+_work_queue_lock = threading.Lock()
+
+
+def get_work_queue():
+    global _work_queue
+    with _work_queue_lock:
+        if _work_queue is None:
+            _work_queue = SqliteWorkQueue()
+        return _work_queue